@@ -0,0 +1,147 @@
+"""
+🚦 Admission Control, Deadlines and Load Shedding
+
+Keeps a traffic spike from slowing every request down:
+1. AdmissionController - a bounded number of pipeline requests run at once, a bounded
+   number wait for a slot, and the rest are turned away immediately (429) or after a
+   short wait (503), so clients can retry elsewhere instead of timing out
+2. Deadline - every admitted request carries one; pipeline stages check it, degrade
+   (fewer sub-questions, no compression/reranking) when it gets close, and stop once
+   it has passed
+"""
+
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from metrics import count_event, record
+
+MAX_IN_FLIGHT_REQUESTS = int(os.getenv("MAX_IN_FLIGHT_REQUESTS", "8"))
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", "16"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUEUE_TIMEOUT_SECONDS", "2"))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+# Below this much remaining time, the pipeline switches to its cheaper variants
+DEGRADE_BELOW_SECONDS = float(os.getenv("DEGRADE_BELOW_SECONDS", "10"))
+MAX_SUBQUESTIONS_DEGRADED = int(os.getenv("MAX_SUBQUESTIONS_DEGRADED", "2"))
+
+
+class DeadlineExceeded(Exception):
+    """Raised by a pipeline stage that would start after its request's deadline."""
+
+
+class Overloaded(Exception):
+    """
+    The request was shed by admission control.
+
+    Args:
+        status_code (int): 429 (queue full) or 503 (no slot freed up in time)
+        detail (str): Message for the client
+        retry_after (int): Seconds the client should wait before retrying
+    """
+
+    def __init__(self, status_code, detail, retry_after=1):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+# === Class 1: Request Deadline ===
+class Deadline:
+    """
+    Absolute point in time by which a request must be answered.
+
+    Args:
+        seconds (float): Time budget from now
+        degrade_below (float): Remaining seconds under which `near()` is true
+    """
+
+    def __init__(self, seconds=REQUEST_DEADLINE_SECONDS, degrade_below=DEGRADE_BELOW_SECONDS):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.degrade_below = degrade_below
+
+    def remaining(self) -> float:
+        """Seconds left (never negative)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def near(self) -> bool:
+        """Whether the pipeline should switch to its cheaper variants."""
+        return self.remaining() < self.degrade_below
+
+    def check(self, stage: str):
+        """Raises DeadlineExceeded if the deadline passed before `stage` could start."""
+        if self.expired():
+            raise DeadlineExceeded(f"Request deadline of {self.budget:g}s passed before {stage}")
+
+
+def note_degraded(kind: str):
+    """Counts a degraded stage process-wide and marks it in the current trace."""
+    count_event(f"degraded_{kind}")
+    record(f"degraded_{kind}", True)
+
+
+# === Class 2: Admission Controller ===
+class AdmissionController:
+    """
+    Bounded in-flight request limit with a bounded waiting queue.
+
+    Args:
+        max_in_flight (int): Requests allowed to run the pipeline at the same time
+        max_queued (int): Requests allowed to wait for a slot; beyond that, 429
+        queue_timeout (float): Longest wait for a slot before giving up with 503
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT_REQUESTS, max_queued=MAX_QUEUED_REQUESTS,
+                 queue_timeout=QUEUE_TIMEOUT_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.queued = 0
+
+    @asynccontextmanager
+    async def admit(self, deadline: Deadline):
+        """
+        Holds one in-flight slot for the duration of the `async with` block.
+
+        Raises:
+            Overloaded: When the queue is full, or no slot frees up within
+                `queue_timeout` (or before the deadline, if that comes first)
+        """
+        if self._slots.locked() and self.queued >= self.max_queued:
+            count_event("shed_queue_full")
+            raise Overloaded(429, "Too many requests queued, please retry shortly")
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=min(self.queue_timeout, deadline.remaining()))
+        except asyncio.TimeoutError:
+            count_event("shed_queue_timeout")
+            raise Overloaded(503, "Server is overloaded, please retry shortly",
+                             retry_after=max(1, math.ceil(self.queue_timeout)))
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        count_event("admitted")
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self):
+        """Returns the current load for the metrics endpoint."""
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+        }
@@ -0,0 +1,436 @@
+"""
+⏱️ Offline Pipeline Benchmark
+
+Measures the sports RAG pipeline without OpenAI or a HuggingFace model:
+1. A deterministic fake LLM (numbered sub-questions for decomposition, canned cited answers otherwise)
+2. A hash-based local embedding model (feature hashing of words, no downloads)
+3. A synthetic corpus built from data/sports_documents, scaled to 10k and 1M chunks
+4. Optionally, a search-latency comparison of the Chroma and flat NumPy vector backends
+5. Optionally, a recall@k vs. queries-per-second sweep of the IVF-PQ index against exact search
+
+For every stage it reports latency percentiles, throughput and peak Python memory,
+and writes everything as JSON so runs can be compared between commits.
+
+Run from the backend directory:
+    python benchmark.py [--scales 10000 1000000] [--repeats 20] [--output bench_results.json] [--no-tracemalloc]
+                        [--backend chroma|flat|ivfpq] [--compare-backends] [--ann-sweep]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.schema.messages import AIMessage
+from langchain.schema.runnable import RunnableLambda
+
+from embedding_cache import with_embedding_cache
+from flat_index import NumpyFlatIndex
+from ivfpq_index import IVFPQIndex
+from ingestion import bulk_ingest, ingest_incrementally
+from query_processor import decompose_complex_query, process_single_subquestion, retrieve_for_subquestions
+from vector_db import load_existing_database, retrieve_relevant_documents, upsert_vectors, flush_vector_store
+
+SOURCE_DOCS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sports_documents")
+
+BENCHMARK_QUERIES = [
+    "What are the top 3 teams in defense and their key defensive statistics?",
+    "Compare Messi's goal-scoring rate in the last season vs previous seasons",
+    "Which goalkeeper has the best save percentage in high-pressure situations?",
+    "How did Manchester City's pressing compare to Arsenal's in their last match?",
+    "Which team conceded the fewest goals and who was their goalkeeper?",
+]
+
+
+# === Fake Models ===
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic local embedding model: each word is hashed into one of `dim`
+    buckets with a +/-1 sign, and the result is L2-normalised. Texts sharing
+    words get similar vectors, which is enough to exercise retrieval and scoring.
+
+    Args:
+        dim (int): Vector size (384 matches all-MiniLM-L6-v2)
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.model_name = f"hash-embeddings-{dim}"
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if (digest >> 32) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def make_fake_llm():
+    """
+    Returns a LangChain runnable standing in for the chat model. It answers the
+    decomposition prompt with numbered sub-questions and every other prompt with
+    a short answer citing the first two context entries.
+    """
+    def respond(prompt_value):
+        prompt = prompt_value.to_string()
+        if "Sub-questions (one per line, numbered)" in prompt:
+            query = prompt.split("Complex Query:", 1)[1].split("Sub-questions", 1)[0].strip()
+            parts = [part.strip() for part in re.split(r"\band\b|,|\bvs\b", query) if part.strip()]
+            content = "\n".join(f"{i}. {part.rstrip('?')}?" for i, part in enumerate(parts, 1))
+        else:
+            content = "Based on the statistics provided [1], the answer is supported by [2]."
+        # Roughly one token per four characters, like the real usage metadata
+        return AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": len(prompt) // 4,
+                "output_tokens": len(content) // 4,
+                "total_tokens": (len(prompt) + len(content)) // 4,
+            },
+        )
+
+    return RunnableLambda(respond)
+
+
+# === Synthetic Corpus ===
+def build_synthetic_corpus(target_chunks, out_dir, chunks_per_file=1000, seed=42):
+    """
+    Writes roughly `target_chunks` chunk-sized paragraphs into .txt files, built
+    by shuffling lines from data/sports_documents and randomising their numbers.
+
+    Args:
+        target_chunks (int): Number of ~450 character paragraphs to generate
+        out_dir (str): Folder to write the files into
+        chunks_per_file (int): Paragraphs per file
+        seed (int): Random seed, so every run builds the same corpus
+
+    Returns:
+        str: `out_dir`
+    """
+    rng = random.Random(seed)
+    lines = []
+    for filename in sorted(os.listdir(SOURCE_DOCS_DIR)):
+        with open(os.path.join(SOURCE_DOCS_DIR, filename), "r", encoding="utf-8") as f:
+            lines.extend(line.strip("- ").strip() for line in f if len(line.strip()) > 10)
+
+    os.makedirs(out_dir, exist_ok=True)
+    for file_idx in range(0, target_chunks, chunks_per_file):
+        paragraphs = []
+        for chunk_idx in range(file_idx, min(file_idx + chunks_per_file, target_chunks)):
+            parts = [f"Report {chunk_idx}."]
+            while sum(len(part) for part in parts) < 400:
+                line = rng.choice(lines)
+                parts.append(re.sub(r"\d+(\.\d+)?", lambda _: str(round(rng.uniform(0, 99), 1)), line) + ".")
+            paragraphs.append(" ".join(parts))
+        path = os.path.join(out_dir, f"synthetic_{file_idx // chunks_per_file:06d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs))
+    return out_dir
+
+
+# === Measurement Helpers ===
+def _percentiles(samples_ms):
+    values = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+    }
+
+
+def measure_stage(name, calls, items_per_call=1, quiet=True):
+    """
+    Runs every callable in `calls` once, timing each and tracking peak memory.
+
+    Args:
+        name (str): Stage name used in the report
+        calls (List[Callable[[], Any]]): One zero-argument callable per sample
+        items_per_call (int): Work items per call, for throughput (e.g. chunks)
+        quiet (bool): Swallow the pipeline's console output while measuring
+
+    Returns:
+        Dict: Latency percentiles, throughput and peak memory for the stage
+    """
+    samples_ms = []
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    stage_started = time.perf_counter()
+    for call in calls:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            call()
+        samples_ms.append((time.perf_counter() - started) * 1000)
+    total_s = time.perf_counter() - stage_started
+    peak_bytes = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+
+    result = {
+        "stage": name,
+        "samples": len(samples_ms),
+        **_percentiles(samples_ms),
+        "throughput_per_s": round(len(samples_ms) * items_per_call / total_s, 2) if total_s else 0.0,
+        "peak_python_mb": round(peak_bytes / 2**20, 2) if peak_bytes is not None else None,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+    }
+    print(
+        f"  ⏱️ {name:<28} p50={result['p50_ms']:>9.2f}ms  p95={result['p95_ms']:>9.2f}ms  "
+        f"p99={result['p99_ms']:>9.2f}ms  {result['throughput_per_s']:>10.2f}/s  "
+        f"peak={result['peak_python_mb']}MB"
+    )
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# === Benchmark Runner ===
+def run_scale(target_chunks, repeats, work_dir, workers, backend="chroma"):
+    """Benchmarks ingestion and every query stage against a corpus of `target_chunks` chunks."""
+    print(f"\n📏 Scale: {target_chunks} chunks ({backend} backend)")
+    corpus_dir = build_synthetic_corpus(target_chunks, os.path.join(work_dir, f"corpus_{target_chunks}"))
+    persist_dir = os.path.join(work_dir, f"{backend}_{target_chunks}")
+
+    embeddings = HashEmbeddings()
+    llm = make_fake_llm()
+    stages = []
+    ingest_report = {}
+
+    def full_ingest():
+        _, report = bulk_ingest(corpus_dir, embeddings, persist_dir, num_workers=workers, backend=backend)
+        ingest_report.update(report)
+
+    stages.append(measure_stage("bulk_ingest", [full_ingest], items_per_call=target_chunks))
+    stages.append(measure_stage(
+        "incremental_ingest_noop",
+        [lambda: ingest_incrementally(corpus_dir, embeddings, persist_dir, backend=backend)],
+        items_per_call=target_chunks,
+    ))
+
+    vectordb = load_existing_database(embeddings, persist_dir, backend)
+    queries = [BENCHMARK_QUERIES[i % len(BENCHMARK_QUERIES)] for i in range(repeats)]
+    sub_questions = decompose_complex_query(BENCHMARK_QUERIES[0], llm, use_cache=False)
+
+    stages.append(measure_stage(
+        "decompose_complex_query",
+        [lambda q=q: decompose_complex_query(q, llm, use_cache=False) for q in queries],
+    ))
+    stages.append(measure_stage(
+        "process_single_subquestion",
+        [lambda q=q: process_single_subquestion(q, vectordb, embeddings, llm, use_cache=False)
+         for q in queries],
+    ))
+    stages.append(measure_stage(
+        "retrieve_for_subquestions",
+        [lambda: retrieve_for_subquestions(sub_questions, vectordb, embeddings)] * repeats,
+        items_per_call=len(sub_questions),
+    ))
+
+    return {"chunks": target_chunks, "backend": backend, "ingestion_report": ingest_report, "stages": stages}
+
+
+def compare_vector_backends(target_chunks, repeats, work_dir, k=10):
+    """
+    Loads the same precomputed vectors into Chroma and the flat index (float32,
+    float16, int8) and compares `retrieve_relevant_documents` latency.
+    """
+    print(f"\n⚖️ Backend comparison: {target_chunks} chunks")
+    corpus_dir = os.path.join(work_dir, f"corpus_{target_chunks}")
+    if not os.path.isdir(corpus_dir):
+        build_synthetic_corpus(target_chunks, corpus_dir)
+
+    texts = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, filename), "r", encoding="utf-8") as f:
+            texts.extend(f.read().split("\n\n"))
+    ids = [f"chunk-{i}" for i in range(len(texts))]
+    metadatas = [{"source": "synthetic"} for _ in texts]
+
+    embeddings = HashEmbeddings()
+    vectors = embeddings.embed_documents(texts)
+    queries = [BENCHMARK_QUERIES[i % len(BENCHMARK_QUERIES)] for i in range(repeats)]
+    stages = []
+
+    for backend, dtype in [("chroma", None), ("flat", "float32"), ("flat", "float16"), ("flat", "int8")]:
+        persist_dir = os.path.join(work_dir, f"compare_{backend}_{dtype}_{target_chunks}")
+        if backend == "flat":
+            vectordb = NumpyFlatIndex(with_embedding_cache(embeddings), persist_directory=persist_dir, dtype=dtype)
+        else:
+            vectordb = load_existing_database(embeddings, persist_dir, backend)
+
+        # Chroma caps the size of a single write, so load in slices
+        for start in range(0, len(texts), 5000):
+            end = start + 5000
+            upsert_vectors(vectordb, ids[start:end], vectors[start:end], texts[start:end], metadatas[start:end])
+        flush_vector_store(vectordb)
+
+        # Warm up once so both backends are measured hot
+        retrieve_relevant_documents(vectordb, queries[0], k)
+
+        name = f"search_{backend}" + (f"_{dtype}" if dtype else "")
+        stages.append(measure_stage(
+            name, [lambda q=q: retrieve_relevant_documents(vectordb, q, k) for q in queries]
+        ))
+
+    return {"chunks": target_chunks, "k": k, "stages": stages}
+
+
+def _load_corpus_vectors(target_chunks, work_dir, embeddings):
+    corpus_dir = os.path.join(work_dir, f"corpus_{target_chunks}")
+    if not os.path.isdir(corpus_dir):
+        build_synthetic_corpus(target_chunks, corpus_dir)
+    texts = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, filename), "r", encoding="utf-8") as f:
+            texts.extend(f.read().split("\n\n"))
+    return texts, np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+
+def evaluate_ann_index(target_chunks, work_dir, k=10, num_queries=200,
+                       nprobes=(1, 2, 4, 8, 16, 32, 64), num_subspaces=48):
+    """
+    Builds an IVF-PQ index over the synthetic corpus and sweeps `nprobe`, with and
+    without exact re-scoring, reporting recall@k against exact (flat float32)
+    search together with single-query throughput.
+
+    Queries are held-out corpus vectors, so they follow the corpus distribution.
+
+    Returns:
+        Dict: Build time plus one row per operating point (recall@k, QPS, latency percentiles)
+    """
+    print(f"\n🎯 ANN sweep: {target_chunks} chunks, recall@{k}")
+    embeddings = HashEmbeddings()
+    texts, vectors = _load_corpus_vectors(target_chunks, work_dir, embeddings)
+
+    rng = np.random.default_rng(0)
+    num_queries = min(num_queries, len(texts) // 10)
+    held_out = rng.choice(len(texts), num_queries, replace=False)
+    keep = np.ones(len(texts), dtype=bool)
+    keep[held_out] = False
+    queries = vectors[held_out]
+    corpus_rows = np.flatnonzero(keep)
+    corpus_texts = [texts[i] for i in corpus_rows]
+    corpus_ids = [f"chunk-{i}" for i in corpus_rows]
+    corpus_vectors = vectors[keep]
+
+    # Ground truth and baseline throughput from exact search
+    exact = NumpyFlatIndex(embeddings)
+    exact.add_vectors(corpus_texts, corpus_vectors, ids=corpus_ids)
+    truth, exact_ms = [], []
+    for query in queries:
+        started = time.perf_counter()
+        truth.append(set(exact.query_by_vectors([query], k)["ids"][0]))
+        exact_ms.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    index = IVFPQIndex(embeddings, num_subspaces=num_subspaces)
+    index.add_vectors(corpus_texts, corpus_vectors, ids=corpus_ids)
+    index.train()
+    build_s = time.perf_counter() - started
+
+    def row(name, latencies_ms, recall):
+        result = {
+            "name": name,
+            f"recall@{k}": round(recall, 4),
+            "qps": round(1000 / float(np.mean(latencies_ms)), 1),
+            **_percentiles(latencies_ms),
+        }
+        print(f"  {name:<28} recall@{k}={result[f'recall@{k}']:.3f}  {result['qps']:>9.1f} qps  "
+              f"p50={result['p50_ms']:.2f} ms")
+        return result
+
+    points = [row("exact_flat_float32", exact_ms, 1.0)]
+    for rescore in (False, True):
+        for nprobe in nprobes:
+            if nprobe > index.nlist:
+                continue
+            found, latencies = [], []
+            for query in queries:
+                started = time.perf_counter()
+                ids = index.query_by_vectors([query], k, nprobe=nprobe, rescore=rescore)["ids"][0]
+                latencies.append((time.perf_counter() - started) * 1000)
+                found.append(len(truth[len(found)] & set(ids)) / k)
+            points.append(row(f"ivfpq_nprobe{nprobe}" + ("_rescore" if rescore else ""),
+                              latencies, float(np.mean(found))))
+
+    return {
+        "chunks": len(corpus_texts),
+        "k": k,
+        "queries": num_queries,
+        "nlist": index.nlist,
+        "num_subspaces": index.num_subspaces,
+        "code_bytes_per_vector": index.num_subspaces,
+        "build_s": round(build_s, 2),
+        "operating_points": points,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the sports RAG pipeline")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 1_000_000],
+                        help="Corpus sizes, in chunks")
+    parser.add_argument("--repeats", type=int, default=20, help="Samples per query stage")
+    parser.add_argument("--workers", type=int, default=None, help="Ingestion worker processes")
+    parser.add_argument("--work-dir", default=None, help="Where to build corpora (default: temp dir)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="Skip peak-memory tracking (it slows Python-heavy stages down)")
+    parser.add_argument("--backend", choices=["chroma", "flat", "ivfpq"], default="chroma",
+                        help="Vector store backend for the pipeline stages")
+    parser.add_argument("--compare-backends", action="store_true",
+                        help="Also compare search latency of Chroma vs the flat NumPy index")
+    parser.add_argument("--ann-sweep", action="store_true",
+                        help="Also report IVF-PQ recall@k and QPS against exact search")
+    args = parser.parse_args()
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+
+        # Keep the embedding cache for the fake model inside the work dir
+        with_embedding_cache(HashEmbeddings(), cache_dir=os.path.join(work_dir, "embedding_cache"))
+
+        results = {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeats": args.repeats,
+            "scales": [run_scale(n, args.repeats, work_dir, args.workers, args.backend) for n in args.scales],
+        }
+        if args.compare_backends:
+            results["backend_comparison"] = [
+                compare_vector_backends(n, args.repeats, work_dir) for n in args.scales
+            ]
+        if args.ann_sweep:
+            results["ann_sweep"] = [evaluate_ann_index(n, work_dir) for n in args.scales]
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+🗄️ Query-Level Caches
+
+This module holds caches that let repeated questions skip LLM round trips:
+1. DecompositionCache - remembers how a (normalized) query was split into sub-questions
+2. SemanticAnswerCache - reuses answers of previously seen, near-identical sub-questions
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+# === Helper: Normalize a Query for Cache Lookups ===
+def normalize_query(query: str) -> str:
+    """
+    Reduces a query to a canonical form so trivially re-worded versions match.
+    Lowercases, drops punctuation and collapses whitespace.
+
+    Args:
+        query (str): Raw user query
+
+    Returns:
+        str: Normalized query (e.g., "Top 3 defensive teams?" -> "top 3 defensive teams")
+    """
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+# === Class 1: Decomposition Cache ===
+class DecompositionCache:
+    """
+    LRU cache of query -> sub-questions with a time-to-live and optional disk backing.
+
+    Args:
+        max_size (int): Maximum number of queries remembered
+        ttl_seconds (float): How long an entry stays valid
+        persist_path (str, optional): JSON file used to keep entries across restarts
+    """
+
+    def __init__(self, max_size=1000, ttl_seconds=24 * 3600, persist_path=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+
+        self._entries = OrderedDict()  # normalized query -> (created_at, sub_questions)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if persist_path and os.path.exists(persist_path):
+            self._load()
+
+    def get(self, query: str):
+        """Returns the cached sub-questions for `query`, or None on a miss/expiry."""
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+
+            if entry:
+                del self._entries[key]  # Expired
+            self.misses += 1
+            return None
+
+    def put(self, query: str, sub_questions):
+        """Stores the sub-questions produced for `query`."""
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = (time.time(), list(sub_questions))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)  # Evict least recently used
+            if self.persist_path:
+                self._save()
+
+    def clear(self):
+        """Drops every entry (in memory and on disk)."""
+        with self._lock:
+            self._entries.clear()
+            if self.persist_path:
+                self._save()
+
+    def stats(self):
+        """Returns hit/miss counters for the metrics endpoint."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "size": len(self._entries),
+        }
+
+    def _load(self):
+        with open(self.persist_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        now = time.time()
+        for key, created_at, sub_questions in saved:
+            if now - created_at < self.ttl_seconds:
+                self._entries[key] = (created_at, sub_questions)
+        print(f"  💾 Loaded {len(self._entries)} cached decompositions")
+
+    def _save(self):
+        tmp_path = self.persist_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([[key, created_at, subs] for key, (created_at, subs) in self._entries.items()], f)
+        os.replace(tmp_path, self.persist_path)
+
+
+# === Class 2: Semantic Answer Cache ===
+class SemanticAnswerCache:
+    """
+    Caches sub-question answers by meaning rather than exact wording: a new
+    sub-question reuses a stored answer if their embeddings' cosine similarity
+    is at least `similarity_threshold`.
+
+    Entries are tied to a corpus version; when the caller reports a different
+    version (i.e. the vector store was re-ingested), the whole cache is dropped.
+
+    Args:
+        similarity_threshold (float): Minimum cosine similarity for a hit
+        max_size (int): Maximum number of answers remembered (LRU eviction)
+    """
+
+    def __init__(self, similarity_threshold=0.95, max_size=5000):
+        self.similarity_threshold = similarity_threshold
+        self.max_size = max_size
+
+        self._keys = []        # sub-question text per row
+        self._vectors = None   # (n, dim) matrix of unit-length embeddings
+        self._answers = {}     # sub-question -> result dict
+        self._last_used = {}   # sub-question -> monotonic counter (for LRU)
+        self._clock = 0
+        self._corpus_version = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, embedding, corpus_version=None):
+        """
+        Returns the cached result of the most similar sub-question, or None.
+
+        Args:
+            embedding (List[float]): Embedding of the new sub-question
+            corpus_version: Identifier of the current vector store contents
+        """
+        query_vec = self._unit(embedding)
+        with self._lock:
+            self._check_version(corpus_version)
+
+            if self._vectors is None or not self._keys:
+                self.misses += 1
+                return None
+
+            similarities = self._vectors @ query_vec
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            key = self._keys[best]
+            self._clock += 1
+            self._last_used[key] = self._clock
+            self.hits += 1
+            print(f"  ⚡ Semantic cache hit (similarity {similarities[best]:.3f}): {key[:50]}")
+            return dict(self._answers[key])
+
+    def put(self, sub_question: str, embedding, result, corpus_version=None):
+        """Stores `result` (answer + citations) for `sub_question`."""
+        vector = self._unit(embedding)
+        with self._lock:
+            self._check_version(corpus_version)
+            self._clock += 1
+
+            if sub_question in self._answers:
+                row = self._keys.index(sub_question)
+                self._vectors[row] = vector
+            else:
+                if len(self._keys) >= self.max_size:
+                    self._evict_lru()
+                self._keys.append(sub_question)
+                self._vectors = (
+                    vector[None, :] if self._vectors is None
+                    else np.vstack([self._vectors, vector])
+                )
+
+            self._answers[sub_question] = dict(result)
+            self._last_used[sub_question] = self._clock
+
+    def clear(self):
+        """Drops every cached answer."""
+        with self._lock:
+            self._reset()
+
+    def stats(self):
+        """Returns hit/miss counters for the metrics endpoint."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "size": len(self._keys),
+            "invalidations": self.invalidations,
+        }
+
+    def _check_version(self, corpus_version):
+        if corpus_version != self._corpus_version:
+            if self._keys:
+                print("  ♻️ Corpus changed, dropping semantic answer cache")
+                self.invalidations += 1
+            self._reset()
+            self._corpus_version = corpus_version
+
+    def _reset(self):
+        self._keys = []
+        self._vectors = None
+        self._answers = {}
+        self._last_used = {}
+
+    def _evict_lru(self):
+        oldest = min(self._keys, key=self._last_used.__getitem__)
+        row = self._keys.index(oldest)
+        del self._keys[row]
+        self._vectors = np.delete(self._vectors, row, axis=0)
+        del self._answers[oldest]
+        del self._last_used[oldest]
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
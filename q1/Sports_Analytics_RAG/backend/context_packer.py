@@ -0,0 +1,126 @@
+"""
+📦 Token-Budget Context Packing
+
+Keeps the answer prompt at a predictable size, however large the chunks or k:
+1. Tokens are counted with the LLM's own tokenizer (tiktoken), loaded once per model
+2. Documents are added greedily, most relevant first, until the budget is spent
+3. A document that doesn't fit whole is trimmed to the sentences that do
+4. Citation numbers are assigned to packed documents only, so [n] in the context
+   and [n] in the citations always refer to the same excerpt
+"""
+
+import os
+from functools import lru_cache
+
+from sentence_store import segment_sentences
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+MIN_TRIMMED_TOKENS = 20  # Don't bother adding an excerpt smaller than this
+CONTEXT_SEPARATOR = "\n\n"
+
+
+# === Helper: Cached Tokenizer ===
+def _estimate_tokens(text: str) -> int:
+    """Rough count for when no tokenizer is available (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+@lru_cache(maxsize=8)
+def get_token_counter(model_name=None):
+    """
+    Returns a function counting tokens the way `model_name` does. The tokenizer is
+    loaded once per model; without tiktoken (or its encoding files) the count is estimated.
+
+    Args:
+        model_name (str, optional): LLM name, e.g. "gpt-3.5-turbo"
+
+    Returns:
+        Callable[[str], int]: Token counter
+    """
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model_name or "")
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:  # Not installed, or the encoding can't be downloaded
+        print(f"  ⚠️ tiktoken unavailable ({type(e).__name__}), estimating tokens as characters / 4")
+        return _estimate_tokens
+
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+# === Helper: Trim a Document to Its Sentences That Fit ===
+def _trim_to_budget(text, budget, count_tokens):
+    """Keeps sentences in their original order while they fit in `budget` tokens."""
+    kept, used = [], 0
+    for start, end in segment_sentences(text, min_chars=1):
+        sentence = text[start:end]
+        cost = count_tokens(sentence + " ")
+        if used + cost <= budget:
+            kept.append(sentence)
+            used += cost
+    return " ".join(kept)
+
+
+# === Function: Pack Documents into a Token Budget ===
+def pack_context(docs, token_budget=CONTEXT_TOKEN_BUDGET, count_tokens=_estimate_tokens):
+    """
+    Builds the numbered context block for the answer prompt within `token_budget`.
+
+    Documents are taken in order of `metadata["relevance_score"]` (set by reranking),
+    falling back to the order given.
+
+    Args:
+        docs (List[Document]): Candidate documents
+        token_budget (int): Maximum tokens for the whole context block
+        count_tokens (Callable[[str], int]): Token counter (see `get_token_counter`)
+
+    Returns:
+        Tuple[str, List[Dict[str, str]], Dict[str, int]]: The context, one citation
+        per packed excerpt ({"id", "source", "text"}), and packing statistics
+    """
+    ordered = sorted(docs, key=lambda doc: doc.metadata.get("relevance_score", 0.0), reverse=True)
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR)
+
+    parts, citations = [], []
+    packed_texts = {}  # excerpt -> its citation, so identical excerpts are packed once
+    used = 0
+    stats = {"docs_packed": 0, "docs_trimmed": 0, "docs_dropped": 0, "docs_merged": 0}
+
+    for doc in ordered:
+        # Near-duplicates collapsed into this document are cited alongside it
+        sources = [doc.metadata.get("source", "unknown")] + doc.metadata.get("duplicate_sources", [])
+
+        # Different chunks can compress down to the same sentences: cite them together
+        if doc.page_content in packed_texts:
+            citation = packed_texts[doc.page_content]
+            citation["source"] = ", ".join(dict.fromkeys(citation["source"].split(", ") + sources))
+            stats["docs_merged"] += 1
+            continue
+
+        label = f"[{len(parts) + 1}] "
+        overhead = count_tokens(label) + (separator_tokens if parts else 0)
+        text = doc.page_content
+
+        if used + overhead + count_tokens(text) > token_budget:
+            remaining = token_budget - used - overhead
+            text = _trim_to_budget(text, remaining, count_tokens) if remaining >= MIN_TRIMMED_TOKENS else ""
+            if not text:
+                stats["docs_dropped"] += 1
+                continue
+            stats["docs_trimmed"] += 1
+
+        used += overhead + count_tokens(text)
+        parts.append(label + text)
+        citations.append({
+            "id": label.strip(),
+            "source": ", ".join(dict.fromkeys(sources)),
+            "text": text,
+        })
+        packed_texts[doc.page_content] = citations[-1]
+        stats["docs_packed"] += 1
+
+    context = CONTEXT_SEPARATOR.join(parts)
+    stats["context_tokens"] = count_tokens(context) if context else 0
+    return context, citations, stats
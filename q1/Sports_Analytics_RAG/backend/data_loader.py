@@ -15,6 +15,31 @@ from langchain_community.document_loaders import TextLoader
 # Used to split large documents into smaller overlapping chunks
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+# SimHash fingerprints, used at query time to collapse near-duplicate chunks
+from near_duplicates import add_fingerprints
+
+
+# === Helper: Load a single .txt file ===
+def load_document(file_path: str):
+    """
+    Loads one .txt file and tags it with its filename as the source.
+
+    Args:
+        file_path (str): Path to the .txt file
+
+    Returns:
+        List of Document objects (LangChain format) with source metadata
+    """
+    # Use LangChain's TextLoader to load content from the file
+    loader = TextLoader(file_path)
+    docs = loader.load()
+
+    # Add metadata: tag each document with its source filename
+    for doc in docs:
+        doc.metadata["source"] = os.path.basename(file_path)
+
+    return docs
+
 
 # === Function 1: Load .txt files from a folder ===
 def load_documents_from_folder(folder_path: str):
@@ -36,15 +61,7 @@ def load_documents_from_folder(folder_path: str):
         if filename.endswith(".txt"):  # Only process .txt files
             file_path = os.path.join(folder_path, filename)
 
-            # Use LangChain's TextLoader to load content from the file
-            loader = TextLoader(file_path)
-            docs = loader.load()
-
-            # Add metadata: tag each document with its source filename
-            for doc in docs:
-                doc.metadata["source"] = filename
-
-            all_docs.extend(docs)
+            all_docs.extend(load_document(file_path))
             print(f"  📄 Loaded {filename}")
 
     return all_docs
@@ -61,7 +78,7 @@ def chunk_documents(docs, chunk_size=500, chunk_overlap=50):
         chunk_overlap (int): Number of characters to overlap between chunks
 
     Returns:
-        List of smaller document chunks
+        List of smaller document chunks, each with a SimHash fingerprint in its metadata
     """
     print(f"✂️ Chunking documents (size={chunk_size}, overlap={chunk_overlap})")
 
@@ -78,5 +95,8 @@ def chunk_documents(docs, chunk_size=500, chunk_overlap=50):
         chunks = splitter.split_documents([doc])  # Returns a list of smaller docs
         all_chunks.extend(chunks)
 
+    # Fingerprint each chunk once, here, instead of on every query
+    add_fingerprints(all_chunks)
+
     print(f"  📊 Created {len(all_chunks)} chunks")
     return all_chunks
@@ -4,22 +4,88 @@
 This file includes:
 1. Contextual Compression - removes irrelevant content based on query similarity
 2. Reranking - reorders retrieved documents based on semantic relevance
+3. Filling in stored sentences for a chunk pool the ingestion step didn't cover
+4. Near-duplicate suppression - collapses chunks that repeat the same content
 """
 
-from sklearn.metrics.pairwise import cosine_similarity  # Used to calculate similarity between vectors
+import numpy as np  # Used for batched vector math
+
+from embedding_cache import with_embedding_cache  # Avoids re-embedding text we've seen before
+from metrics import timed_stage, record  # Per-stage timing and counts
+from sentence_store import get_sentence_store, segment_sentences  # Sentences segmented and embedded at ingestion
+from near_duplicates import get_fingerprint, hamming_distance, NEAR_DUPLICATE_MAX_DISTANCE
+
+
+# === Helper: Cosine Similarity Between One Query and Many Vectors ===
+def _cosine_scores(query_embedding, vectors):
+    """
+    Scores every row of `vectors` against the query in one matrix product.
+
+    Args:
+        query_embedding (List[float]): Query vector
+        vectors (List[List[float]]): Vectors to compare against the query
+
+    Returns:
+        np.ndarray: One cosine similarity per row of `vectors`
+    """
+    query_vec = np.asarray(query_embedding, dtype=np.float32)
+    matrix = np.asarray(vectors, dtype=np.float32)
+
+    # Normalise both sides (guarding against zero vectors, like sklearn does)
+    query_norm = np.linalg.norm(query_vec) or 1.0
+    row_norms = np.linalg.norm(matrix, axis=1)
+    row_norms[row_norms == 0] = 1.0
+
+    return (matrix @ query_vec) / (row_norms * query_norm)
+
+
+# === Helper: Embed Texts in Batches, Skipping Known Ones ===
+def _embed_missing(texts, embeddings, known, batch_size):
+    """Returns vectors for `texts`, embedding only those not already in `known`."""
+    missing = list(dict.fromkeys(text for text in texts if text not in known))
+    new_vectors = {}
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        new_vectors.update(zip(batch, embeddings.embed_documents(batch)))
+    return [known[text] if text in known else new_vectors[text] for text in texts]
+
+
+# === Helper: Sentences of One Chunk, Embedded on the Spot ===
+def _embed_sentences(text, embeddings):
+    """
+    Segments and embeds one chunk's sentences without the sentence store.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray | None]: Same shape as `SentenceStore.lookup`
+    """
+    spans = segment_sentences(text)
+    if not spans:
+        return np.empty((0, 2), dtype=np.int32), None
+    vectors = embeddings.embed_documents([text[start:end] for start, end in spans])
+    return np.asarray(spans, dtype=np.int32), np.asarray(vectors, dtype=np.float32)
 
 
 # === Function 1: Contextual Compression ===
-def compress_document_context(docs, query: str, embeddings, similarity_threshold=0.3):
+@timed_stage("compression")
+def compress_document_context(docs, query: str, embeddings, similarity_threshold=0.3, batch_size=64,
+                              query_embedding=None, sentence_store=None):
     """
     Filters out irrelevant sentences from documents by comparing each sentence
     to the query using cosine similarity.
 
+    Sentence offsets and vectors come from the sentence side store filled at
+    ingestion time, so this is a lookup plus a single matrix product. Chunks the
+    store doesn't know yet are segmented and embedded once, then kept in it.
+
     Args:
         docs (List[Document]): List of LangChain Document objects
         query (str): User query
         embeddings: Embedding model (e.g., HuggingFaceEmbeddings)
         similarity_threshold (float): Cut-off value below which content is ignored
+        batch_size (int): Maximum number of sentences sent to the model per call
+        query_embedding (List[float], optional): Precomputed query vector
+        sentence_store (SentenceStore, optional): Store to read sentences from
+            (default: the one opened with the vector store)
 
     Returns:
         List of compressed (filtered) documents
@@ -29,54 +95,82 @@ def compress_document_context(docs, query: str, embeddings, similarity_threshold
     if not docs:
         return docs
 
+    # Route all embedding calls through the shared cache
+    embeddings = with_embedding_cache(embeddings)
+    sentence_store = sentence_store or get_sentence_store()
+    sentence_store.ensure_model(embeddings)
+
     # Convert the full query to an embedding vector
-    query_embedding = embeddings.embed_query(query)
+    if query_embedding is None:
+        query_embedding = embeddings.embed_query(query)
 
-    compressed_docs = []
+    # Segment + embed only chunks that weren't ingested with the store
+    new_sentences = sentence_store.add_chunks([doc.page_content for doc in docs], embeddings, batch_size)
+    record("sentences_embedded", new_sentences)
 
-    for doc in docs:
-        # Split document into sentences
-        sentences = doc.page_content.split('. ')
-        relevant_sentences = []
+    # Gather every stored sentence across all docs, remembering its owner
+    owners, offsets, vectors = [], [], []
+    for doc_idx, doc in enumerate(docs):
+        stored = sentence_store.lookup(doc.page_content)
+        if stored is None:
+            # Dropped since add_chunks (the store was reset or swapped): embed this chunk directly
+            stored = _embed_sentences(doc.page_content, embeddings)
+            record("sentences_embedded", len(stored[0]))
+        doc_offsets, doc_vectors = stored
+        if len(doc_offsets):
+            owners.extend([doc_idx] * len(doc_offsets))
+            offsets.extend(doc_offsets.tolist())
+            vectors.append(doc_vectors)
+
+    record("compression_docs_in", len(docs))
+    record("sentences_scored", len(owners))
 
-        for sentence in sentences:
-            # Skip very short sentences that aren't meaningful
-            if len(sentence.strip()) < 20:
-                continue
+    if not owners:
+        print("  📊 Compressed to 0 relevant documents")
+        record("compression_docs_out", 0)
+        return []
 
-            # Convert sentence to embedding
-            sentence_embedding = embeddings.embed_query(sentence)
+    # Measure how similar every sentence is to the query in one go
+    similarities = _cosine_scores(query_embedding, np.concatenate(vectors))
 
-            # Measure how similar the sentence is to the query
-            similarity = cosine_similarity(
-                [query_embedding],
-                [sentence_embedding]
-            )[0][0]
+    # Keep only sentences above the similarity threshold, grouped by document
+    relevant_by_doc = {}
+    for doc_idx, (start, end), similarity in zip(owners, offsets, similarities):
+        if similarity > similarity_threshold:
+            relevant_by_doc.setdefault(doc_idx, []).append(docs[doc_idx].page_content[start:end])
 
-            # Keep only sentences above the similarity threshold
-            if similarity > similarity_threshold:
-                relevant_sentences.append(sentence)
+    compressed_docs = []
 
-        # If relevant sentences found, reconstruct the document
+    # If relevant sentences found, reconstruct the document (original order preserved)
+    for doc_idx, doc in enumerate(docs):
+        relevant_sentences = relevant_by_doc.get(doc_idx)
         if relevant_sentences:
-            compressed_content = '. '.join(relevant_sentences)
-            doc.page_content = compressed_content
+            doc.page_content = ' '.join(relevant_sentences)
             compressed_docs.append(doc)
 
     print(f"  📊 Compressed to {len(compressed_docs)} relevant documents")
+    record("compression_docs_out", len(compressed_docs))
     return compressed_docs
 
 
 # === Function 2: Rerank Documents by Relevance ===
-def rerank_documents_by_similarity(docs, query: str, embeddings):
+@timed_stage("reranking")
+def rerank_documents_by_similarity(docs, query: str, embeddings, stored_embeddings=None,
+                                   query_embedding=None):
     """
     Reranks the given documents by comparing their content to the query.
     More relevant documents (higher cosine similarity) come first.
 
+    If `stored_embeddings` is given (a mapping of chunk text to the vector the
+    vector store already holds for it), those vectors are reused and only
+    documents whose text was rewritten (e.g. by compression) are re-embedded.
+
     Args:
         docs (List[Document]): List of LangChain documents
         query (str): Original user query
         embeddings: Embedding model to convert text to vectors
+        stored_embeddings (Dict[str, List[float]], optional): Known vectors keyed by text
+        query_embedding (List[float], optional): Precomputed query vector
 
     Returns:
         List[Document]: Documents sorted by relevance (highest first)
@@ -86,29 +180,100 @@ def rerank_documents_by_similarity(docs, query: str, embeddings):
     if not docs:
         return docs
 
-    # Embed the user's question
-    query_embedding = embeddings.embed_query(query)
+    stored_embeddings = stored_embeddings or {}
+    embeddings = with_embedding_cache(embeddings)
 
-    scored_docs = []
+    # Embed the user's question
+    if query_embedding is None:
+        query_embedding = embeddings.embed_query(query)
 
-    for doc in docs:
-        # Embed the document’s content
-        doc_embedding = embeddings.embed_query(doc.page_content)
+    # Only embed documents we don't already have a vector for, in one batch
+    texts = [doc.page_content for doc in docs]
+    missing = [text for text in texts if text not in stored_embeddings]
+    doc_embeddings = _embed_missing(texts, embeddings, stored_embeddings, batch_size=len(texts))
+    if stored_embeddings:
+        print(f"  ♻️ Reused {len(docs) - len(missing)} stored vectors, embedded {len(missing)}")
 
-        # Compute similarity between query and doc
-        similarity = cosine_similarity(
-            [query_embedding],
-            [doc_embedding]
-        )[0][0]
+    # Compute similarity between query and every doc at once
+    similarities = _cosine_scores(query_embedding, doc_embeddings)
 
-        # Store doc along with its similarity score
-        scored_docs.append((doc, similarity))
+    # Store doc along with its similarity score (also kept on the doc, for context packing)
+    scored_docs = list(zip(docs, similarities))
+    for doc, score in scored_docs:
+        doc.metadata["relevance_score"] = float(score)
 
     # Sort documents by similarity score (highest first)
     scored_docs.sort(key=lambda x: x[1], reverse=True)
 
     # Print top 3 scores (for insight)
     print(f"  🏆 Top similarity scores: {[f'{score:.3f}' for _, score in scored_docs[:3]]}")
+    record("reranked_docs", len(scored_docs))
+    record("top_similarity_scores", ", ".join(f"{score:.3f}" for _, score in scored_docs[:3]))
 
     # Return only the documents, now ordered by relevance
     return [doc for doc, score in scored_docs]
+
+
+# === Function 3: Make Sure a Chunk Pool's Sentences Are Stored ===
+@timed_stage("sentence_embedding")
+def embed_chunk_sentences(chunk_texts, embeddings, batch_size=64, sentence_store=None):
+    """
+    Segments and embeds the sentences of any chunk in the pool that the sentence
+    store doesn't hold yet (normally none: ingestion stores them all), so that
+    compressing the same chunks for several queries never re-embeds a sentence.
+
+    Args:
+        chunk_texts (Iterable[str]): Distinct chunk contents
+        embeddings: Embedding model (e.g., HuggingFaceEmbeddings)
+        batch_size (int): Maximum number of sentences sent to the model per call
+        sentence_store (SentenceStore, optional): Store to fill (default: the active one)
+
+    Returns:
+        int: Number of sentences that had to be embedded
+    """
+    sentence_store = sentence_store or get_sentence_store()
+    embedded = sentence_store.add_chunks(list(chunk_texts), with_embedding_cache(embeddings), batch_size)
+    print(f"🧩 Embedded {embedded} new sentences for the chunk pool")
+    record("pool_sentences_embedded", embedded)
+    return embedded
+
+
+# === Function 4: Collapse Near-Duplicate Chunks ===
+@timed_stage("deduplication")
+def collapse_near_duplicates(docs, max_distance=NEAR_DUPLICATE_MAX_DISTANCE):
+    """
+    Keeps one representative per group of near-identical chunks, so repeated stat
+    lines don't each cost reranking work and prompt tokens.
+
+    Chunks are compared by the SimHash fingerprints stored at ingestion time. The
+    first (best-retrieved) chunk of a group is kept, and the sources of the chunks
+    it absorbs are added to its `duplicate_sources` metadata so they stay citable.
+
+    Args:
+        docs (List[Document]): Retrieved documents, best first
+        max_distance (int): Maximum differing fingerprint bits (of 64) for a duplicate
+
+    Returns:
+        List[Document]: Representatives, in their original order
+    """
+    representatives = []  # (fingerprint, doc)
+    for doc in docs:
+        fingerprint = get_fingerprint(doc)
+        match = next(
+            (kept for kept_fp, kept in representatives if hamming_distance(fingerprint, kept_fp) <= max_distance),
+            None
+        )
+        if match is None:
+            representatives.append((fingerprint, doc))
+            continue
+
+        source = doc.metadata.get("source", "unknown")
+        sources = match.metadata.setdefault("duplicate_sources", [])
+        if source != match.metadata.get("source") and source not in sources:
+            sources.append(source)
+
+    collapsed = len(docs) - len(representatives)
+    if collapsed:
+        print(f"  👯 Collapsed {collapsed} near-duplicate chunks")
+    record("duplicates_collapsed", collapsed)
+    return [doc for _, doc in representatives]
@@ -0,0 +1,349 @@
+"""
+💾 Embedding Cache
+
+This module wraps an embedding model (e.g., HuggingFaceEmbeddings) so the same
+text is never embedded twice:
+1. An in-memory LRU tier for the hottest vectors
+2. An on-disk tier (memory-mapped float32 array + JSON index file) that survives restarts
+
+New disk entries are appended to a small log next to the index, so a cache miss
+costs one line of I/O. The log is folded into the JSON index only once it is as
+long as the index itself (and at exit, or on `flush()`), which keeps rewriting the
+index O(1) amortized per insert and off the common query path.
+
+Entries are keyed by the model name plus a hash of the text, so switching models
+never returns stale vectors.
+
+The disk tier has no cross-process locking. When several worker processes share one
+cache directory (multi-worker serving), they open it read-only
+(`EMBEDDING_CACHE_READ_ONLY=true`) and keep new vectors in their memory tier only.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain.embeddings.base import Embeddings  # Base class expected by Chroma and LangChain
+
+from metrics import increment  # Counts real model calls in the current request trace
+
+EMBEDDING_CACHE_READ_ONLY = os.getenv("EMBEDDING_CACHE_READ_ONLY", "false").lower() == "true"
+MIN_LOG_ENTRIES = 1024  # Don't compact a log shorter than this, however small the index
+
+
+# === Class: Two-Tier Embedding Cache ===
+class CachedEmbeddings(Embeddings):
+    """
+    Drop-in replacement for an embedding model that caches every vector it produces.
+
+    Args:
+        base_embeddings: The real embedding model to call on a cache miss
+        cache_dir (str): Root directory for the on-disk tier (None disables it)
+        max_memory_items (int): Maximum number of vectors kept in the memory tier
+        max_disk_items (int): Maximum number of vectors kept in the disk tier
+        read_only (bool): Only read the disk tier, never write it (for caches shared
+            by several processes)
+    """
+
+    def __init__(self, base_embeddings, cache_dir="./embedding_cache",
+                 max_memory_items=10_000, max_disk_items=200_000, read_only=EMBEDDING_CACHE_READ_ONLY):
+        self.base_embeddings = base_embeddings
+        self.model_name = getattr(base_embeddings, "model_name", type(base_embeddings).__name__)
+        # Each model gets its own sub-directory so vector sizes never clash
+        self.cache_dir = (
+            os.path.join(cache_dir, self.model_name.replace("/", "__")) if cache_dir else None
+        )
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.read_only = read_only
+
+        self._memory = OrderedDict()  # key -> np.ndarray, most recently used last
+        self._lock = threading.Lock()
+
+        # Disk tier state (created lazily once we know the vector dimension)
+        self._disk_rows = OrderedDict()  # key -> row in the memmap, most recently used last
+        self._vectors = None
+        self._dim = None
+        self._log = None         # Append-only log of (key, row) inserts since the last compaction
+        self._log_entries = 0
+        self._generation = 0     # Which log the JSON index was compacted with
+
+        # Counters for monitoring
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            self._load_disk_index()
+            if not self.read_only:
+                atexit.register(self.flush)
+
+    # --- LangChain Embeddings interface ---
+
+    def embed_documents(self, texts):
+        """Embeds a batch of texts, calling the model only for uncached ones."""
+        keys = [self._key(text) for text in texts]
+        results = [None] * len(texts)
+        missing = {}  # key -> (text, [positions])
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._lookup(key)
+                if vector is not None:
+                    results[i] = vector
+                elif key in missing:
+                    missing[key][1].append(i)
+                else:
+                    missing[key] = (texts[i], [i])
+            self.misses += len(missing)
+
+        increment("embedding_cache_hits", len(texts) - sum(len(pos) for _, pos in missing.values()))
+        if missing:
+            increment("embedding_calls")
+            increment("embedded_texts", len(missing))
+            new_vectors = self.base_embeddings.embed_documents([text for text, _ in missing.values()])
+            with self._lock:
+                for (key, (_, positions)), vector in zip(missing.items(), new_vectors):
+                    vector = np.asarray(vector, dtype=np.float32)
+                    self._store(key, vector)
+                    for i in positions:
+                        results[i] = vector
+                self._sync_log()
+
+        return [vector.tolist() for vector in results]
+
+    def embed_query(self, text):
+        """Embeds a single query string through the cache."""
+        key = self._key(text)
+        with self._lock:
+            vector = self._lookup(key)
+            if vector is None:
+                self.misses += 1
+        if vector is None:
+            increment("embedding_calls")
+            increment("embedded_texts")
+            vector = np.asarray(self.base_embeddings.embed_query(text), dtype=np.float32)
+            with self._lock:
+                self._store(key, vector)
+                self._sync_log()
+        else:
+            increment("embedding_cache_hits")
+        return vector.tolist()
+
+    def flush(self):
+        """Folds the insert log into the JSON index (called at exit)."""
+        with self._lock:
+            if self._log_entries:
+                self._compact_disk_index()
+
+    # --- Monitoring ---
+
+    def stats(self):
+        """Returns hit/miss counters and tier sizes."""
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_items": len(self._memory),
+            "disk_items": len(self._disk_rows),
+        }
+
+    # --- Internal helpers ---
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, key):
+        # Tier 1: memory
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return self._memory[key]
+
+        # Tier 2: disk (promote to memory on hit)
+        if key in self._disk_rows:
+            if not self.read_only:
+                self._disk_rows.move_to_end(key)  # Saved with the next compaction
+            vector = np.array(self._vectors[self._disk_rows[key]])
+            self._remember(key, vector)
+            self.disk_hits += 1
+            return vector
+
+        return None
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)  # Evict least recently used
+
+    def _store(self, key, vector):
+        self._remember(key, vector)
+        if not self.cache_dir or self.max_disk_items <= 0 or self.read_only:
+            return
+
+        if self._vectors is None:
+            self._open_vectors(dim=len(vector))
+        if len(vector) != self._dim:
+            return  # Different model output size; keep it in memory only
+
+        if key in self._disk_rows:
+            row = self._disk_rows[key]
+        elif len(self._disk_rows) < self.max_disk_items:
+            row = len(self._disk_rows)
+        else:
+            # Evict the least recently used disk entry and reuse its row
+            _, row = self._disk_rows.popitem(last=False)
+
+        self._vectors[row] = vector
+        self._disk_rows[key] = row
+        self._disk_rows.move_to_end(key)
+        self._log.write(f"{key} {row}\n")
+        self._log_entries += 1
+
+    def _paths(self):
+        return (
+            os.path.join(self.cache_dir, "vectors.f32"),
+            os.path.join(self.cache_dir, "index.json"),
+            os.path.join(self.cache_dir, "index.log"),
+        )
+
+    def _open_vectors(self, dim, log_ok=False):
+        vectors_path, _, log_path = self._paths()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if self.read_only:
+            mode = "r"
+        else:
+            mode = "r+" if os.path.exists(vectors_path) else "w+"
+        self._dim = dim
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode=mode,
+                                  shape=(self.max_disk_items, dim))
+        if self.read_only:
+            return
+        if log_ok:
+            self._log = open(log_path, "a", encoding="utf-8")
+        else:
+            self._compact_disk_index()  # Index and a matching log exist as soon as the vectors do
+
+    def _load_disk_index(self):
+        vectors_path, index_path, log_path = self._paths()
+        if not (os.path.exists(index_path) and os.path.exists(vectors_path)):
+            # Vectors without an index are unusable (e.g. crash before the first flush)
+            if os.path.exists(vectors_path) and not self.read_only:
+                os.remove(vectors_path)
+            return
+
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+
+        # A cache built with a different capacity can't be mapped safely; start fresh
+        if index.get("capacity") != self.max_disk_items:
+            if self.read_only:
+                print("  ⚠️ Embedding cache capacity changed, ignoring the read-only on-disk tier")
+                return
+            print("  ⚠️ Embedding cache capacity changed, discarding on-disk tier")
+            os.remove(vectors_path)
+            os.remove(index_path)
+            if os.path.exists(log_path):
+                os.remove(log_path)
+            return
+
+        self._disk_rows = OrderedDict(index["rows"])  # Saved in LRU order
+        self._generation = index.get("generation", 0)
+        log_ok = self._replay_log()
+        self._open_vectors(dim=index["dim"], log_ok=log_ok)
+        print(f"  💾 Loaded {len(self._disk_rows)} cached embeddings from {self.cache_dir}")
+
+    def _replay_log(self):
+        """
+        Applies the inserts logged since the index was last compacted. Returns whether
+        the log belongs to the index (new inserts can then be appended to it).
+        """
+        _, _, log_path = self._paths()
+        if not os.path.exists(log_path):
+            return False
+        with open(log_path, "r", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        # A log from before the last compaction is already part of the index
+        if lines[0] != str(self._generation):
+            return False
+        row_keys = {row: key for key, row in self._disk_rows.items()}
+        for line in lines[1:-1]:  # The last piece is empty, or a line cut off by a crash
+            key, _, row = line.partition(" ")
+            if len(key) != 64 or not row.isdigit():  # Keys are SHA-256 hex digests
+                continue
+            row = int(row)
+            if row_keys.get(row, key) != key:
+                del self._disk_rows[row_keys[row]]  # That row was evicted and reused
+            self._disk_rows[key] = row
+            self._disk_rows.move_to_end(key)
+            row_keys[row] = key
+            self._log_entries += 1
+        return True
+
+    def _sync_log(self):
+        """Hands logged inserts to the OS; compacts once the log is as long as the index."""
+        if self._log is None:
+            return
+        self._log.flush()
+        if self._log_entries >= max(MIN_LOG_ENTRIES, len(self._disk_rows)):
+            self._compact_disk_index()
+
+    def _compact_disk_index(self):
+        """Rewrites the JSON index from the in-memory rows and starts an empty log."""
+        _, index_path, log_path = self._paths()
+        if self._log is not None:
+            self._log.close()
+        self._vectors.flush()
+        self._generation += 1
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "model_name": self.model_name,
+                "dim": self._dim,
+                "capacity": self.max_disk_items,
+                "generation": self._generation,
+                "rows": list(self._disk_rows.items()),
+            }, f)
+        os.replace(tmp_path, index_path)  # Atomic so a crash never leaves a half-written index
+
+        # A crash before the new log is in place leaves the old one, which is ignored:
+        # its generation no longer matches the index
+        with open(log_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(f"{self._generation}\n")
+        os.replace(log_path + ".tmp", log_path)
+        self._log = open(log_path, "a", encoding="utf-8")
+        self._log_entries = 0
+
+
+# === Function: Wrap an Embedding Model Once ===
+def with_embedding_cache(embeddings, **cache_kwargs):
+    """
+    Wraps `embeddings` in a CachedEmbeddings unless it already is one.
+
+    Caches are shared per model name, so every caller embedding with the same
+    model hits the same tiers.
+
+    Args:
+        embeddings: Embedding model (e.g., HuggingFaceEmbeddings)
+        **cache_kwargs: Extra arguments for CachedEmbeddings on first creation
+
+    Returns:
+        CachedEmbeddings: The shared cache for this model
+    """
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings
+
+    model_name = getattr(embeddings, "model_name", type(embeddings).__name__)
+    with _shared_caches_lock:
+        if model_name not in _shared_caches:
+            _shared_caches[model_name] = CachedEmbeddings(embeddings, **cache_kwargs)
+        return _shared_caches[model_name]
+
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
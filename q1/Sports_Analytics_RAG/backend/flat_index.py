@@ -0,0 +1,467 @@
+"""
+🧮 In-Process Flat Vector Index
+
+A lightweight alternative to Chroma for corpora up to a few hundred thousand chunks:
+1. Normalized embeddings live in one contiguous matrix (float32, float16 or int8-quantized)
+2. The matrix is saved as .npy and memory-mapped when loaded
+3. Search is a single matrix product plus `argpartition` top-k
+4. Ids, texts and metadata live in packed UTF-8 columns (one blob plus an offsets
+   array each), memory-mapped too; a string is only decoded when it is returned
+
+Writes hold a lock; a search takes it only to grab a consistent view of the rows,
+then scores without it, so searches from the pipeline's thread pool run in parallel
+with each other and with ingestion.
+
+It implements the LangChain VectorStore interface, so `as_retriever`,
+`add_documents` and `delete` work exactly as they do with Chroma.
+"""
+
+import copy
+import json
+import os
+import threading
+from collections.abc import Sequence
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.vectorstore import VectorStore
+
+VECTORS_FILE = "flat_vectors.npy"
+SCALES_FILE = "flat_scales.npy"
+CONFIG_FILE = "flat_index.json"
+COLUMN_FILES = {"ids": "flat_ids", "texts": "flat_texts", "metadatas": "flat_metadatas"}
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+
+# === Helpers: Normalise and Quantize Vectors ===
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _encode(vectors, dtype):
+    """Returns (stored matrix, per-row scales or None) for normalized float32 vectors."""
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    # int8: symmetric per-row quantization
+    scales = np.abs(vectors).max(axis=1)
+    scales[scales == 0] = 1.0
+    codes = np.round(vectors / scales[:, None] * 127).astype(np.int8)
+    return codes, (scales / 127).astype(np.float32)
+
+
+# === Helper: Packed, Memory-Mapped String Columns ===
+class PackedStrings(Sequence):
+    """
+    Read-only list of strings stored as one UTF-8 blob plus an (n + 1) offsets array.
+    Both files are memory-mapped; a string is only decoded when it is accessed.
+
+    Args:
+        path (str): Path prefix (`<path>.bin` and `<path>.offsets.npy`)
+        as_json (bool): Decode every item as JSON (used for metadata)
+    """
+
+    def __init__(self, path, as_json=False):
+        self._offsets = np.load(path + ".offsets.npy", mmap_mode="r")
+        size = int(self._offsets[-1])
+        self._data = np.memmap(path + ".bin", dtype=np.uint8, mode="r") if size else np.empty(0, np.uint8)
+        self._as_json = as_json
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        text = bytes(self._data[start:end]).decode("utf-8")
+        return json.loads(text) if self._as_json else text
+
+
+# === Class: Packed Column Store ===
+class _ColumnStore:
+    """
+    Ids, texts and metadata of every row.
+
+    Rows written by the last `save` are memory-mapped packed columns; rows added
+    since wait in lists until the next save. Deletes only remap logical rows to
+    stored ones, so saved columns are never read back into memory: the next save
+    writes the rows out in their new order, copying saved items as raw bytes.
+
+    Args:
+        files (Dict[str, str]): File prefix of each column ("ids", "texts", "metadatas")
+        directory (str, optional): Folder the columns were saved in
+    """
+
+    def __init__(self, files, directory=None):
+        self.files = files
+        self.saved = {name: [] for name in files}  # PackedStrings once saved
+        self.pending = {name: [] for name in files}
+        self.rows = None    # Logical row -> stored row (None: the same)
+        self.length = None  # Fixed row count of a snapshot
+        if directory:
+            self._open(directory)
+
+    def __len__(self):
+        if self.length is not None:
+            return self.length
+        return self.num_stored if self.rows is None else len(self.rows)
+
+    @property
+    def num_saved(self):
+        return len(self.saved["ids"])
+
+    @property
+    def num_stored(self):
+        return self.num_saved + len(self.pending["ids"])
+
+    def append(self, ids, texts, metadatas):
+        """Adds rows at the end."""
+        first = self.num_stored
+        self.pending["ids"].extend(ids)
+        self.pending["texts"].extend(texts)
+        self.pending["metadatas"].extend(metadatas)
+        if self.rows is not None:
+            self.rows = np.concatenate([self.rows, np.arange(first, self.num_stored)])
+
+    def select(self, logical_rows):
+        """Keeps only `logical_rows`, in that order (for deletes and reordering)."""
+        self.rows = self._stored(logical_rows)
+
+    def value(self, name, row):
+        """The id, text or metadata of one row."""
+        stored = int(row if self.rows is None else self.rows[row])
+        if stored < self.num_saved:
+            return self.saved[name][stored]
+        return self.pending[name][stored - self.num_saved]
+
+    def snapshot(self):
+        """
+        Frozen view of the current rows, readable while writes go on (take it under the
+        index lock). Writes only append to the pending lists and rebind `rows`, so the
+        view shares both and just stops at today's length.
+        """
+        frozen = copy.copy(self)
+        frozen.length = len(self)
+        return frozen
+
+    def save(self, directory):
+        """Writes every column in logical order and returns a store reading them back."""
+        self._write_columns(directory)
+        return _ColumnStore(self.files, directory)
+
+    def _stored(self, logical_rows):
+        logical_rows = np.asarray(logical_rows, dtype=np.int64)
+        return logical_rows if self.rows is None else self.rows[logical_rows]
+
+    def _write_columns(self, directory):
+        stored = self._stored(np.arange(len(self)))
+        for name, filename in self.files.items():
+            self._write_column(os.path.join(directory, filename), name, stored)
+
+    def _write_column(self, path, name, stored):
+        """Writes one packed column atomically; saved items are copied without decoding."""
+        saved, pending = self.saved[name], self.pending[name]
+        packed = isinstance(saved, PackedStrings)
+        offsets = [0]
+        with open(path + ".bin.tmp", "wb") as out:
+            for row in stored.tolist():
+                if packed and row < len(saved):
+                    data = saved._data[int(saved._offsets[row]):int(saved._offsets[row + 1])]
+                else:
+                    item = saved[row] if row < len(saved) else pending[row - len(saved)]
+                    data = (json.dumps(item) if name == "metadatas" else item).encode("utf-8")
+                out.write(data)
+                offsets.append(offsets[-1] + len(data))
+        with open(path + ".offsets.npy.tmp", "wb") as f:
+            np.save(f, np.asarray(offsets, dtype=np.int64))
+        os.replace(path + ".bin.tmp", path + ".bin")
+        os.replace(path + ".offsets.npy.tmp", path + ".offsets.npy")
+
+    def _open(self, directory):
+        if os.path.exists(os.path.join(directory, self.files["ids"] + ".offsets.npy")):
+            for name, filename in self.files.items():
+                self.saved[name] = PackedStrings(os.path.join(directory, filename), as_json=name == "metadatas")
+
+
+class _Column(Sequence):
+    """Read-only view of one column of a column store (ids, texts or metadatas)."""
+
+    def __init__(self, store, name):
+        self._store = store
+        self._name = name
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("row out of range")
+        return self._store.value(self._name, index)
+
+
+# === Class: Flat Index Vector Store ===
+class NumpyFlatIndex(VectorStore):
+    """
+    Exact cosine-similarity search over an in-memory (or memory-mapped) matrix.
+
+    Args:
+        embedding_function: Embedding model used for queries and new texts
+        persist_directory (str, optional): Where the index files are saved
+        dtype (str): Storage precision - "float32", "float16" or "int8"
+        block_size (int): Rows scored per matrix product (bounds temporary memory)
+    """
+
+    def __init__(self, embedding_function, persist_directory=None, dtype="float32", block_size=65536):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+
+        self._embedding_function = embedding_function
+        self._persist_directory = persist_directory
+        self.dtype = dtype
+        self.block_size = block_size
+
+        self._matrix = None   # (n, dim) stored vectors
+        self._scales = None   # (n,) int8 dequantization scales
+        self._columns = _ColumnStore(COLUMN_FILES)  # Ids, texts and metadata
+        self._id_to_row = None  # Built on the first write
+        self._lock = threading.RLock()  # Writes (searches only to take a snapshot)
+
+        if persist_directory and os.path.exists(os.path.join(persist_directory, CONFIG_FILE)):
+            self._load()
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    @property
+    def _ids(self):
+        return _Column(self._columns, "ids")
+
+    @property
+    def _texts(self):
+        return _Column(self._columns, "texts")
+
+    @property
+    def _metadatas(self):
+        return _Column(self._columns, "metadatas")
+
+    def count(self):
+        """Number of stored vectors."""
+        return len(self._columns)
+
+    # --- Writing ---
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """Embeds and stores `texts`. Existing ids are replaced (upsert semantics)."""
+        texts = list(texts)
+        vectors = self._embedding_function.embed_documents(texts)
+        return self.add_vectors(texts, vectors, metadatas, ids)
+
+    def add_vectors(self, texts, vectors, metadatas=None, ids=None):
+        """Stores precomputed vectors (upsert semantics on ids)."""
+        texts = list(texts)
+        metadatas = [metadata or {} for metadata in metadatas] if metadatas is not None else [{} for _ in texts]
+        codes, scales = _encode(_normalize(vectors), self.dtype)
+
+        with self._lock:
+            ids = list(ids) if ids is not None else [f"flat-{self.count() + i}" for i in range(len(texts))]
+
+            # Replacing existing ids = delete then append
+            existing = [chunk_id for chunk_id in ids if chunk_id in self._row_index()]
+            if existing:
+                self.delete(existing)
+
+            # Arrays are replaced, never changed in place, so snapshots stay consistent
+            if self._matrix is None or not self.count():
+                self._matrix, self._scales = codes, scales
+            else:
+                self._matrix = np.concatenate([self._matrix, codes])
+                if scales is not None:
+                    self._scales = np.concatenate([self._scales, scales])
+
+            id_to_row = self._row_index()
+            for row, chunk_id in enumerate(ids, self.count()):
+                id_to_row[chunk_id] = row
+            self._columns.append(ids, texts, metadatas)
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        """Removes the given ids from the index."""
+        with self._lock:
+            id_to_row = self._row_index()
+            rows = [id_to_row[chunk_id] for chunk_id in set(ids or []) if chunk_id in id_to_row]
+            if not rows:
+                return True
+
+            keep = np.ones(self.count(), dtype=bool)
+            keep[rows] = False
+            self._matrix = self._matrix[keep]
+            if self._scales is not None:
+                self._scales = self._scales[keep]
+            self._columns.select(np.flatnonzero(keep))
+            removed_before = np.cumsum(~keep)
+            self._id_to_row = {
+                chunk_id: row - int(removed_before[row]) for chunk_id, row in id_to_row.items() if keep[row]
+            }
+        return True
+
+    def persist(self):
+        """Writes the matrix and the packed columns to `persist_directory`."""
+        if not self._persist_directory:
+            return
+        with self._lock:
+            os.makedirs(self._persist_directory, exist_ok=True)
+
+            def atomic_save(name, array):
+                path = os.path.join(self._persist_directory, name)
+                with open(path + ".tmp", "wb") as f:
+                    np.save(f, array)
+                os.replace(path + ".tmp", path)
+
+            if self._matrix is not None:
+                atomic_save(VECTORS_FILE, np.ascontiguousarray(self._matrix))
+            if self._scales is not None:
+                atomic_save(SCALES_FILE, self._scales)
+
+            self._columns = self._columns.save(self._persist_directory)
+            config_path = os.path.join(self._persist_directory, CONFIG_FILE)
+            with open(config_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"dtype": self.dtype, "count": self.count()}, f)
+            os.replace(config_path + ".tmp", config_path)
+
+    # --- Searching ---
+
+    def query_by_vectors(self, query_embeddings, k=10):
+        """
+        Top-k search for several query vectors at once.
+
+        Returns:
+            Dict shaped like Chroma's `collection.query` result: "ids", "documents",
+            "metadatas", "embeddings" and "scores", each a list per query
+        """
+        results = {"ids": [], "documents": [], "metadatas": [], "embeddings": [], "scores": []}
+        queries = _normalize(query_embeddings)
+        with self._lock:
+            index = self._snapshot()
+        n = index.count()
+
+        if n == 0:
+            for _ in range(len(queries)):
+                for key in results:
+                    results[key].append([])
+            return results
+
+        k = min(k, n)
+        scores = index._score(queries)  # (num_queries, n)
+
+        for query_scores in scores:
+            # argpartition finds the k best in O(n); only those k get sorted
+            top = np.argpartition(-query_scores, k - 1)[:k]
+            top = top[np.argsort(-query_scores[top])]
+            results["ids"].append([index._columns.value("ids", i) for i in top])
+            results["documents"].append([index._columns.value("texts", i) for i in top])
+            results["metadatas"].append([index._columns.value("metadatas", i) for i in top])
+            results["embeddings"].append([index._vector(i) for i in top])
+            results["scores"].append(query_scores[top].tolist())
+        return results
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        results = self.query_by_vectors([self._embedding_function.embed_query(query)], k)
+        return [
+            (Document(page_content=text, metadata=dict(metadata)), score)
+            for text, metadata, score in zip(
+                results["documents"][0], results["metadatas"][0], results["scores"][0]
+            )
+        ]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _similarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score(query, k)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None,
+                   dtype="float32", **kwargs):
+        index = cls(embedding, persist_directory=persist_directory, dtype=dtype)
+        index.add_texts(texts, metadatas=metadatas, ids=ids)
+        index.persist()
+        return index
+
+    # --- Internal helpers ---
+
+    def _score(self, queries):
+        """Cosine scores of every stored row against every query, block by block."""
+        n = self.count()
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        for start in range(0, n, self.block_size):
+            block = np.asarray(self._matrix[start:start + self.block_size], dtype=np.float32)
+            block_scores = queries @ block.T
+            if self._scales is not None:
+                block_scores *= self._scales[start:start + self.block_size]
+            scores[:, start:start + len(block)] = block_scores
+        return scores
+
+    def get_vectors(self, start, end):
+        """Dequantized float32 vectors of rows `start:end` (for exporting the index)."""
+        with self._lock:
+            matrix, scales = self._matrix, self._scales
+        block = np.asarray(matrix[start:end], dtype=np.float32)
+        if scales is not None:
+            block = block * np.asarray(scales[start:end])[:, None]
+        return block
+
+    def _vector(self, row):
+        vector = np.asarray(self._matrix[row], dtype=np.float32)
+        if self._scales is not None:
+            vector = vector * self._scales[row]
+        return vector.tolist()
+
+    def _snapshot(self):
+        """
+        Shallow copy of the index to search without the lock (take it under the lock):
+        writes replace the matrix and scales instead of changing them in place, and the
+        columns are frozen separately.
+        """
+        index = copy.copy(self)
+        index._columns = self._columns.snapshot()
+        return index
+
+    def _row_index(self):
+        """id -> row. Built on the first write, which reads every id once."""
+        if self._id_to_row is None:
+            self._id_to_row = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        return self._id_to_row
+
+    def _load(self):
+        with open(os.path.join(self._persist_directory, CONFIG_FILE), "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        self.dtype = config["dtype"]
+        self._columns = _ColumnStore(COLUMN_FILES, self._persist_directory)
+        self._id_to_row = None
+
+        # Memory-map the vectors: only the pages a search touches get read
+        vectors_path = os.path.join(self._persist_directory, VECTORS_FILE)
+        if os.path.exists(vectors_path):
+            self._matrix = np.load(vectors_path, mmap_mode="r")
+        scales_path = os.path.join(self._persist_directory, SCALES_FILE)
+        if os.path.exists(scales_path):
+            self._scales = np.load(scales_path, mmap_mode="r")
+
+
+def has_flat_index(persist_dir):
+    """Whether `persist_dir` holds a saved NumpyFlatIndex."""
+    return bool(persist_dir) and os.path.exists(os.path.join(persist_dir, CONFIG_FILE))
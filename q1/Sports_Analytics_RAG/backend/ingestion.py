@@ -0,0 +1,370 @@
+"""
+🔄 Corpus Ingestion
+
+This module keeps the vector database in sync with the sports documents folder:
+1. Tracks every ingested file in a manifest (path, size, mtime, content hash, chunk ids)
+2. Re-chunks and re-embeds only new or changed files, segmenting and embedding
+   their sentences once for the sentence side store used by compression
+3. Deletes the vectors of files that were removed from the folder
+4. Bulk-loads a whole corpus with a parallel read/chunk → embed → upsert pipeline
+
+A refresh therefore costs time proportional to what changed, not to the corpus size.
+
+Run from the command line:
+    python ingestion.py --folder data/sports_documents [--incremental] [--publish-dir ./serving_index]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from data_loader import load_document, chunk_documents
+from embedding_cache import with_embedding_cache
+from near_duplicates import add_fingerprints
+from sentence_store import open_sentence_store
+from vector_db import (
+    load_existing_database,
+    mark_corpus_updated,
+    load_embedding_model,
+    upsert_vectors,
+    flush_vector_store
+)
+
+MANIFEST_NAME = "ingest_manifest.json"
+
+
+# === Helper: Hash a File's Contents ===
+def file_content_hash(file_path: str) -> str:
+    """
+    Computes the SHA-256 of a file, reading it in blocks to bound memory use.
+
+    Args:
+        file_path (str): File to hash
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# === Helper: Stable Chunk IDs ===
+def make_chunk_ids(filename: str, content_hash: str, num_chunks: int):
+    """Chunk ids depend on the file and its content, so re-ingesting is idempotent."""
+    return [f"{filename}:{content_hash[:16]}:{i}" for i in range(num_chunks)]
+
+
+# === Helper: Read / Write the Manifest ===
+def load_manifest(manifest_path: str) -> dict:
+    """Returns the saved manifest, or an empty one if none exists yet."""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, manifest_path: str):
+    """Writes the manifest atomically so an interrupted run never corrupts it."""
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+# === Function: Incremental Ingestion ===
+def ingest_incrementally(folder_path: str, embeddings, persist_dir="./chroma_db",
+                         chunk_size=500, chunk_overlap=50, backend=None):
+    """
+    Brings the vector database in line with the .txt files in `folder_path`.
+
+    Files whose size and mtime are unchanged are skipped without being read.
+    Files whose metadata changed are hashed, and only re-embedded if their
+    content really changed. Vectors for deleted files are removed.
+
+    Args:
+        folder_path (str): Folder containing the .txt corpus
+        embeddings: Embedding model (e.g., HuggingFaceEmbeddings)
+        persist_dir (str): Directory of the ChromaDB (the manifest lives here too)
+        chunk_size (int): Number of characters per chunk
+        chunk_overlap (int): Number of characters to overlap between chunks
+        backend (str, optional): Vector store backend ("chroma", "flat" or "ivfpq")
+
+    Returns:
+        Tuple[Chroma, Dict[str, List[str]]]: The vector store and a summary of
+        which files were added, updated, removed and left unchanged
+    """
+    print(f"🔄 Incrementally ingesting {folder_path} into {persist_dir}")
+
+    os.makedirs(persist_dir, exist_ok=True)
+    manifest_path = os.path.join(persist_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    vectordb = load_existing_database(embeddings, persist_dir, backend)
+    sentence_store = open_sentence_store(persist_dir)
+
+    summary = {"added": [], "updated": [], "removed": [], "unchanged": []}
+
+    current_files = sorted(f for f in os.listdir(folder_path) if f.endswith(".txt"))
+
+    # Step 1: Drop vectors for files that no longer exist
+    for filename in sorted(set(manifest) - set(current_files)):
+        chunk_ids = manifest.pop(filename)["chunk_ids"]
+        if chunk_ids:
+            vectordb.delete(ids=chunk_ids)
+        summary["removed"].append(filename)
+        print(f"  🗑️ Removed {filename} ({len(chunk_ids)} chunks)")
+
+    # Step 2: Add new files and refresh changed ones
+    for filename in current_files:
+        file_path = os.path.join(folder_path, filename)
+        stat = os.stat(file_path)
+        entry = manifest.get(filename)
+
+        # Cheap check first: same size and mtime means the file wasn't touched
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            summary["unchanged"].append(filename)
+            continue
+
+        content_hash = file_content_hash(file_path)
+        if entry and entry["sha256"] == content_hash:
+            # Touched but not modified: just remember the new metadata
+            entry.update(size=stat.st_size, mtime=stat.st_mtime)
+            summary["unchanged"].append(filename)
+            continue
+
+        # New or modified: replace whatever chunks we had for this file
+        if entry and entry["chunk_ids"]:
+            vectordb.delete(ids=entry["chunk_ids"])
+
+        chunks = chunk_documents(load_document(file_path), chunk_size, chunk_overlap)
+        chunk_ids = make_chunk_ids(filename, content_hash, len(chunks))
+        if chunks:
+            vectordb.add_documents(chunks, ids=chunk_ids)
+            sentence_store.add_chunks([chunk.page_content for chunk in chunks], embeddings)
+
+        summary["updated" if entry else "added"].append(filename)
+        manifest[filename] = {
+            "path": file_path,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": content_hash,
+            "chunk_ids": chunk_ids,
+        }
+        print(f"  📄 {'Updated' if entry else 'Added'} {filename} ({len(chunks)} chunks)")
+
+        # Save after every file so an interrupted run resumes where it stopped
+        flush_vector_store(vectordb)
+        save_manifest(manifest, manifest_path)
+
+    flush_vector_store(vectordb)
+    sentence_store.persist()
+    save_manifest(manifest, manifest_path)
+    if summary["added"] or summary["updated"] or summary["removed"]:
+        mark_corpus_updated(persist_dir)
+
+    print(
+        f"  ✅ Ingestion done: {len(summary['added'])} added, {len(summary['updated'])} updated, "
+        f"{len(summary['removed'])} removed, {len(summary['unchanged'])} unchanged"
+    )
+    return vectordb, summary
+
+
+# === Stage 1 Worker: Read and Chunk One File (runs in a separate process) ===
+def _read_and_chunk_file(file_path: str, chunk_size: int, chunk_overlap: int):
+    """
+    Loads, hashes and chunks a single file. Kept at module level so it can be
+    sent to a process pool.
+
+    Returns:
+        Tuple[str, dict, List[Document]]: Filename, its manifest entry and its chunks
+    """
+    filename = os.path.basename(file_path)
+    stat = os.stat(file_path)
+    content_hash = file_content_hash(file_path)
+
+    # Split directly (not via chunk_documents) to keep worker output quiet
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = add_fingerprints(splitter.split_documents(load_document(file_path)))
+
+    entry = {
+        "path": file_path,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": content_hash,
+        "chunk_ids": make_chunk_ids(filename, content_hash, len(chunks)),
+    }
+    return filename, entry, chunks
+
+
+# === Function: Parallel Bulk Ingestion ===
+def bulk_ingest(folder_path: str, embeddings, persist_dir="./chroma_db",
+                chunk_size=500, chunk_overlap=50, num_workers=None,
+                embed_batch_size=64, write_batch_size=512, backend=None):
+    """
+    Ingests every .txt file in `folder_path` with a three-stage pipeline:
+    1. Files are read, hashed and chunked in parallel on a process pool
+    2. Chunks (and their sentences, for the sentence store) are embedded in
+       batches of `embed_batch_size`
+    3. Vectors are upserted into Chroma `write_batch_size` chunks at a time
+
+    Only a small window of files and one write batch of vectors are held in memory
+    at once, and the manifest is written so later runs can use `ingest_incrementally`.
+
+    Args:
+        folder_path (str): Folder containing the .txt corpus
+        embeddings: Embedding model (e.g., HuggingFaceEmbeddings)
+        persist_dir (str): Directory of the ChromaDB
+        chunk_size (int): Number of characters per chunk
+        chunk_overlap (int): Number of characters to overlap between chunks
+        num_workers (int): Processes used for reading/chunking (default: CPU count)
+        embed_batch_size (int): Texts per embedding model call
+        write_batch_size (int): Chunks per Chroma upsert
+        backend (str, optional): Vector store backend ("chroma", "flat" or "ivfpq")
+
+    Returns:
+        Tuple[Chroma, Dict[str, float]]: The vector store and throughput statistics
+    """
+    print(f"🚚 Bulk ingesting {folder_path} into {persist_dir}")
+
+    os.makedirs(persist_dir, exist_ok=True)
+    manifest_path = os.path.join(persist_dir, MANIFEST_NAME)
+    manifest = {}  # Rebuilt from scratch; the old one is only used to find stale chunks
+    embeddings = with_embedding_cache(embeddings)
+    vectordb = load_existing_database(embeddings, persist_dir, backend)
+    sentence_store = open_sentence_store(persist_dir)
+
+    file_paths = sorted(
+        os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(".txt")
+    )
+
+    stats = {"docs": 0, "chunks": 0, "embeddings": 0, "sentences": 0}
+    stage_seconds = {"embed": 0.0, "sentences": 0.0, "write": 0.0}
+    pending_ids, pending_chunks = [], []
+
+    def embed_and_write(ids, chunks):
+        # Stage 2: embed the chunks in model-sized batches
+        texts = [chunk.page_content for chunk in chunks]
+        started = time.perf_counter()
+        vectors = []
+        for start in range(0, len(texts), embed_batch_size):
+            vectors.extend(embeddings.embed_documents(texts[start:start + embed_batch_size]))
+        stage_seconds["embed"] += time.perf_counter() - started
+        stats["embeddings"] += len(vectors)
+
+        started = time.perf_counter()
+        stats["sentences"] += sentence_store.add_chunks(texts, embeddings, embed_batch_size)
+        stage_seconds["sentences"] += time.perf_counter() - started
+
+        # Stage 3: one upsert for the whole batch
+        started = time.perf_counter()
+        upsert_vectors(vectordb, ids, vectors, texts, [chunk.metadata for chunk in chunks])
+        stage_seconds["write"] += time.perf_counter() - started
+
+    started_at = time.perf_counter()
+
+    # Stage 1: read + chunk on a process pool. Only a small window of files is in
+    # flight at once so a slow embedding stage can't let chunks pile up in memory.
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        window = 2 * (num_workers or os.cpu_count() or 1)
+        in_flight = deque()
+        remaining = iter(file_paths)
+
+        for file_path in islice(remaining, window):
+            in_flight.append(pool.submit(_read_and_chunk_file, file_path, chunk_size, chunk_overlap))
+
+        while in_flight:
+            filename, entry, chunks = in_flight.popleft().result()
+            for file_path in islice(remaining, 1):
+                in_flight.append(pool.submit(_read_and_chunk_file, file_path, chunk_size, chunk_overlap))
+
+            stats["docs"] += 1
+            stats["chunks"] += len(chunks)
+            manifest[filename] = entry
+
+            pending_ids.extend(entry["chunk_ids"])
+            pending_chunks.extend(chunks)
+            while len(pending_chunks) >= write_batch_size:
+                embed_and_write(pending_ids[:write_batch_size], pending_chunks[:write_batch_size])
+                del pending_ids[:write_batch_size]
+                del pending_chunks[:write_batch_size]
+
+    if pending_chunks:
+        embed_and_write(pending_ids, pending_chunks)
+
+    # Remove chunks from an earlier ingestion that no longer exist
+    current_ids = {chunk_id for entry in manifest.values() for chunk_id in entry["chunk_ids"]}
+    stale_ids = [
+        chunk_id
+        for entry in load_manifest(manifest_path).values()
+        for chunk_id in entry["chunk_ids"]
+        if chunk_id not in current_ids
+    ]
+    if stale_ids:
+        vectordb.delete(ids=stale_ids)
+        print(f"  🗑️ Removed {len(stale_ids)} stale chunks")
+
+    flush_vector_store(vectordb)
+    sentence_store.persist()
+    save_manifest(manifest, manifest_path)
+    mark_corpus_updated(persist_dir)
+
+    elapsed = max(time.perf_counter() - started_at, 1e-9)
+    report = {
+        "seconds": round(elapsed, 3),
+        "docs_per_s": round(stats["docs"] / elapsed, 2),
+        "chunks_per_s": round(stats["chunks"] / elapsed, 2),
+        "embeddings_per_s": round(stats["embeddings"] / max(stage_seconds["embed"], 1e-9), 2),
+        "embed_seconds": round(stage_seconds["embed"], 3),
+        "sentence_seconds": round(stage_seconds["sentences"], 3),
+        "write_seconds": round(stage_seconds["write"], 3),
+        **stats,
+    }
+
+    print(
+        f"  ✅ Ingested {stats['docs']} docs / {stats['chunks']} chunks in {report['seconds']}s "
+        f"({report['docs_per_s']} docs/s, {report['chunks_per_s']} chunks/s, "
+        f"{report['embeddings_per_s']} embeddings/s)"
+    )
+    return vectordb, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the sports corpus into the vector database")
+    parser.add_argument("--folder", default="data/sports_documents")
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    parser.add_argument("--incremental", action="store_true", help="Only ingest what changed")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--embed-batch-size", type=int, default=64)
+    parser.add_argument("--write-batch-size", type=int, default=512)
+    parser.add_argument("--backend", choices=["chroma", "flat", "ivfpq"], default=None)
+    parser.add_argument("--publish-dir", default=None,
+                        help="Afterwards, publish a read-only snapshot here for multi-worker serving")
+    args = parser.parse_args()
+
+    embedding_model = load_embedding_model()
+
+    if args.incremental:
+        vectordb, _ = ingest_incrementally(args.folder, embedding_model, args.persist_dir, backend=args.backend)
+    else:
+        vectordb, _ = bulk_ingest(
+            args.folder,
+            embedding_model,
+            args.persist_dir,
+            num_workers=args.workers,
+            embed_batch_size=args.embed_batch_size,
+            write_batch_size=args.write_batch_size,
+            backend=args.backend,
+        )
+
+    if args.publish_dir:
+        from shared_index import publish_snapshot
+        publish_snapshot(vectordb, args.publish_dir, persist_dir=args.persist_dir)
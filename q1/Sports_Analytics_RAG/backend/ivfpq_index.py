@@ -0,0 +1,584 @@
+"""
+🧭 Approximate Nearest-Neighbour Index (IVF + Product Quantization)
+
+For corpora of millions of chunks, where exhaustive search is too slow and the raw
+vectors no longer fit in RAM:
+1. Coarse k-means centroids split the corpus into `nlist` inverted lists (IVF)
+2. Each vector's residual to its centroid is compressed to `m` one-byte codes (PQ)
+3. A query scans only the `nprobe` closest lists, scoring codes with one lookup
+   table per query (asymmetric distance computation)
+4. Optionally, the shortlist is re-scored exactly against the full vectors, which
+   stay on disk (memory-mapped) and are only read for those few rows
+
+The index is trained from a sample of the corpus. Vectors added before training
+are kept and encoded once training happens (on the first search or persist), and
+the index retrains itself on persist once the corpus has grown `retrain_growth`
+times past the size it was trained at. Training and writes hold one lock; a
+search takes it only to train on first use and to grab a consistent view of the
+arrays, then scores without it, so concurrent searches run in parallel.
+
+Only the centroids, codebooks and codes are held in RAM. The full vectors and the
+ids, texts and metadata stay on disk (memory-mapped, as packed UTF-8 columns like
+the flat index's); rows added since the last persist wait in small pending
+blocks, like the sentence store's.
+Like the flat index, it implements the LangChain VectorStore interface.
+"""
+
+import copy
+import json
+import os
+import threading
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.vectorstore import VectorStore
+
+from flat_index import _Column, _ColumnStore, _normalize
+
+CONFIG_FILE = "ivfpq_config.json"
+RAW_FILE = "ivfpq_raw.npy"
+ARRAY_FILES = {
+    "centroids": "ivfpq_centroids.npy",
+    "codebooks": "ivfpq_codebooks.npy",
+    "codes": "ivfpq_codes.npy",
+    "assignments": "ivfpq_assignments.npy",
+    "code_terms": "ivfpq_code_terms.npy",
+}
+COLUMN_FILES = {"ids": "ivfpq_ids", "texts": "ivfpq_texts", "metadatas": "ivfpq_metadatas"}
+
+PQ_CODEWORDS = 256  # One byte per sub-vector
+
+
+# === Helpers: K-Means ===
+def _nearest_centroid(x, centroids, block_size=65536):
+    """Index of the closest centroid (squared L2) for every row of `x`."""
+    centroid_sq = (centroids ** 2).sum(axis=1)
+    nearest = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), block_size):
+        block = np.asarray(x[start:start + block_size], dtype=np.float32)
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, and ||x||^2 doesn't change the argmin
+        distances = centroid_sq[None, :] - 2 * block @ centroids.T
+        nearest[start:start + len(block)] = distances.argmin(axis=1)
+    return nearest
+
+
+def _kmeans(x, k, iterations=20, seed=0):
+    """Plain Lloyd's k-means; empty clusters are re-seeded from random points."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].astype(np.float32)
+
+    for _ in range(iterations):
+        assignments = _nearest_centroid(x, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=k)
+        nonempty = counts > 0
+
+        # Sum each cluster's points with one reduceat over the sorted rows
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        sums = np.add.reduceat(x[order], starts, axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        if not nonempty.all():
+            centroids[~nonempty] = x[rng.choice(len(x), (~nonempty).sum())]
+
+    return centroids
+
+
+def _pick_num_subspaces(dim, requested):
+    """Largest divisor of `dim` that is <= `requested`."""
+    for m in range(min(requested, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+# === Class: On-Disk Row Store ===
+class _RowStore(_ColumnStore):
+    """
+    Full vectors, ids, texts and metadata of every row, kept on disk.
+
+    Extends the flat index's column store with the float16 vectors: saved ones are
+    memory-mapped, and rows appended since the last `save` wait in pending blocks.
+    Deletes and re-clustering only remap rows, so nothing is read back into memory.
+
+    Args:
+        directory (str, optional): Folder the rows were saved in
+    """
+
+    def __init__(self, directory=None):
+        self.raw = None  # (saved rows, dim) float16, memory-mapped
+        self._pending_raw = []  # float16 blocks
+        super().__init__(COLUMN_FILES, directory)
+
+    @property
+    def dim(self):
+        if self.raw is not None:
+            return self.raw.shape[1]
+        return self._pending_raw[0].shape[1] if self._pending_raw else 0
+
+    def append(self, ids, texts, metadatas, raw):
+        """Adds rows at the end (`raw`: normalized float16 vectors)."""
+        super().append(ids, texts, metadatas)
+        self._pending_raw.append(raw)
+
+    def snapshot(self):
+        if len(self._pending_raw) > 1:
+            self._pending_raw = [np.concatenate(self._pending_raw)]
+        frozen = super().snapshot()
+        frozen._pending_raw = list(self._pending_raw)  # The live list keeps growing
+        return frozen
+
+    def vectors(self, logical_rows, dtype=np.float32):
+        """Full vectors of the given rows (only those rows are read from disk)."""
+        stored = self._stored(logical_rows)
+        vectors = np.empty((len(stored), self.dim), dtype=dtype)
+        saved = stored < self.num_saved
+        if saved.any():
+            vectors[saved] = self.raw[stored[saved]]
+        if not saved.all():
+            if len(self._pending_raw) > 1:
+                self._pending_raw = [np.concatenate(self._pending_raw)]
+            vectors[~saved] = self._pending_raw[0][stored[~saved] - self.num_saved]
+        return vectors
+
+    def save(self, directory, block_size=65536):
+        """
+        Writes every row in logical order (each file atomically) and returns a store
+        reading them back from `directory`.
+        """
+        raw_path = os.path.join(directory, RAW_FILE)
+        if len(self):
+            raw = np.lib.format.open_memmap(raw_path + ".tmp", mode="w+", dtype=np.float16, shape=(len(self), self.dim))
+            for start in range(0, len(self), block_size):
+                end = min(start + block_size, len(self))
+                raw[start:end] = self.vectors(np.arange(start, end), dtype=np.float16)
+            raw.flush()
+            del raw
+            os.replace(raw_path + ".tmp", raw_path)
+        elif os.path.exists(raw_path):
+            os.remove(raw_path)
+
+        self._write_columns(directory)
+        return _RowStore(directory)
+
+    def _open(self, directory):
+        raw_path = os.path.join(directory, RAW_FILE)
+        if os.path.exists(raw_path):
+            self.raw = np.load(raw_path, mmap_mode="r")
+        super()._open(directory)
+
+
+class _StoredVectors:
+    """Slices of a row store's vectors, read block by block (what `_encode` needs)."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, rows):
+        return self._store.vectors(np.arange(*rows.indices(len(self))))
+
+
+# === Class: IVF-PQ Vector Store ===
+class IVFPQIndex(VectorStore):
+    """
+    Approximate cosine-similarity search with an inverted file and product quantization.
+
+    Args:
+        embedding_function: Embedding model used for queries and new texts
+        persist_directory (str, optional): Where the index files are saved
+        nlist (int, optional): Number of coarse clusters (default: ~4*sqrt(n) at training time)
+        num_subspaces (int): PQ sub-vectors per vector, i.e. bytes per stored code
+        nprobe (int): Inverted lists scanned per query (higher = better recall, slower)
+        rescore (bool): Re-score the shortlist exactly with the full vectors
+        rescore_factor (int): Shortlist size as a multiple of k when re-scoring
+        train_sample_size (int): Vectors sampled to train centroids and codebooks
+        retrain_growth (float): Retrain on persist once the corpus is this many times
+            larger than when the index was last trained
+    """
+
+    def __init__(self, embedding_function, persist_directory=None, nlist=None, num_subspaces=48,
+                 nprobe=8, rescore=True, rescore_factor=10, train_sample_size=50_000, retrain_growth=4.0):
+        self._embedding_function = embedding_function
+        self._persist_directory = persist_directory
+        self.requested_nlist = nlist  # None = sized from the corpus at every training
+        self.nlist = nlist
+        self.num_subspaces = num_subspaces
+        self.nprobe = nprobe
+        self.rescore = rescore
+        self.rescore_factor = rescore_factor
+        self.train_sample_size = train_sample_size
+        self.retrain_growth = retrain_growth
+        self.trained_size = 0    # Corpus size at the last training
+
+        self.centroids = None    # (nlist, dim)
+        self.codebooks = None    # (m, 256, dim / m)
+        self.codes = None        # (n, m) uint8, rows without codes yet are untrained
+        self.assignments = None  # (n,) list id per row
+        self.code_terms = None   # (n,) query-independent part of each row's distance
+
+        self._rows = _RowStore()  # Full vectors, ids, texts and metadata (on disk once persisted)
+        self._id_to_row = None    # Built on the first write
+        self._list_rows = None    # Rows grouped by list (rebuilt lazily after writes)
+        self._list_offsets = None
+        self._lock = threading.RLock()  # Training and writes (searches only to start)
+
+        if persist_directory and os.path.exists(os.path.join(persist_directory, CONFIG_FILE)):
+            self._load()
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @property
+    def _ids(self):
+        return _Column(self._rows, "ids")
+
+    @property
+    def _texts(self):
+        return _Column(self._rows, "texts")
+
+    @property
+    def _metadatas(self):
+        return _Column(self._rows, "metadatas")
+
+    def count(self):
+        """Number of stored vectors."""
+        return len(self._rows)
+
+    def get_vectors(self, start, end):
+        """Full-precision (float16 -> float32) vectors of rows `start:end` (for exporting the index)."""
+        with self._lock:
+            return self._rows.vectors(np.arange(start, min(end, self.count())))
+
+    # --- Training ---
+
+    def train(self, sample=None):
+        """
+        Learns the coarse centroids and PQ codebooks, then (re-)encodes every stored vector.
+
+        Args:
+            sample (np.ndarray, optional): Vectors to train on (default: a random
+                sample of the stored vectors)
+        """
+        with self._lock:
+            if sample is None:
+                if not self.count():
+                    raise ValueError("Cannot train an empty IVF-PQ index")
+                rng = np.random.default_rng(0)
+                size = min(self.train_sample_size, self.count())
+                sample = self._rows.vectors(np.sort(rng.choice(self.count(), size, replace=False)))
+            sample = _normalize(sample)
+
+            dim = sample.shape[1]
+            nlist = self.requested_nlist or max(1, int(4 * np.sqrt(max(self.count(), len(sample)))))
+            nlist = min(nlist, len(sample))
+            m = _pick_num_subspaces(dim, self.num_subspaces)
+            print(f"🎯 Training IVF-PQ on {len(sample)} vectors (nlist={nlist}, m={m})")
+
+            # Coarse quantizer, then PQ codebooks on the residuals
+            self.centroids = _kmeans(sample, nlist)
+            residuals = sample - self.centroids[_nearest_centroid(sample, self.centroids)]
+            dsub = dim // m
+            self.codebooks = np.stack([
+                _kmeans(residuals[:, j * dsub:(j + 1) * dsub], PQ_CODEWORDS, iterations=15, seed=j)
+                for j in range(m)
+            ])
+            self.nlist, self.num_subspaces = nlist, m
+            self.trained_size = max(self.count(), len(sample))
+
+            if self.count():
+                self.assignments, self.codes, self.code_terms = self._encode(_StoredVectors(self._rows))
+            self._list_rows = None
+
+    def _encode(self, vectors, block_size=65536):
+        """
+        Returns (list assignments, PQ codes, code terms) for normalized vectors.
+
+        With r the PQ-reconstructed residual to centroid c, the squared distance is
+        ||q - c - r||^2 = ||q - c||^2 + (||r||^2 + 2<c, r>) - 2<q, r>. The middle
+        term doesn't depend on the query, so it is stored per row.
+        """
+        m, _, dsub = self.codebooks.shape
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+        code_terms = np.empty(len(vectors), dtype=np.float32)
+
+        for start in range(0, len(vectors), block_size):
+            block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+            rows = slice(start, start + len(block))
+            assignments[rows] = _nearest_centroid(block, self.centroids)
+            centroids = self.centroids[assignments[rows]]
+            residuals = block - centroids
+            for j in range(m):
+                codes[rows, j] = _nearest_centroid(residuals[:, j * dsub:(j + 1) * dsub], self.codebooks[j])
+            reconstructed = self.codebooks[np.arange(m), codes[rows]].reshape(len(block), -1)
+            code_terms[rows] = (reconstructed ** 2).sum(axis=1) + 2 * (centroids * reconstructed).sum(axis=1)
+
+        return assignments, codes, code_terms
+
+    # --- Writing ---
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """Embeds and stores `texts`. Existing ids are replaced (upsert semantics)."""
+        texts = list(texts)
+        vectors = self._embedding_function.embed_documents(texts)
+        return self.add_vectors(texts, vectors, metadatas, ids)
+
+    def add_vectors(self, texts, vectors, metadatas=None, ids=None):
+        """Stores precomputed vectors (upsert semantics on ids)."""
+        texts = list(texts)
+        metadatas = [metadata or {} for metadata in metadatas] if metadatas is not None else [{} for _ in texts]
+        vectors = _normalize(vectors)
+
+        with self._lock:
+            ids = list(ids) if ids is not None else [f"ivfpq-{self.count() + i}" for i in range(len(texts))]
+            existing = [chunk_id for chunk_id in ids if chunk_id in self._row_index()]
+            if existing:
+                self.delete(existing)
+
+            first = self.count()
+            self._rows.append(ids, texts, metadatas, vectors.astype(np.float16))
+
+            if self.is_trained:
+                assignments, codes, code_terms = self._encode(vectors)
+                self.assignments = assignments if self.assignments is None else np.concatenate([self.assignments, assignments])
+                self.codes = codes if self.codes is None else np.concatenate([self.codes, codes])
+                self.code_terms = code_terms if self.code_terms is None else np.concatenate([self.code_terms, code_terms])
+
+            id_to_row = self._row_index()
+            for row, chunk_id in enumerate(ids, first):
+                id_to_row[chunk_id] = row
+            self._list_rows = None
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        """Removes the given ids from the index."""
+        with self._lock:
+            id_to_row = self._row_index()
+            rows = [id_to_row[chunk_id] for chunk_id in set(ids or []) if chunk_id in id_to_row]
+            if not rows:
+                return True
+
+            keep = np.ones(self.count(), dtype=bool)
+            keep[rows] = False
+            self._rows.select(np.flatnonzero(keep))
+            if self.codes is not None:
+                self.codes = self.codes[keep]
+                self.assignments = self.assignments[keep]
+                self.code_terms = self.code_terms[keep]
+            removed_before = np.cumsum(~keep)
+            self._id_to_row = {
+                chunk_id: row - int(removed_before[row]) for chunk_id, row in id_to_row.items() if keep[row]
+            }
+            self._list_rows = None
+        return True
+
+    def persist(self):
+        """Trains if needed, then writes every array plus the row store to `persist_directory`."""
+        if not self._persist_directory:
+            return
+        with self._lock:
+            if self.count() and (not self.is_trained
+                                 or self.count() >= self.retrain_growth * self.trained_size):
+                self.train()
+            if self.is_trained and self.count():
+                self._cluster_rows()
+            os.makedirs(self._persist_directory, exist_ok=True)
+
+            for name, filename in ARRAY_FILES.items():
+                array = getattr(self, name)
+                if array is None:
+                    continue
+                path = os.path.join(self._persist_directory, filename)
+                with open(path + ".tmp", "wb") as f:
+                    np.save(f, np.ascontiguousarray(array))
+                os.replace(path + ".tmp", path)
+
+            self._rows = self._rows.save(self._persist_directory)
+            self._write_json(CONFIG_FILE, {
+                "nlist": self.nlist,
+                "requested_nlist": self.requested_nlist,
+                "num_subspaces": self.num_subspaces,
+                "nprobe": self.nprobe,
+                "rescore": self.rescore,
+                "rescore_factor": self.rescore_factor,
+                "trained_size": self.trained_size,
+            })
+
+    # --- Searching ---
+
+    def query_by_vectors(self, query_embeddings, k=10, nprobe=None, rescore=None):
+        """
+        Approximate top-k search for several query vectors.
+
+        Args:
+            query_embeddings (List[List[float]]): Query vectors
+            k (int): Results per query
+            nprobe (int, optional): Override the number of lists scanned
+            rescore (bool, optional): Override exact re-scoring of the shortlist
+
+        Returns:
+            Dict shaped like Chroma's `collection.query` result: "ids", "documents",
+            "metadatas", "embeddings" and "scores", each a list per query
+        """
+        nprobe = nprobe or self.nprobe
+        rescore = self.rescore if rescore is None else rescore
+        results = {"ids": [], "documents": [], "metadatas": [], "embeddings": [], "scores": []}
+
+        with self._lock:
+            # Under the lock: concurrent first queries train (and group the lists) only once
+            if self.count() and not self.is_trained:
+                self.train()
+            if self._list_rows is None and self.count():
+                self._build_lists()
+            index = self._snapshot()
+
+        # Scored without the lock, against the snapshot
+        for query in _normalize(query_embeddings):
+            rows, scores = index._search_one(query, k, nprobe, rescore) if index.count() else ([], [])
+            results["ids"].append([index._rows.value("ids", i) for i in rows])
+            results["documents"].append([index._rows.value("texts", i) for i in rows])
+            results["metadatas"].append([index._rows.value("metadatas", i) for i in rows])
+            results["embeddings"].append(index._rows.vectors(rows).tolist() if rows else [])
+            results["scores"].append([float(score) for score in scores])
+        return results
+
+    def _snapshot(self):
+        """
+        Shallow copy of the index to search without the lock. Writes replace the
+        arrays (codes, lists, ...) instead of changing them in place, so the copy keeps
+        a consistent set; the row store is frozen separately.
+        """
+        index = copy.copy(self)
+        index._rows = self._rows.snapshot()
+        return index
+
+    def _search_one(self, query, k, nprobe, rescore):
+        # 1. Closest coarse centroids: ||q - c||^2 = 1 - 2<q, c> + ||c||^2 for a unit query
+        centroid_dist = 1 - 2 * (self.centroids @ query) + self._centroid_sq
+        nprobe = min(nprobe, len(centroid_dist))
+        probe = np.argpartition(centroid_dist, nprobe - 1)[:nprobe]
+
+        # 2. One lookup table of <q, codeword> per sub-space, shared by every probed list
+        m, _, dsub = self.codebooks.shape
+        table = np.einsum("mkd,md->mk", self.codebooks, query.reshape(m, dsub))
+        candidate_rows, candidate_dist = [], []
+        for list_id in probe:
+            start, end = self._list_offsets[list_id], self._list_offsets[list_id + 1]
+            if start == end:
+                continue
+            rows = self._list_rows[start:end]
+            codes = np.asarray(self.codes[rows])
+            inner = table[np.arange(m), codes].sum(axis=1)
+            candidate_rows.append(rows)
+            candidate_dist.append(centroid_dist[list_id] + self.code_terms[rows] - 2 * inner)
+
+        if not candidate_rows:
+            return [], []
+        rows = np.concatenate(candidate_rows)
+        distances = np.concatenate(candidate_dist)
+
+        # 3. Shortlist by approximate distance; for unit vectors cos = 1 - d^2 / 2
+        shortlist_size = min(len(rows), k * self.rescore_factor if rescore else k)
+        shortlist = np.argpartition(distances, shortlist_size - 1)[:shortlist_size]
+        rows, scores = rows[shortlist], 1 - distances[shortlist] / 2
+
+        # 4. Optional exact re-score, reading only the shortlisted full vectors
+        if rescore:
+            order = np.argsort(rows)  # Sorted reads are friendlier to the memory map
+            rows = rows[order]
+            scores = self._rows.vectors(rows) @ query
+
+        top = np.argsort(-scores)[:k]
+        return rows[top].tolist(), scores[top].tolist()
+
+    def _cluster_rows(self):
+        """Reorders rows by inverted list, so each list's codes and vectors are contiguous on disk."""
+        order = np.argsort(self.assignments, kind="stable")
+        if np.array_equal(order, np.arange(len(order))):
+            return
+        for name in ("codes", "assignments", "code_terms"):
+            setattr(self, name, np.asarray(getattr(self, name))[order])
+        self._rows.select(order)
+        if self._id_to_row is not None:
+            new_rows = np.empty_like(order)
+            new_rows[order] = np.arange(len(order))
+            self._id_to_row = {chunk_id: int(new_rows[row]) for chunk_id, row in self._id_to_row.items()}
+        self._list_rows = None
+
+    def _build_lists(self):
+        self._centroid_sq = (self.centroids ** 2).sum(axis=1)
+        self._list_rows = np.argsort(self.assignments, kind="stable")
+        counts = np.bincount(self.assignments, minlength=len(self.centroids))
+        self._list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        results = self.query_by_vectors([self._embedding_function.embed_query(query)], k)
+        return [
+            (Document(page_content=text, metadata=dict(metadata)), score)
+            for text, metadata, score in zip(
+                results["documents"][0], results["metadatas"][0], results["scores"][0]
+            )
+        ]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _similarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score(query, k)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, **kwargs):
+        index = cls(embedding, persist_directory=persist_directory, **kwargs)
+        index.add_texts(texts, metadatas=metadatas, ids=ids)
+        index.train()
+        index.persist()
+        return index
+
+    # --- Internal helpers ---
+
+    def _row_index(self):
+        """id -> row. Built on the first write, which reads every id once."""
+        if self._id_to_row is None:
+            self._id_to_row = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        return self._id_to_row
+
+    def _write_json(self, filename, data):
+        path = os.path.join(self._persist_directory, filename)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    def _load(self):
+        with open(os.path.join(self._persist_directory, CONFIG_FILE), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self.nlist = config["nlist"]
+        self.requested_nlist = config["requested_nlist"]
+        self.num_subspaces = config["num_subspaces"]
+        self.nprobe = config["nprobe"]
+        self.rescore = config["rescore"]
+        self.rescore_factor = config["rescore_factor"]
+        self.trained_size = config["trained_size"]
+
+        # Full vectors and the id/text/metadata columns stay memory-mapped
+        self._rows = _RowStore(self._persist_directory)
+        self._id_to_row = None
+
+        # Codes are memory-mapped too; only centroids/codebooks and per-row list data are read eagerly
+        for name, filename in ARRAY_FILES.items():
+            path = os.path.join(self._persist_directory, filename)
+            if os.path.exists(path):
+                eager = name in ("centroids", "codebooks", "assignments", "code_terms")
+                setattr(self, name, np.load(path, mmap_mode=None if eager else "r"))
+
+
+def has_ivfpq_index(persist_dir):
+    """Whether `persist_dir` holds a saved IVFPQIndex."""
+    return bool(persist_dir) and os.path.exists(os.path.join(persist_dir, CONFIG_FILE))
@@ -9,16 +9,40 @@ This file runs the full pipeline:
 """
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
 import uvicorn
+from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 
+load_dotenv()  # Loads OPENAI_API_KEY (and optional settings) from .env
+
 # Import our RAG components
-from query_processor import decompose_complex_query, process_single_subquestion
-from data_loader import load_documents_from_folder, chunk_documents
-from document_processor import compress_document_context, rerank_documents_by_similarity
-from vector_db import init_vector_store
+from query_processor import (
+    decompose_complex_query,
+    process_single_subquestion,
+    retrieve_for_subquestions,
+    decomposition_cache,
+    answer_cache
+)
+from vector_db import (
+    init_vector_store, load_embedding_model, retrieve_relevant_documents,
+    load_existing_database, count_vectors
+)
+from shared_index import open_shared_index, publish_snapshot, current_version
+from metrics import traced_call, timed_stage, latency_snapshot, count_event, counters_snapshot
+from admission import (
+    AdmissionController, Deadline, DeadlineExceeded, Overloaded,
+    MAX_IN_FLIGHT_REQUESTS, REQUEST_DEADLINE_SECONDS
+)
+from sentence_store import get_sentence_store
 
 # Initialize FastAPI app
 app = FastAPI(title="Sports Analytics RAG API")
@@ -35,6 +59,7 @@ app.add_middleware(
 # Pydantic models for request/response
 class QueryRequest(BaseModel):
     query: str
+    deadline_ms: Optional[int] = None  # Capped at REQUEST_DEADLINE_SECONDS
 
 class SubQuestionResponse(BaseModel):
     sub_question: str
@@ -44,51 +69,191 @@ class SubQuestionResponse(BaseModel):
 class QueryResponse(BaseModel):
     original_query: str
     sub_questions: List[SubQuestionResponse]
-    processing_steps: Dict[str, str]
+    processing_steps: Dict[str, Dict[str, Any]]
 
 # Global variables for RAG components
 vector_store = None
 llm = None
 embeddings = None
 
+# Startup state: the app only reports healthy once everything is loaded and warmed up
+CHROMA_DIR = os.getenv("CHROMA_DIR", "./chroma_db")
+DOCS_DIR = os.getenv("DOCS_DIR", "data/sports_documents")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+WARMUP_QUERY = "Which team has the best defense?"
+
+# Multi-worker serving: workers open a published, memory-mapped snapshot read-only
+# instead of each loading its own copy of the vector store (see shared_index.py)
+UVICORN_WORKERS = int(os.getenv("UVICORN_WORKERS", "1"))
+SERVING_DIR = os.getenv("SERVING_DIR", "./serving_index")
+USE_SHARED_INDEX = os.getenv("USE_SHARED_INDEX", "false").lower() == "true"
+SNAPSHOT_CHECK_SECONDS = float(os.getenv("SNAPSHOT_CHECK_SECONDS", "2"))
+_last_snapshot_check = 0.0
+
+startup_state = {"ready": False, "error": None, "steps_ms": {}}
+
+# Maximum number of sub-question pipelines one request runs at the same time.
+# Each pipeline makes blocking retrieval/embedding/LLM calls, so they run on this pool
+# to keep the event loop free for other requests. The pool is sized for every admitted
+# request at once, so admission control is the only queue a request waits in.
+MAX_CONCURRENT_SUBQUESTIONS = int(os.getenv("MAX_CONCURRENT_SUBQUESTIONS", "4"))
+subquestion_executor = ThreadPoolExecutor(
+    max_workers=MAX_IN_FLIGHT_REQUESTS * MAX_CONCURRENT_SUBQUESTIONS,
+    thread_name_prefix="subquestion"
+)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking pipeline call on the sub-question pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(subquestion_executor, lambda: func(*args, **kwargs))
+
+
+async def run_traced(func, *args, **kwargs):
+    """Like run_blocking, but also returns the stage timings/counts the call recorded"""
+    return await run_blocking(traced_call, func, *args, **kwargs)
+
+
+async def run_traced_limited(limit: asyncio.Semaphore, func, *args, **kwargs):
+    """Like run_traced, but waits for one of the request's sub-question slots first"""
+    async with limit:
+        return await run_traced(func, *args, **kwargs)
+
+
+# Bounded in-flight pipelines plus a bounded wait queue; everything beyond is shed
+# (MAX_IN_FLIGHT_REQUESTS, MAX_QUEUED_REQUESTS, QUEUE_TIMEOUT_SECONDS, see admission.py)
+admission = AdmissionController()
+
+
+def start_deadline(request: QueryRequest) -> Deadline:
+    """Starts the request's deadline clock (the client may ask for a shorter one)"""
+    seconds = REQUEST_DEADLINE_SECONDS
+    if request.deadline_ms is not None:
+        seconds = min(seconds, max(request.deadline_ms, 1) / 1000)
+    return Deadline(seconds)
+
+
+def overloaded_error(e: Overloaded) -> HTTPException:
+    """Turns a shed request into a 429/503 the client can back off from"""
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+
+def deadline_error(deadline: Deadline) -> HTTPException:
+    count_event("deadline_exceeded")
+    return HTTPException(status_code=504, detail=f"Request deadline of {deadline.budget:g}s exceeded")
+
+def load_llm():
+    """Creates the chat model used for decomposition and answers"""
+    from langchain_community.chat_models import ChatOpenAI
+    return ChatOpenAI(model_name=LLM_MODEL, temperature=0)
+
+def initialize_components():
+    """
+    Loads every heavyweight component once and runs a warm-up embedding and
+    search, timing each step into startup_state["steps_ms"]
+    """
+    global vector_store, llm, embeddings
+
+    def step(name, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        startup_state["steps_ms"][name] = round((time.perf_counter() - started) * 1000, 1)
+        print(f"  ⏱️ Startup step '{name}' took {startup_state['steps_ms'][name]} ms")
+        return result
+
+    embeddings = step("load_embedding_model", load_embedding_model)
+    if USE_SHARED_INDEX:
+        vector_store = step("open_vector_store", open_shared_index, embeddings, SERVING_DIR)
+    else:
+        vector_store = step("open_vector_store", init_vector_store, embeddings, CHROMA_DIR, DOCS_DIR)
+    llm = step("load_llm", load_llm)
+
+    # Warm-up: first model forward pass and first index search are the slow ones
+    step("warmup_embedding", embeddings.embed_query, WARMUP_QUERY)
+    step("warmup_search", retrieve_relevant_documents, vector_store, WARMUP_QUERY, 1)
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize RAG components on startup"""
-    global vector_store, llm, embeddings
-    # Initialize your components here
-    # This is placeholder - you'll need to add actual initialization code
-    pass
+    print("🚀 Starting Sports Analytics RAG API")
+    started = time.perf_counter()
+    try:
+        await run_blocking(initialize_components)
+        startup_state["ready"] = True
+    except Exception as e:
+        # Keep serving so /health can report what went wrong
+        startup_state["error"] = str(e)
+        print(f"  ❌ Startup failed: {e}")
+    startup_state["steps_ms"]["total"] = round((time.perf_counter() - started) * 1000, 1)
+
+def ensure_ready():
+    """
+    Rejects pipeline requests until startup has finished. Returns the vector store
+    the request should use for its whole lifetime (in shared-index mode, the newest
+    published snapshot; requests already running keep the one they started with).
+    """
+    global vector_store, _last_snapshot_check
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail=startup_state["error"] or "Service is warming up")
+
+    now = time.monotonic()
+    if USE_SHARED_INDEX and now - _last_snapshot_check >= SNAPSHOT_CHECK_SECONDS:
+        _last_snapshot_check = now
+        if vector_store.is_stale():
+            print(f"  🔁 New snapshot {current_version(SERVING_DIR)} published, switching over")
+            vector_store = open_shared_index(embeddings, SERVING_DIR)
+    return vector_store
 
 @app.post("/process_query", response_model=QueryResponse)
 async def process_query(request: QueryRequest):
     """
     Process a complex sports analytics query through the RAG pipeline
     """
+    vectordb = ensure_ready()
+    deadline = start_deadline(request)
     try:
-        # 1. Query Decomposition
-        sub_questions = decompose_complex_query(request.query, llm)
-        
-        # 2. Process each sub-question
-        results = []
-        processing_steps = {}
-        
-        for sub_q in sub_questions:
-            # Process the sub-question and track each step
-            result = process_single_subquestion(
-                sub_q,
-                vector_store,
-                embeddings,
-                llm
+        async with admission.admit(deadline):
+            # Stop waiting at the deadline; pipeline threads still running give up
+            # at their next stage boundary (each stage checks the deadline)
+            return await asyncio.wait_for(answer_query(request, vectordb, deadline), timeout=deadline.remaining())
+    except Overloaded as e:
+        raise overloaded_error(e)
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        raise deadline_error(deadline)
+
+async def answer_query(request: QueryRequest, vectordb, deadline: Deadline):
+    """Runs the full pipeline for an admitted /process_query request"""
+    try:
+        with timed_stage("process_query"):
+            # 1. Query Decomposition
+            sub_questions, decomposition_steps = await run_traced(
+                decompose_complex_query, request.query, llm, deadline=deadline
             )
-            results.append(result)
-            
-            # Track processing steps for visualization
-            processing_steps[f"sub_question_{len(results)}"] = {
-                "query_decomposition": sub_q,
-                "retrieved_docs": "Number of docs retrieved: X",  # You'll need to add actual numbers
-                "compression": "Compressed to Y relevant documents",
-                "reranking": "Top similarity scores: [...]"
-            }
+
+            # 2. Retrieve for every sub-question in one batched pass
+            prefetched, retrieval_steps = await run_traced(
+                retrieve_for_subquestions, sub_questions, vectordb, embeddings, deadline=deadline
+            )
+            sub_questions = sub_questions[:len(prefetched)]  # Fewer when the deadline is near
+
+            # 3. Process the sub-questions concurrently (gather keeps the original order)
+            limit = asyncio.Semaphore(MAX_CONCURRENT_SUBQUESTIONS)
+            traced_results = await asyncio.gather(*[
+                run_traced_limited(
+                    limit, process_single_subquestion, sub_q, vectordb, embeddings, llm,
+                    prefetched=prefetched_q, deadline=deadline
+                )
+                for sub_q, prefetched_q in zip(sub_questions, prefetched)
+            ])
+
+        # Real per-stage timings and counts, for visualization
+        results = [result for result, _ in traced_results]
+        processing_steps = {
+            "decomposition": decomposition_steps,
+            "batch_retrieval": retrieval_steps,
+        }
+        for i, (sub_q, (_, steps)) in enumerate(zip(sub_questions, traced_results), 1):
+            processing_steps[f"sub_question_{i}"] = {"query_decomposition": sub_q, **steps}
         
         return QueryResponse(
             original_query=request.query,
@@ -96,13 +261,198 @@ async def process_query(request: QueryRequest):
             processing_steps=processing_steps
         )
     
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def format_sse(event: str, data) -> str:
+    """Formats one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that releases its admission slot however the response ends,
+    including when the client disconnects before the stream is ever iterated
+    (closing the slot a second time is a no-op).
+    """
+
+    def __init__(self, content, slot: AsyncExitStack, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.slot.aclose()
+
+@app.post("/process_query/stream")
+async def process_query_stream(request: QueryRequest):
+    """
+    Streaming variant of /process_query using Server-Sent Events.
+
+    Events, in order of arrival:
+    - decomposition: the list of sub-questions
+    - token: a piece of a sub-question's answer as the LLM generates it
+    - sub_answer: a finished sub-question with its answer and citations
+    - error: a sub-question (or the decomposition) failed, or the deadline passed
+    - done: everything has finished
+    Sub-question events carry a 1-based "index" matching the decomposition order.
+    Shed requests are rejected with 429/503 before the stream starts.
+    """
+    vectordb = ensure_ready()
+    deadline = start_deadline(request)
+
+    # Take the admission slot now, so a shed request still gets a real status code;
+    # the stream releases it when it ends, the response if the stream never ran
+    slot = AsyncExitStack()
+    try:
+        await slot.enter_async_context(admission.admit(deadline))
+    except Overloaded as e:
+        raise overloaded_error(e)
+
+    async def event_stream():
+        async with slot:
+            async for event in answer_query_stream(request, vectordb, deadline):
+                yield event
+
+    return AdmittedStreamingResponse(event_stream(), slot, media_type="text/event-stream")
+
+async def answer_query_stream(request: QueryRequest, vectordb, deadline: Deadline):
+    """Runs the full pipeline for an admitted streaming request, yielding SSE events"""
+    queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+
+    def emit(event, data):
+        # Called from worker threads, so hand the event over to the event loop
+        loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+
+    try:
+        sub_questions, decomposition_steps = await asyncio.wait_for(
+            run_traced(decompose_complex_query, request.query, llm, deadline=deadline),
+            timeout=deadline.remaining()
+        )
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        yield format_sse("error", {"detail": deadline_error(deadline).detail})
+        return
+    except Exception as e:
+        yield format_sse("error", {"detail": str(e)})
+        return
+
+    # Sent before the batched retrieval, so the client can show the plan right away
+    yield format_sse("decomposition", {
+        "original_query": request.query,
+        "sub_questions": sub_questions,
+        "processing_steps": decomposition_steps
+    })
+
+    try:
+        prefetched, _ = await asyncio.wait_for(
+            run_traced(retrieve_for_subquestions, sub_questions, vectordb, embeddings, deadline=deadline),
+            timeout=deadline.remaining()
+        )
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        yield format_sse("error", {"detail": deadline_error(deadline).detail})
+        return
+    except Exception as e:
+        yield format_sse("error", {"detail": str(e)})
+        return
+
+    # Fewer when the deadline is near: report the sub-questions that were dropped
+    for index in range(len(prefetched) + 1, len(sub_questions) + 1):
+        yield format_sse("error", {"index": index, "detail": deadline_error(deadline).detail})
+    sub_questions = sub_questions[:len(prefetched)]
+
+    limit = asyncio.Semaphore(MAX_CONCURRENT_SUBQUESTIONS)
+
+    async def run_one(index, sub_q, prefetched_q):
+        try:
+            result, steps = await run_traced_limited(
+                limit,
+                process_single_subquestion,
+                sub_q,
+                vectordb,
+                embeddings,
+                llm,
+                on_token=lambda token: emit("token", {"index": index, "token": token}),
+                prefetched=prefetched_q,
+                deadline=deadline
+            )
+            emit("sub_answer", {"index": index, **result, "processing_steps": steps})
+        except DeadlineExceeded:
+            emit("error", {"index": index, "detail": deadline_error(deadline).detail})
+        except Exception as e:
+            emit("error", {"index": index, "detail": str(e)})
+
+    tasks = [
+        asyncio.create_task(run_one(i, sub_q, prefetched_q))
+        for i, (sub_q, prefetched_q) in enumerate(zip(sub_questions, prefetched), 1)
+    ]
+    all_done = asyncio.gather(*tasks)
+    all_done.add_done_callback(lambda _: emit("done", {}))
+
+    try:
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=deadline.remaining())
+            except asyncio.TimeoutError:
+                yield format_sse("error", {"detail": deadline_error(deadline).detail})
+                yield format_sse("done", {})
+                break
+            yield format_sse(event, data)
+            if event == "done":
+                break
+    finally:
+        # Client went away (or the deadline passed): stop waiting on pipelines nobody will read
+        all_done.cancel()
+
 @app.get("/health")
 async def health_check():
-    """Simple health check endpoint"""
-    return {"status": "healthy"}
+    """Reports healthy only once models are loaded and warm-up has finished"""
+    if startup_state["ready"]:
+        return {"status": "healthy", "startup_ms": startup_state["steps_ms"]}
+    return JSONResponse(
+        status_code=503,
+        content={
+            "status": "failed" if startup_state["error"] else "starting",
+            "error": startup_state["error"],
+            "startup_ms": startup_state["steps_ms"]
+        }
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency histograms, cache hit rates and other runtime counters"""
+    return {
+        "stage_latency": latency_snapshot(),
+        "decomposition_cache": decomposition_cache.stats(),
+        "semantic_answer_cache": answer_cache.stats(),
+        "sentence_store": get_sentence_store().stats(),
+        "admission": admission.stats(),
+        "events": counters_snapshot()
+    }
+
+def prepare_shared_index(workers):
+    """
+    Runs once in the parent process before the workers start: makes sure a snapshot
+    is published, and tells the workers to open it instead of their own store
+    """
+    os.environ["USE_SHARED_INDEX"] = "true"
+    # The embedding cache's disk tier has no cross-process locking: workers only read it
+    os.environ["EMBEDDING_CACHE_READ_ONLY"] = "true"
+    # Split the cores between workers so their model inference doesn't oversubscribe the CPU
+    os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+    if current_version(SERVING_DIR) is None:
+        vectordb = load_existing_database(None, CHROMA_DIR)  # Only its stored vectors are exported
+        if count_vectors(vectordb) == 0:
+            vectordb = init_vector_store(load_embedding_model(), CHROMA_DIR, DOCS_DIR)
+        publish_snapshot(vectordb, SERVING_DIR, persist_dir=CHROMA_DIR)
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    if UVICORN_WORKERS > 1:
+        prepare_shared_index(UVICORN_WORKERS)
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=UVICORN_WORKERS)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,180 @@
+"""
+📈 Pipeline Instrumentation
+
+This module measures what every stage of the RAG pipeline does:
+1. Per-request traces - wall time, doc counts, embedding calls, LLM tokens and scores,
+   returned to the client in `processing_steps`
+2. Process-wide latency histograms per stage, exposed at the /metrics endpoint
+3. Process-wide event counters (shed requests, degraded stages, ...), also at /metrics
+
+Traces are thread-local: each pipeline call runs on one worker thread, so a stage
+only needs to call `timed_stage` / `record` and the numbers land in the right trace.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in milliseconds
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float("inf"))
+
+_local = threading.local()
+
+
+# === Class: Latency Histogram ===
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram plus a window of recent samples for percentiles.
+
+    Args:
+        window (int): Number of most recent samples used for p50/p95/p99
+    """
+
+    def __init__(self, window=2000):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms: float):
+        """Records one latency sample."""
+        with self._lock:
+            for i, upper in enumerate(LATENCY_BUCKETS_MS):
+                if elapsed_ms <= upper:
+                    self.bucket_counts[i] += 1
+                    break
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self._recent.append(elapsed_ms)
+
+    def snapshot(self):
+        """Returns counts, buckets and percentiles as a JSON-friendly dict."""
+        with self._lock:
+            recent = sorted(self._recent)
+            buckets = {
+                ("+Inf" if upper == float("inf") else str(upper)): count
+                for upper, count in zip(LATENCY_BUCKETS_MS, self.bucket_counts)
+            }
+            return {
+                "count": self.count,
+                "mean_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+                "p50_ms": _percentile(recent, 50),
+                "p95_ms": _percentile(recent, 95),
+                "p99_ms": _percentile(recent, 99),
+                "buckets_ms": buckets,
+            }
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 2)
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def _histogram(stage: str) -> LatencyHistogram:
+    with _histograms_lock:
+        if stage not in _histograms:
+            _histograms[stage] = LatencyHistogram()
+        return _histograms[stage]
+
+
+# === Per-Request Traces ===
+def current_trace():
+    """Returns the trace dict being filled on this thread, or None."""
+    return getattr(_local, "trace", None)
+
+
+def traced_call(func, *args, **kwargs):
+    """
+    Runs `func` with a fresh trace on the current thread.
+
+    Returns:
+        Tuple[Any, Dict]: The function's result and everything its stages recorded
+    """
+    previous = current_trace()
+    _local.trace = {}
+    try:
+        result = func(*args, **kwargs)
+        return result, _local.trace
+    finally:
+        _local.trace = previous
+
+
+def record(key: str, value):
+    """Stores a value (count, score, flag) in the current trace, if any."""
+    trace = current_trace()
+    if trace is not None:
+        trace[key] = value
+
+
+def increment(key: str, amount=1):
+    """Adds to a counter in the current trace, if any."""
+    trace = current_trace()
+    if trace is not None:
+        trace[key] = trace.get(key, 0) + amount
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """
+    Times a pipeline stage: the wall time goes into the stage's histogram and,
+    as `<stage>_ms`, into the current trace. Works as a `with` block or as a
+    function decorator.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        _histogram(stage).observe(elapsed_ms)
+        trace = current_trace()
+        if trace is not None:
+            trace[f"{stage}_ms"] = round(trace.get(f"{stage}_ms", 0) + elapsed_ms, 1)
+
+
+def record_llm_usage(result):
+    """
+    Records prompt/completion token counts from a LangChain LLM result, when the
+    provider reports them.
+    """
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        increment("llm_prompt_tokens", usage.get("input_tokens", 0))
+        increment("llm_completion_tokens", usage.get("output_tokens", 0))
+        return
+
+    token_usage = (getattr(result, "response_metadata", None) or {}).get("token_usage")
+    if token_usage:
+        increment("llm_prompt_tokens", token_usage.get("prompt_tokens", 0))
+        increment("llm_completion_tokens", token_usage.get("completion_tokens", 0))
+
+
+# === Process-Wide Event Counters ===
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def count_event(name: str, amount=1):
+    """Adds to a process-wide counter (e.g. "shed_queue_full"), independent of any trace."""
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def counters_snapshot():
+    """Returns every event counter for the /metrics endpoint."""
+    with _counters_lock:
+        return dict(sorted(_counters.items()))
+
+
+def latency_snapshot():
+    """Returns every stage's histogram for the /metrics endpoint."""
+    with _histograms_lock:
+        stages = dict(_histograms)
+    return {stage: histogram.snapshot() for stage, histogram in sorted(stages.items())}
@@ -0,0 +1,75 @@
+"""
+👯 Near-Duplicate Detection with SimHash
+
+The sports documents repeat the same stat lines across files, so retrieval often
+returns several chunks that say the same thing:
+1. At ingestion, every chunk gets a 64-bit SimHash of its word 3-grams, stored in
+   its metadata (so it comes back with every search result for free)
+2. At query time, chunks whose fingerprints differ in only a few bits are collapsed
+   into the best-ranked one, which keeps the other copies' sources for citations
+"""
+
+import hashlib
+import os
+import re
+
+import numpy as np
+
+FINGERPRINT_KEY = "simhash"  # Metadata field holding the hex fingerprint
+SHINGLE_SIZE = 3
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "3"))  # Of 64 bits
+
+
+# === Function 1: SimHash Fingerprint ===
+def simhash(text: str) -> int:
+    """
+    64-bit SimHash of the text's lowercase word 3-grams. Texts that share most of
+    their 3-grams get fingerprints differing in only a few bits.
+
+    Args:
+        text (str): Chunk content
+
+    Returns:
+        int: Unsigned 64-bit fingerprint
+    """
+    words = re.findall(r"\w+", text.lower())
+    shingles = {
+        " ".join(words[i:i + SHINGLE_SIZE])
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    }
+
+    # One 64-bit hash per shingle, unpacked to a (num_shingles, 64) bit matrix
+    digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+
+    # Each output bit is set if most shingles have it set
+    majority = bits.sum(axis=0) * 2 > len(shingles)
+    return int(np.packbits(majority, bitorder="little").view("<u8")[0])
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two fingerprints."""
+    return (a ^ b).bit_count()
+
+
+# === Function 2: Tag Chunks at Ingestion ===
+def add_fingerprints(chunks):
+    """
+    Stores each chunk's SimHash in its metadata (as hex: vector stores only keep
+    signed 64-bit integers).
+
+    Args:
+        chunks (List[Document]): Freshly split chunks
+
+    Returns:
+        List[Document]: The same chunks
+    """
+    for chunk in chunks:
+        chunk.metadata[FINGERPRINT_KEY] = f"{simhash(chunk.page_content):016x}"
+    return chunks
+
+
+def get_fingerprint(doc) -> int:
+    """Reads a document's stored fingerprint, computing it for chunks ingested without one."""
+    stored = doc.metadata.get(FINGERPRINT_KEY)
+    return int(stored, 16) if stored else simhash(doc.page_content)
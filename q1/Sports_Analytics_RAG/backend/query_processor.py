@@ -4,24 +4,71 @@
 This file handles:
 1. Breaking down complex questions into smaller parts
 2. Passing each sub-question through the full RAG pipeline (retrieve → compress → rerank → generate answer)
+3. Retrieving for all sub-questions of a query in one batched pass
+
+Every stage accepts an optional `admission.Deadline`: stages refuse to start once it
+has passed, and switch to cheaper variants (no LLM decomposition, fewer sub-questions,
+no compression/reranking) when it is close.
 """
 
+import os
+
 from langchain.prompts import ChatPromptTemplate  # Used to format the prompt for the LLM
 
+from caches import DecompositionCache, SemanticAnswerCache  # Skip LLM calls for repeated questions
+from metrics import timed_stage, record, record_llm_usage  # Per-stage timing and counts
+from admission import DeadlineExceeded, MAX_SUBQUESTIONS_DEGRADED, note_degraded  # Deadline-driven degradation
+
+# Shared cache of query -> sub-questions (set DECOMPOSITION_CACHE_PATH to keep it on disk)
+decomposition_cache = DecompositionCache(
+    max_size=int(os.getenv("DECOMPOSITION_CACHE_SIZE", "1000")),
+    ttl_seconds=float(os.getenv("DECOMPOSITION_CACHE_TTL", str(24 * 3600))),
+    persist_path=os.getenv("DECOMPOSITION_CACHE_PATH")
+)
+
+# Shared cache of sub-question answers, matched by embedding similarity
+answer_cache = SemanticAnswerCache(
+    similarity_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+    max_size=int(os.getenv("SEMANTIC_CACHE_SIZE", "5000"))
+)
+
 
 # === Function 1: Decompose Complex Queries ===
-def decompose_complex_query(query: str, llm):
+@timed_stage("decomposition")
+def decompose_complex_query(query: str, llm, use_cache=True, deadline=None):
     """
     Use an LLM to break down a long, multi-part question into simpler sub-questions.
+    Repeated (or trivially re-worded) queries are answered from `decomposition_cache`.
 
     Args:
         query (str): A complex question (e.g., "Which team has the best defense and how does their goalkeeper compare?")
         llm: The LLM instance used to generate sub-questions (e.g., ChatOpenAI)
+        use_cache (bool): Whether to consult and fill the decomposition cache
+        deadline (Deadline, optional): Request deadline; when it is near, the query is
+            answered as a single question instead of asking the LLM to split it
 
     Returns:
         List[str]: List of atomic sub-questions derived from the complex one
     """
     print(f"🔍 Decomposing query: {query}")
+    if deadline is not None:
+        deadline.check("decomposition")
+
+    if use_cache:
+        cached = decomposition_cache.get(query)
+        if cached is not None:
+            print(f"  ⚡ Reused cached decomposition ({len(cached)} sub-questions)")
+            record("decomposition_cache", "hit")
+            record("sub_questions", len(cached))
+            return cached
+        record("decomposition_cache", "miss")
+
+    # Short on time: an LLM round trip here would eat most of what is left
+    if deadline is not None and deadline.near():
+        print("  ⏳ Deadline is near, skipping decomposition")
+        note_degraded("decomposition")
+        record("sub_questions", 1)
+        return [query]
 
     # Prompt template: What we want the LLM to do
     prompt_text = """
@@ -39,6 +86,7 @@ def decompose_complex_query(query: str, llm):
     # Chain = prompt → LLM → response
     chain = prompt | llm
     result = chain.invoke({"query": query})  # Ask the LLM to generate sub-questions
+    record_llm_usage(result)
 
     # === Parse the result into a list of sub-questions ===
     sub_questions = []
@@ -54,6 +102,10 @@ def decompose_complex_query(query: str, llm):
     if not sub_questions:
         sub_questions = [query]
 
+    if use_cache:
+        decomposition_cache.put(query, sub_questions)
+    record("sub_questions", len(sub_questions))
+
     print(f"  📝 Generated {len(sub_questions)} sub-questions:")
     for i, sq in enumerate(sub_questions, 1):
         print(f"    {i}. {sq}")
@@ -62,13 +114,18 @@ def decompose_complex_query(query: str, llm):
 
 
 # === Function 2: Process Each Sub-question Through RAG ===
+@timed_stage("subquestion_total")
 def process_single_subquestion(
     subquestion: str,
     vectordb,
     embeddings,
     llm,
     similarity_threshold=0.3,
-    top_k=5
+    top_k=5,
+    on_token=None,
+    use_cache=True,
+    prefetched=None,
+    deadline=None
 ):
     """
     Full pipeline for answering a single sub-question:
@@ -84,32 +141,151 @@ def process_single_subquestion(
         llm: Language model used to generate the final answer
         similarity_threshold (float): Cutoff for context compression
         top_k (int): Number of top documents to use for answer generation
+        on_token (Callable[[str], None], optional): Receives answer tokens as they are generated
+        use_cache (bool): Reuse the answer of a near-identical, previously answered sub-question
+        prefetched (Dict, optional): This sub-question's entry from `retrieve_for_subquestions`;
+            when given, retrieval is skipped and the shared chunk pool vectors are reused
+        deadline (Deadline, optional): Request deadline; when it is near, compression and
+            reranking are skipped and the retrieval order is used as is
 
     Returns:
         Dict with sub-question, answer, and supporting citations
     """
     print(f"\n🔎 Processing sub-question: {subquestion}")
+    if deadline is not None:
+        deadline.check("sub-question processing")
 
     # 🔁 Lazy import to avoid circular dependency
-    from vector_db import retrieve_relevant_documents
-    from document_processor import compress_document_context, rerank_documents_by_similarity
+    from vector_db import retrieve_documents_with_vectors, read_corpus_version
+    from document_processor import (
+        compress_document_context, rerank_documents_by_similarity, collapse_near_duplicates
+    )
     from response_generator import generate_answer_with_citations
+    from embedding_cache import with_embedding_cache
+
+    # Step 0: Check whether a near-identical sub-question was already answered
+    if use_cache:
+        corpus_version = read_corpus_version(getattr(vectordb, "_persist_directory", None))
+        subquestion_embedding = (
+            prefetched["query_embedding"] if prefetched
+            else with_embedding_cache(embeddings).embed_query(subquestion)
+        )
+        cached = answer_cache.get(subquestion_embedding, corpus_version)
+        record("answer_cache", "miss" if cached is None else "hit")
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached["answer"])
+            return {"sub_question": subquestion, **cached}
+
+    # Step 1: Retrieve documents most similar to the sub-question, keeping their stored vectors
+    if prefetched:
+        docs = prefetched["docs"]
+        stored_embeddings = prefetched["stored_embeddings"]
+        query_embedding = prefetched["query_embedding"]
+        record("retrieved_docs", len(docs))
+    else:
+        docs, doc_embeddings, _ = retrieve_documents_with_vectors(vectordb, subquestion)
+        stored_embeddings = {doc.page_content: vector for doc, vector in zip(docs, doc_embeddings)}
+        query_embedding = None
+
+    # Each later stage first checks the deadline: a request that timed out stops
+    # here instead of keeping a pool thread busy with work nobody will read
+    if deadline is not None:
+        deadline.check("compression")
+
+    # Step 2: Collapse near-identical chunks (their sources stay as citations)
+    docs = collapse_near_duplicates(docs)
+
+    if deadline is not None and deadline.near():
+        # Short on time: keep the retrieval order and go straight to the answer
+        print("  ⏳ Deadline is near, skipping compression and reranking")
+        note_degraded("compression_rerank")
+        reranked_docs = docs
+    else:
+        # Step 3: Apply contextual compression to filter out unrelated sentences
+        compressed_docs = compress_document_context(
+            docs, subquestion, embeddings, similarity_threshold,
+            query_embedding=query_embedding
+        )
+        if deadline is not None:
+            deadline.check("reranking")
 
-    # Step 1: Retrieve documents most similar to the sub-question
-    docs = retrieve_relevant_documents(vectordb, subquestion)
+        # Step 4: Rerank the compressed documents by how relevant they are
+        # (chunks left untouched by compression reuse their stored vectors)
+        reranked_docs = rerank_documents_by_similarity(
+            compressed_docs, subquestion, embeddings,
+            stored_embeddings=stored_embeddings, query_embedding=query_embedding
+        )
 
-    # Step 2: Apply contextual compression to filter out unrelated sentences
-    compressed_docs = compress_document_context(docs, subquestion, embeddings, similarity_threshold)
+    if deadline is not None:
+        deadline.check("answer generation")
+        if on_token is not None:
+            # A streamed answer can also stop between tokens
+            forward_token = on_token
 
-    # Step 3: Rerank the compressed documents by how relevant they are
-    reranked_docs = rerank_documents_by_similarity(compressed_docs, subquestion, embeddings)
+            def on_token(token):
+                if deadline.expired():
+                    raise DeadlineExceeded(f"Request deadline of {deadline.budget:g}s passed during answer generation")
+                forward_token(token)
 
-    # Step 4: Generate a well-formed answer using the LLM, with citations
-    result = generate_answer_with_citations(subquestion, reranked_docs[:top_k], llm)
+    # Step 5: Generate a well-formed answer using the LLM, with citations
+    result = generate_answer_with_citations(subquestion, reranked_docs[:top_k], llm, on_token=on_token)
+
+    answer = {"answer": result["answer"], "citations": result["citations"]}
+    if use_cache and reranked_docs:
+        # Only cache real answers, not the "couldn't find relevant information" fallback
+        answer_cache.put(subquestion, subquestion_embedding, answer, corpus_version)
 
     # Return the result in a clean dictionary format
     return {
         "sub_question": subquestion,
-        "answer": result["answer"],
-        "citations": result["citations"]
+        **answer
     }
+
+
+# === Function 3: Retrieve for All Sub-questions at Once ===
+def retrieve_for_subquestions(subquestions, vectordb, embeddings, k=10, deadline=None):
+    """
+    Runs one batched retrieval for every sub-question of a query and makes sure
+    the sentences of the resulting (deduplicated) chunk pool are in the sentence
+    store, so overlapping chunks are only embedded and scored a single time.
+
+    Args:
+        subquestions (List[str]): Sub-questions from `decompose_complex_query`
+        vectordb: Vector database (Chroma)
+        embeddings: Embedding model to convert text into vectors
+        k (int): Number of top documents to retrieve per sub-question
+        deadline (Deadline, optional): Request deadline; when it is near, only the first
+            MAX_SUBQUESTIONS_DEGRADED sub-questions are kept
+
+    Returns:
+        List[Dict]: One `prefetched` entry per kept sub-question, in the same order,
+        to pass to `process_single_subquestion` (zip it with the sub-questions)
+    """
+    from vector_db import retrieve_documents_for_queries
+    from document_processor import embed_chunk_sentences
+
+    if deadline is not None:
+        deadline.check("retrieval")
+        if deadline.near() and len(subquestions) > MAX_SUBQUESTIONS_DEGRADED:
+            print(f"  ⏳ Deadline is near, answering only {MAX_SUBQUESTIONS_DEGRADED} of {len(subquestions)} sub-questions")
+            note_degraded("subquestions")
+            subquestions = subquestions[:MAX_SUBQUESTIONS_DEGRADED]
+
+    per_query_docs, stored_embeddings, query_embeddings = retrieve_documents_for_queries(
+        vectordb, subquestions, k
+    )
+    if deadline is not None:
+        deadline.check("sentence embedding")
+    if deadline is None or not deadline.near():
+        # Sentences are only needed for compression, which a near deadline skips
+        embed_chunk_sentences(stored_embeddings.keys(), embeddings)
+
+    return [
+        {
+            "docs": docs,
+            "stored_embeddings": stored_embeddings,
+            "query_embedding": query_embedding,
+        }
+        for docs, query_embedding in zip(per_query_docs, query_embeddings)
+    ]
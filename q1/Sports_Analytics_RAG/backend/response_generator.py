@@ -9,17 +9,27 @@ This file handles:
 
 from langchain.prompts import ChatPromptTemplate  # Used to format prompts for the LLM
 
+from metrics import timed_stage, record, record_llm_usage  # Per-stage timing and counts
+from context_packer import pack_context, get_token_counter, CONTEXT_TOKEN_BUDGET  # Prompt size control
+
 
 # === Function 1: Generate Answer with Citations ===
-def generate_answer_with_citations(query: str, docs, llm):
+@timed_stage("generation")
+def generate_answer_with_citations(query: str, docs, llm, on_token=None, token_budget=None):
     """
     Generates an answer to a sub-question using relevant documents.
     Adds citations (like [1], [2]) that refer to the source of each supporting document.
 
+    The context is packed into a token budget: the most relevant documents go in
+    first, and a document that doesn't fit whole is trimmed to the sentences that do.
+
     Args:
         query (str): The sub-question to answer
         docs (List[Document]): List of relevant documents to use
         llm: The language model to generate the answer (e.g., ChatOpenAI)
+        on_token (Callable[[str], None], optional): If given, the answer is streamed
+            from the LLM and this is called with each piece of text as it arrives
+        token_budget (int, optional): Maximum context tokens (default: CONTEXT_TOKEN_BUDGET)
 
     Returns:
         Dict with the generated answer and its citations
@@ -33,22 +43,11 @@ def generate_answer_with_citations(query: str, docs, llm):
             "citations": []
         }
 
-    # Prepare the input context for the LLM, including source numbers
-    context_parts = []
-    citations = []
-
-    for i, doc in enumerate(docs):
-        # Get the source file name or fallback to "unknown"
-        source = doc.metadata.get("source", "unknown")
-
-        # Format the chunked content with [index] label for citation
-        context_parts.append(f"[{i+1}] {doc.page_content}")
-
-        # Track the source file with the same index
-        citations.append(f"[{i+1}] {source}")
-
-    # Join all chunks to form a single input string for the prompt
-    context = "\n\n".join(context_parts)
+    # Prepare the input context for the LLM: numbered excerpts, within the token budget
+    count_tokens = get_token_counter(getattr(llm, "model_name", None))
+    context, citations, packing = pack_context(
+        docs, token_budget or CONTEXT_TOKEN_BUDGET, count_tokens
+    )
 
     # Prompt template to instruct the LLM on how to respond
     prompt_text = """
@@ -71,12 +70,38 @@ def generate_answer_with_citations(query: str, docs, llm):
     # Create and run the prompt
     prompt = ChatPromptTemplate.from_template(prompt_text)
     chain = prompt | llm
-    result = chain.invoke({"query": query, "context": context})
+    inputs = {"query": query, "context": context}
+
+    prompt_tokens = count_tokens(prompt.format(**inputs))
+    print(f"  📦 Packed {packing['docs_packed']}/{len(docs)} docs "
+          f"({packing['docs_trimmed']} trimmed) into {packing['context_tokens']} context tokens, "
+          f"{prompt_tokens} prompt tokens")
+    record("context_docs", packing["docs_packed"])
+    record("context_docs_trimmed", packing["docs_trimmed"])
+    record("context_docs_dropped", packing["docs_dropped"])
+    record("context_docs_merged", packing["docs_merged"])
+    record("context_tokens", packing["context_tokens"])
+    record("prompt_tokens", prompt_tokens)
+
+    if on_token is None:
+        result = chain.invoke(inputs)
+        record_llm_usage(result)
+        answer = result.content
+    else:
+        # Stream the answer, forwarding each token as soon as the LLM produces it
+        answer_parts = []
+        for chunk in chain.stream(inputs):
+            record_llm_usage(chunk)  # Providers that report usage do so on a stream chunk
+            token = getattr(chunk, "content", chunk)
+            if token:
+                answer_parts.append(token)
+                on_token(token)
+        answer = "".join(answer_parts)
 
     print(f"  ✅ Answer generated with {len(citations)} citations")
 
     return {
-        "answer": result.content,
+        "answer": answer,
         "citations": citations
     }
 
@@ -130,5 +155,6 @@ def combine_subquestion_results(original_query: str, sub_results, llm):
 
     return {
         "answer": result.content,
-        "citations": list(set(all_citations))  # Remove duplicate citations
+        # Remove duplicate citations (the same excerpt cited by several sub-answers)
+        "citations": list({(c["source"], c["text"]): c for c in all_citations}.values())
     }
@@ -0,0 +1,297 @@
+"""
+✂️ Sentence Segmentation and Sentence Side Store
+
+Chunks never change between queries, so their sentences are split and embedded
+once, at ingestion time, instead of on every compression call:
+1. `segment_sentences` - rule-based sentence segmenter returning character offsets
+   (handles decimals, abbreviations, initials, bullet lists and line breaks)
+2. `SentenceStore` - per-chunk sentence offsets plus normalized float16 sentence
+   vectors, keyed by a hash of the chunk text and saved next to the vector store
+
+At query time, compression is then a lookup plus one matrix product, whatever
+the embedding model costs.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+SENTENCE_MIN_CHARS = 20  # Shorter fragments ("Goals: 25") are not worth scoring on their own
+STORE_DIR_NAME = "sentence_store"
+
+# Words that end with a period without ending the sentence
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "st", "jr", "sr", "vs", "v", "no", "nos", "approx",
+    "e.g", "i.e", "etc", "al", "fig", "min", "max", "avg", "pts", "ft", "jan", "feb",
+    "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+}
+
+# A run of terminal punctuation (plus closing quotes/brackets) followed by whitespace, or a line break
+_BOUNDARY = re.compile(r"[.!?]+[\"')\]]*\s+|\n+")
+_BULLET = re.compile(r"^(?:[-*•·]|\d+[.)])\s+")
+_LAST_WORD = re.compile(r"([\w.]+)$")
+
+
+# === Helper: Is This Punctuation a Real Sentence End? ===
+def _is_sentence_end(text, match):
+    """Rejects boundaries after abbreviations and initials, or before lowercase text."""
+    following = text[match.end():match.end() + 1]
+    if following and following.islower():
+        return False
+
+    if not match.group().startswith("."):
+        return True  # "!" and "?" always end a sentence
+    word = _LAST_WORD.search(text, 0, match.start())
+    if not word:
+        return True
+    word = word.group(1).lower()
+    if word in ABBREVIATIONS:
+        return False
+    return not (len(word) == 1 and word.isalpha())  # Initials: "J. Smith"
+
+
+# === Function 1: Segment Text into Sentences ===
+def segment_sentences(text: str, min_chars=SENTENCE_MIN_CHARS):
+    """
+    Splits text into sentences and returns their character offsets.
+
+    Args:
+        text (str): Chunk content
+        min_chars (int): Sentences shorter than this are dropped
+
+    Returns:
+        List[Tuple[int, int]]: (start, end) offsets into `text`, in order;
+        `text[start:end]` is the sentence including its final punctuation
+    """
+    spans = []
+    start = 0
+
+    def add_span(span_start, span_end):
+        sentence = text[span_start:span_end]
+        stripped = sentence.lstrip()
+        span_start += len(sentence) - len(stripped)
+        bullet = _BULLET.match(stripped)
+        if bullet:
+            span_start += bullet.end()
+        span_end = span_start + len(text[span_start:span_end].rstrip())
+        if span_end - span_start >= min_chars:
+            spans.append((span_start, span_end))
+
+    for match in _BOUNDARY.finditer(text):
+        if "\n" not in match.group() and not _is_sentence_end(text, match):
+            continue
+        # The sentence keeps its punctuation; a bare line break contributes nothing
+        add_span(start, match.start() + len(match.group().rstrip()))
+        start = match.end()
+    add_span(start, len(text))
+
+    return spans
+
+
+# === Helper: Stable Key for a Chunk's Text ===
+def chunk_key(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# === Class: Sentence Side Store ===
+class SentenceStore:
+    """
+    Sentence offsets and unit-length sentence embeddings for every ingested chunk.
+
+    Rows for one chunk are contiguous: `chunks[key] = (first_row, count)` points into
+    an (n, 2) int32 offsets array and an (n, dim) float16 vectors array. On disk the
+    vectors are memory-mapped, so only the rows a query touches are read.
+
+    Args:
+        persist_dir (str, optional): Folder the store is saved in (None = memory only)
+    """
+
+    def __init__(self, persist_dir=None):
+        self.persist_dir = persist_dir
+        self.model_name = None
+        self._chunks = {}        # chunk key -> (first_row, count)
+        self._offsets = np.empty((0, 2), dtype=np.int32)
+        self._vectors = None     # (n, dim) float16
+        self._pending = []       # (offsets, vectors) blocks not yet merged into the arrays
+        self._num_rows = 0
+        self._lock = threading.RLock()
+
+        if persist_dir and os.path.exists(os.path.join(persist_dir, "chunks.json")):
+            self._load()
+
+    def __contains__(self, text):
+        return chunk_key(text) in self._chunks
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def ensure_model(self, embeddings):
+        """Drops the stored vectors if they were made by a different embedding model."""
+        model_name = _model_name(embeddings)
+        with self._lock:
+            if self.model_name not in (None, model_name):
+                print(f"  ♻️ Sentence store built with {self.model_name}, resetting for {model_name}")
+                self._reset()
+            self.model_name = model_name
+
+    def add_chunks(self, texts, embeddings, batch_size=64):
+        """
+        Segments and embeds every chunk of `texts` not stored yet.
+
+        The store is itself the cache for sentence vectors, so the embedding
+        cache wrapper (if any) is bypassed.
+
+        Returns:
+            int: Number of sentences embedded
+        """
+        self.ensure_model(embeddings)
+        model = getattr(embeddings, "base_embeddings", embeddings)
+
+        with self._lock:
+            new_texts = {}
+            for text in texts:
+                key = chunk_key(text)
+                if key not in self._chunks:
+                    new_texts.setdefault(key, text)
+
+        if not new_texts:
+            return 0
+
+        keys = list(new_texts)
+        spans = [segment_sentences(new_texts[key]) for key in keys]
+        sentences = [new_texts[key][s:e] for key, key_spans in zip(keys, spans) for s, e in key_spans]
+
+        vectors = []
+        for start in range(0, len(sentences), batch_size):
+            vectors.extend(model.embed_documents(sentences[start:start + batch_size]))
+        vectors = _unit_rows(vectors).astype(np.float16) if vectors else None
+
+        with self._lock:
+            row = self._num_rows
+            offsets = np.asarray([span for key_spans in spans for span in key_spans], dtype=np.int32).reshape(-1, 2)
+            for key, key_spans in zip(keys, spans):
+                self._chunks[key] = (row, len(key_spans))
+                row += len(key_spans)
+            if len(offsets):
+                self._pending.append((offsets, vectors))
+                self._num_rows = row
+        return len(sentences)
+
+    def lookup(self, text):
+        """
+        Returns the stored sentences of one chunk.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray] | None: (offsets (c, 2), float32 unit vectors (c, dim)),
+            or None if the chunk was never added
+        """
+        with self._lock:
+            entry = self._chunks.get(chunk_key(text))
+            if entry is None:
+                return None
+            self._merge_pending()
+            first, count = entry
+            if not count:
+                return np.empty((0, 2), dtype=np.int32), None
+            return (
+                np.asarray(self._offsets[first:first + count]),
+                np.asarray(self._vectors[first:first + count], dtype=np.float32),
+            )
+
+    def persist(self):
+        """Writes offsets, vectors and the chunk table to `persist_dir`."""
+        if not self.persist_dir:
+            return
+        with self._lock:
+            self._merge_pending()
+            os.makedirs(self.persist_dir, exist_ok=True)
+            _atomic_save(os.path.join(self.persist_dir, "offsets.npy"), self._offsets)
+            if self._vectors is not None:
+                _atomic_save(os.path.join(self.persist_dir, "vectors.npy"), self._vectors)
+
+            table_path = os.path.join(self.persist_dir, "chunks.json")
+            with open(table_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"model_name": self.model_name, "chunks": self._chunks}, f)
+            os.replace(table_path + ".tmp", table_path)
+
+    def stats(self):
+        """Returns chunk and sentence counts."""
+        return {"chunks": len(self._chunks), "sentences": self._num_rows}
+
+    def _merge_pending(self):
+        if not self._pending:
+            return
+        offsets = [self._offsets] + [block[0] for block in self._pending]
+        vectors = ([] if self._vectors is None else [self._vectors]) + [block[1] for block in self._pending]
+        self._offsets = np.concatenate(offsets)
+        self._vectors = np.concatenate(vectors)
+        self._pending = []
+
+    def _reset(self):
+        self._chunks = {}
+        self._offsets = np.empty((0, 2), dtype=np.int32)
+        self._vectors = None
+        self._pending = []
+        self._num_rows = 0
+
+    def _load(self):
+        with open(os.path.join(self.persist_dir, "chunks.json"), "r", encoding="utf-8") as f:
+            table = json.load(f)
+        self.model_name = table["model_name"]
+        self._chunks = {key: tuple(entry) for key, entry in table["chunks"].items()}
+        self._offsets = np.load(os.path.join(self.persist_dir, "offsets.npy"))
+        vectors_path = os.path.join(self.persist_dir, "vectors.npy")
+        if os.path.exists(vectors_path):
+            self._vectors = np.load(vectors_path, mmap_mode="r")
+        self._num_rows = len(self._offsets)
+        print(f"  ✂️ Loaded sentence store ({len(self._chunks)} chunks, {self._num_rows} sentences)")
+
+
+def _model_name(embeddings):
+    return getattr(embeddings, "model_name", type(embeddings).__name__)
+
+
+def _unit_rows(vectors):
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _atomic_save(path, array):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(path + ".tmp", path)
+
+
+# === Shared Store ===
+_active_store = None
+_stores_lock = threading.Lock()
+
+
+def open_sentence_store(persist_dir):
+    """
+    Returns the shared SentenceStore saved alongside the vector store in
+    `persist_dir`, and makes it the one compression uses by default. Only the
+    active store is kept: once another folder is opened (e.g. a new snapshot goes
+    live) the old store is dropped, and requests still holding it finish with it.
+    """
+    global _active_store
+    path = os.path.join(persist_dir, STORE_DIR_NAME)
+    with _stores_lock:
+        if _active_store is None or _active_store.persist_dir != path:
+            _active_store = SentenceStore(path)
+        return _active_store
+
+
+def get_sentence_store():
+    """Returns the store opened last, or a process-wide in-memory store if none was opened."""
+    global _active_store
+    with _stores_lock:
+        if _active_store is None:
+            _active_store = SentenceStore()
+        return _active_store
@@ -0,0 +1,245 @@
+"""
+🪟 Shared Read-Only Index Snapshots
+
+Lets several uvicorn worker processes serve one corpus without each holding a copy:
+1. `publish_snapshot` exports the vector store into a new, immutable version directory
+   (vectors as .npy, ids/texts/metadata as packed UTF-8 blobs plus offset arrays)
+2. The `CURRENT` pointer file is then swapped atomically, so a re-ingest goes live
+   all at once and readers never see a half-written version
+3. `SharedSnapshotIndex` memory-maps every file read-only: all workers share the same
+   page-cache pages, and opening a snapshot copies nothing
+
+Layout of a serving directory:
+    serving_dir/CURRENT              -> name of the live version
+    serving_dir/versions/<version>/  -> one immutable snapshot
+
+Publish from the command line (run from the backend directory):
+    python shared_index.py --persist-dir ./chroma_db --serving-dir ./serving_index
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from flat_index import (
+    NumpyFlatIndex, VECTORS_FILE, SCALES_FILE, _ColumnStore, _encode, _normalize
+)
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+SNAPSHOT_FILE = "snapshot.json"
+COLUMN_FILES = {"ids": "ids", "texts": "texts", "metadatas": "metadatas"}
+
+
+class ReadOnlyIndexError(PermissionError):
+    """Raised on an attempt to write to a published (read-only) snapshot."""
+
+
+# === Helper: Writer for Packed String Columns ===
+class _PackedStringsWriter:
+    """Appends strings to `<path>.bin` and writes their offsets on close."""
+
+    def __init__(self, path, as_json=False):
+        self._path = path
+        self._file = open(path + ".bin", "wb")
+        self._offsets = [0]
+        self._as_json = as_json
+
+    def extend(self, items):
+        for item in items:
+            data = (json.dumps(item) if self._as_json else item).encode("utf-8")
+            self._file.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        self._file.close()
+        np.save(self._path + ".offsets.npy", np.asarray(self._offsets, dtype=np.int64))
+
+
+# === Function 1: Publish a Snapshot ===
+def publish_snapshot(vectordb, serving_dir, persist_dir=None, dtype="float32", keep_versions=3):
+    """
+    Exports every chunk of `vectordb` into a new version directory and makes it live.
+
+    Args:
+        vectordb: Any supported vector store (Chroma, flat or IVF-PQ index)
+        serving_dir (str): Root of the shared snapshots
+        persist_dir (str, optional): The store's directory; its sentence store is
+            copied along so compression matches the published chunks
+        dtype (str): Vector storage precision ("float32", "float16" or "int8")
+        keep_versions (int): Old versions kept on disk (workers may still be reading them)
+
+    Returns:
+        str: The published version name
+    """
+    # 🔁 Lazy import to avoid circular dependency
+    from vector_db import count_vectors, iter_vector_batches, mark_corpus_updated
+
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 1_000_000_000:09d}"
+    versions_root = os.path.join(serving_dir, VERSIONS_DIR)
+    staging_dir = os.path.join(versions_root, f".staging-{version}")
+    os.makedirs(staging_dir)
+
+    total = count_vectors(vectordb)
+    print(f"📤 Publishing snapshot {version} ({total} chunks) to {serving_dir}")
+
+    ids = _PackedStringsWriter(os.path.join(staging_dir, "ids"))
+    texts = _PackedStringsWriter(os.path.join(staging_dir, "texts"))
+    metadatas = _PackedStringsWriter(os.path.join(staging_dir, "metadatas"), as_json=True)
+    matrix, scales, row = None, None, 0
+
+    # Stream the store out batch by batch, writing vectors straight into .npy files
+    for batch_ids, batch_vectors, batch_texts, batch_metadatas in iter_vector_batches(vectordb):
+        codes, batch_scales = _encode(_normalize(batch_vectors), dtype)
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(
+                os.path.join(staging_dir, VECTORS_FILE), mode="w+", dtype=codes.dtype, shape=(total, codes.shape[1])
+            )
+            if batch_scales is not None:
+                scales = np.lib.format.open_memmap(
+                    os.path.join(staging_dir, SCALES_FILE), mode="w+", dtype=np.float32, shape=(total,)
+                )
+        matrix[row:row + len(codes)] = codes
+        if scales is not None:
+            scales[row:row + len(codes)] = batch_scales
+        row += len(codes)
+
+        ids.extend(batch_ids)
+        texts.extend(batch_texts)
+        metadatas.extend(metadata or {} for metadata in batch_metadatas)
+
+    for writer in (ids, texts, metadatas):
+        writer.close()
+    for array in (matrix, scales):
+        if array is not None:
+            array.flush()
+
+    if persist_dir and os.path.isdir(os.path.join(persist_dir, "sentence_store")):
+        shutil.copytree(os.path.join(persist_dir, "sentence_store"), os.path.join(staging_dir, "sentence_store"))
+
+    with open(os.path.join(staging_dir, SNAPSHOT_FILE), "w", encoding="utf-8") as f:
+        json.dump({"version": version, "count": row, "dtype": dtype, "created": time.time()}, f)
+    mark_corpus_updated(staging_dir)
+
+    # Go live: finished directory first, then the pointer (both renames are atomic)
+    os.replace(staging_dir, os.path.join(versions_root, version))
+    pointer_tmp = os.path.join(serving_dir, CURRENT_FILE + ".tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(serving_dir, CURRENT_FILE))
+
+    _prune_versions(versions_root, keep_versions)
+    print(f"  ✅ Snapshot {version} is live")
+    return version
+
+
+def _prune_versions(versions_root, keep_versions):
+    """Deletes all but the newest versions. Workers still mapping a deleted
+    version keep reading it safely; the space is freed when they let go."""
+    versions = sorted(name for name in os.listdir(versions_root) if not name.startswith("."))
+    for name in versions[:-keep_versions]:
+        shutil.rmtree(os.path.join(versions_root, name), ignore_errors=True)
+
+
+def current_version(serving_dir):
+    """Name of the live version, or None if nothing was published yet."""
+    try:
+        with open(os.path.join(serving_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# === Class: Read-Only Snapshot Index ===
+class SharedSnapshotIndex(NumpyFlatIndex):
+    """
+    Exact-search flat index over a published snapshot. Vectors, ids, texts and
+    metadata are all memory-mapped read-only, so N worker processes opening the
+    same version share one copy of the data in the page cache.
+
+    Args:
+        embedding_function: Embedding model used for queries
+        serving_dir (str): Root of the shared snapshots
+        version (str, optional): Version to open (default: the live one)
+    """
+
+    def __init__(self, embedding_function, serving_dir, version=None):
+        version = version or current_version(serving_dir)
+        if version is None:
+            raise FileNotFoundError(f"No snapshot published in {serving_dir}")
+
+        self.serving_dir = serving_dir
+        self.version = version
+        super().__init__(embedding_function, persist_directory=None)
+        self._persist_directory = os.path.join(serving_dir, VERSIONS_DIR, version)
+        self._load()
+
+    def is_stale(self):
+        """Whether a newer version has been published since this one was opened."""
+        return current_version(self.serving_dir) != self.version
+
+    def add_vectors(self, texts, vectors, metadatas=None, ids=None):
+        raise ReadOnlyIndexError("Snapshots are read-only; re-ingest and publish a new version")
+
+    def delete(self, ids=None, **kwargs):
+        raise ReadOnlyIndexError("Snapshots are read-only; re-ingest and publish a new version")
+
+    def persist(self):
+        pass  # Nothing to write: published versions never change
+
+    def _load(self):
+        with open(os.path.join(self._persist_directory, SNAPSHOT_FILE), "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        self.dtype = snapshot["dtype"]
+        self._columns = _ColumnStore(COLUMN_FILES, self._persist_directory)
+        self._id_to_row = None  # Only needed for writes
+
+        vectors_path = os.path.join(self._persist_directory, VECTORS_FILE)
+        if os.path.exists(vectors_path):
+            self._matrix = np.load(vectors_path, mmap_mode="r")
+        scales_path = os.path.join(self._persist_directory, SCALES_FILE)
+        if os.path.exists(scales_path):
+            self._scales = np.load(scales_path, mmap_mode="r")
+        print(f"  🪟 Opened snapshot {self.version} ({len(self._ids)} chunks, memory-mapped)")
+
+
+# === Function 2: Open the Live Snapshot ===
+def open_shared_index(embeddings, serving_dir):
+    """
+    Opens the live snapshot (and its sentence store) for serving.
+
+    Args:
+        embeddings: Embedding model used for queries
+        serving_dir (str): Root of the shared snapshots
+
+    Returns:
+        SharedSnapshotIndex: The read-only index
+    """
+    # 🔁 Lazy imports to avoid circular dependency
+    from embedding_cache import with_embedding_cache
+    from sentence_store import open_sentence_store
+
+    index = SharedSnapshotIndex(with_embedding_cache(embeddings), serving_dir)
+    open_sentence_store(index._persist_directory)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish the vector store as a shared read-only snapshot")
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    parser.add_argument("--serving-dir", default="./serving_index")
+    parser.add_argument("--backend", choices=["chroma", "flat", "ivfpq"], default=None)
+    parser.add_argument("--dtype", choices=["float32", "float16", "int8"], default="float32")
+    args = parser.parse_args()
+
+    from vector_db import load_existing_database
+    publish_snapshot(
+        load_existing_database(None, args.persist_dir, args.backend),
+        args.serving_dir,
+        persist_dir=args.persist_dir,
+        dtype=args.dtype,
+    )
@@ -5,64 +5,214 @@ This module handles:
 1. Creating a vector database from document chunks
 2. Loading an existing vector DB (from disk)
 3. Retrieving relevant documents for a given query
+4. Retrieving documents together with their stored vectors and scores
+5. Tracking a corpus version so caches know when the store was re-ingested
+6. Retrieving for many queries at once with a shared, deduplicated chunk pool
+7. Loading the embedding model and opening (or building) the store at startup
+
+Three storage backends are supported: "chroma" (default), "flat", an in-process
+NumPy index (see flat_index.py), and "ivfpq", an approximate IVF-PQ index for very
+large corpora (see ivfpq_index.py). Pick one with the `backend` argument or the
+VECTOR_BACKEND environment variable; an existing flat or IVF-PQ index is detected on load.
 """
 
+import os
+import time
+
 from langchain_community.vectorstores import Chroma  # ChromaDB integration with LangChain
+from langchain.schema import Document  # Standard LangChain document container
+
+from embedding_cache import with_embedding_cache  # Shared on-disk/in-memory embedding cache
+from flat_index import NumpyFlatIndex, has_flat_index  # In-process NumPy backend
+from ivfpq_index import IVFPQIndex, has_ivfpq_index  # Approximate (IVF-PQ) backend
+from metrics import timed_stage, record  # Per-stage timing and counts
+from sentence_store import open_sentence_store  # Per-chunk sentences for compression
+
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # "chroma", "flat" or "ivfpq"
+FLAT_INDEX_DTYPE = os.getenv("FLAT_INDEX_DTYPE", "float32")  # "float32", "float16" or "int8"
+
+# IVF-PQ operating point (see `python benchmark.py --ann-sweep` for recall vs. QPS)
+IVFPQ_NLIST = int(os.getenv("IVFPQ_NLIST", "0")) or None  # 0 = ~4*sqrt(n) at training time
+IVFPQ_SUBSPACES = int(os.getenv("IVFPQ_SUBSPACES", "48"))
+IVFPQ_NPROBE = int(os.getenv("IVFPQ_NPROBE", "8"))
+IVFPQ_RESCORE = os.getenv("IVFPQ_RESCORE", "true").lower() == "true"
+
+# Stores implemented in this repo (they share query_by_vectors/add_vectors/count/persist)
+LOCAL_INDEX_TYPES = (NumpyFlatIndex, IVFPQIndex)
+
+
+# === Backend Helpers: Operations Both Stores Support ===
+def _resolve_backend(backend, persist_dir):
+    if backend:
+        return backend
+    if has_ivfpq_index(persist_dir):
+        return "ivfpq"
+    return "flat" if has_flat_index(persist_dir) else VECTOR_BACKEND
+
+
+def _ivfpq_options():
+    return {
+        "nlist": IVFPQ_NLIST,
+        "num_subspaces": IVFPQ_SUBSPACES,
+        "nprobe": IVFPQ_NPROBE,
+        "rescore": IVFPQ_RESCORE,
+    }
+
+
+def query_by_vectors(vectordb, query_embeddings, k):
+    """Top-k search for precomputed query vectors; returns ids, documents, metadatas and embeddings."""
+    if isinstance(vectordb, LOCAL_INDEX_TYPES):
+        return vectordb.query_by_vectors(query_embeddings, k)
+    return vectordb._collection.query(
+        query_embeddings=query_embeddings,
+        n_results=k,
+        include=["documents", "metadatas", "embeddings"]
+    )
+
+
+def upsert_vectors(vectordb, ids, vectors, texts, metadatas):
+    """Writes precomputed vectors, replacing any existing entries with the same ids."""
+    if isinstance(vectordb, LOCAL_INDEX_TYPES):
+        vectordb.add_vectors(texts, vectors, metadatas, ids)
+    else:
+        vectordb._collection.upsert(ids=ids, embeddings=vectors, documents=texts, metadatas=metadatas)
+
+
+def count_vectors(vectordb):
+    """Number of chunks stored."""
+    if isinstance(vectordb, LOCAL_INDEX_TYPES):
+        return vectordb.count()
+    return vectordb._collection.count()
+
+
+def iter_vector_batches(vectordb, batch_size=5000):
+    """Yields (ids, vectors, texts, metadatas) for every stored chunk, `batch_size` at a time."""
+    total = count_vectors(vectordb)
+    for start in range(0, total, batch_size):
+        if isinstance(vectordb, LOCAL_INDEX_TYPES):
+            end = min(start + batch_size, total)
+            yield (
+                vectordb._ids[start:end],
+                vectordb.get_vectors(start, end),
+                vectordb._texts[start:end],
+                vectordb._metadatas[start:end],
+            )
+        else:
+            batch = vectordb._collection.get(
+                limit=batch_size, offset=start, include=["embeddings", "documents", "metadatas"]
+            )
+            yield batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"]
+
+
+def flush_vector_store(vectordb):
+    """Makes pending writes durable (Chroma persists on every write; local indexes on demand)."""
+    if isinstance(vectordb, LOCAL_INDEX_TYPES):
+        vectordb.persist()
 
 
 # === Function 1: Create and Persist a Vector Database ===
-def create_vector_database(docs, embeddings, persist_dir="./chroma_db"):
+def create_vector_database(docs, embeddings, persist_dir="./chroma_db", backend=None):
     """
-    Converts document chunks into vector embeddings and stores them in a persistent ChromaDB database.
+    Converts document chunks into vector embeddings and stores them in a persistent ChromaDB database
+    (or a flat NumPy index when backend="flat", an IVF-PQ index when backend="ivfpq").
 
     Args:
         docs (List[Document]): Chunked documents to store
         embeddings: Embedding model (e.g., HuggingFaceEmbeddings)
         persist_dir (str): Directory to save the ChromaDB
+        backend (str, optional): "chroma", "flat" or "ivfpq" (default: VECTOR_BACKEND)
 
     Returns:
-        Chroma: The created vector store object
+        Chroma | NumpyFlatIndex | IVFPQIndex: The created vector store object
     """
-    print(f"🗃️ Creating vector database in {persist_dir}")
+    backend = backend or VECTOR_BACKEND
+    print(f"🗃️ Creating {backend} vector database in {persist_dir}")
 
-    # Create a Chroma vector database from the given documents
-    vectordb = Chroma.from_documents(
-        docs,
-        embedding=embeddings,
-        persist_directory=persist_dir
-    )
+    # Create a vector database from the given documents
+    # (embeddings go through the cache so re-ingesting unchanged text is free)
+    if backend == "flat":
+        vectordb = NumpyFlatIndex.from_documents(
+            docs,
+            with_embedding_cache(embeddings),
+            persist_directory=persist_dir,
+            dtype=FLAT_INDEX_DTYPE
+        )
+    elif backend == "ivfpq":
+        vectordb = IVFPQIndex.from_documents(
+            docs,
+            with_embedding_cache(embeddings),
+            persist_directory=persist_dir,
+            **_ivfpq_options()
+        )
+    else:
+        vectordb = Chroma.from_documents(
+            docs,
+            embedding=with_embedding_cache(embeddings),
+            persist_directory=persist_dir
+        )
+
+    # Segment and embed every chunk's sentences once, for query-time compression
+    sentence_store = open_sentence_store(persist_dir)
+    sentence_store.add_chunks([doc.page_content for doc in docs], embeddings)
 
     # Save to disk so we can reload later
     vectordb.persist()
+    sentence_store.persist()
+    mark_corpus_updated(persist_dir)
 
     print("  ✅ Vector database created and persisted")
     return vectordb
 
 
 # === Function 2: Load an Existing Vector Database ===
-def load_existing_database(embeddings, persist_dir="./chroma_db"):
+def load_existing_database(embeddings, persist_dir="./chroma_db", backend=None):
     """
-    Loads a previously saved ChromaDB from disk.
+    Loads a previously saved ChromaDB (or flat / IVF-PQ index) from disk.
 
     Args:
-        embeddings: Embedding function used during creation (must be the same)
+        embeddings: Embedding function used during creation (must be the same), or
+            None to only read the stored vectors
         persist_dir (str): Directory where the database is stored
+        backend (str, optional): "chroma", "flat" or "ivfpq" (default: detect, then VECTOR_BACKEND)
 
     Returns:
-        Chroma: The loaded vector store object
+        Chroma | NumpyFlatIndex | IVFPQIndex: The loaded vector store object
     """
-    print(f"📂 Loading existing database from {persist_dir}")
+    backend = _resolve_backend(backend, persist_dir)
+    print(f"📂 Loading existing {backend} database from {persist_dir}")
+    # Without a model (e.g. only exporting stored vectors) there is nothing to cache
+    embedding_function = with_embedding_cache(embeddings) if embeddings is not None else None
 
-    vectordb = Chroma(
-        persist_directory=persist_dir,
-        embedding_function=embeddings
-    )
+    if backend == "flat":
+        vectordb = NumpyFlatIndex(
+            embedding_function,
+            persist_directory=persist_dir,
+            dtype=FLAT_INDEX_DTYPE
+        )
+    elif backend == "ivfpq":
+        vectordb = IVFPQIndex(
+            embedding_function,
+            persist_directory=persist_dir,
+            **_ivfpq_options()
+        )
+        # The search-time knobs come from the environment, not the saved config
+        vectordb.nprobe, vectordb.rescore = IVFPQ_NPROBE, IVFPQ_RESCORE
+    else:
+        vectordb = Chroma(
+            persist_directory=persist_dir,
+            embedding_function=embedding_function
+        )
+
+    open_sentence_store(persist_dir)
 
     print("  ✅ Database loaded")
     return vectordb
 
 
 # === Function 3: Retrieve Top-K Relevant Documents ===
+@timed_stage("retrieval")
 def retrieve_relevant_documents(vectordb, query: str, k: int = 10):
     """
     Given a query, fetches the top-K most relevant documents using vector similarity search.
@@ -82,6 +232,177 @@ def retrieve_relevant_documents(vectordb, query: str, k: int = 10):
 
     # Get the most relevant documents
     docs = retriever.get_relevant_documents(query)
+    record("retrieved_docs", len(docs))
 
     print(f"  📖 Retrieved {len(docs)} documents")
     return docs
+
+
+# === Function 4: Retrieve Top-K Documents with Stored Vectors ===
+@timed_stage("retrieval")
+def retrieve_documents_with_vectors(vectordb, query: str, k: int = 10):
+    """
+    Like `retrieve_relevant_documents`, but also returns the embedding Chroma
+    already holds for each chunk and its cosine similarity to the query, so
+    later stages don't need to embed the chunks again.
+
+    Args:
+        vectordb: The Chroma vector store
+        query (str): The user question or sub-question
+        k (int): Number of top documents to retrieve
+
+    Returns:
+        Tuple[List[Document], List[List[float]], List[float]]:
+            Documents, their stored embeddings and their similarity to the query
+    """
+    print(f"📚 Retrieving documents with vectors for: {query[:50]}...")
+
+    # 🔁 Lazy import to avoid circular dependency
+    from document_processor import _cosine_scores
+
+    # Embed the query with the same model the collection was built with
+    query_embedding = vectordb.embeddings.embed_query(query)
+
+    # Query the underlying index directly so vectors come back too
+    results = query_by_vectors(vectordb, [query_embedding], k)
+
+    texts = results["documents"][0]
+    metadatas = results["metadatas"][0]
+    doc_embeddings = [list(vector) for vector in results["embeddings"][0]]
+
+    docs = [
+        Document(page_content=text, metadata=metadata or {})
+        for text, metadata in zip(texts, metadatas)
+    ]
+
+    scores = _cosine_scores(query_embedding, doc_embeddings).tolist() if docs else []
+    record("retrieved_docs", len(docs))
+
+    print(f"  📖 Retrieved {len(docs)} documents")
+    return docs, doc_embeddings, scores
+
+
+# === Function 5: Corpus Version Tracking ===
+CORPUS_VERSION_FILE = "corpus_version"
+
+
+def mark_corpus_updated(persist_dir="./chroma_db"):
+    """
+    Records that the vector store contents changed. Call after every ingestion
+    so answer caches built against the old contents get invalidated.
+
+    Args:
+        persist_dir (str): Directory of the ChromaDB
+    """
+    os.makedirs(persist_dir, exist_ok=True)
+    with open(os.path.join(persist_dir, CORPUS_VERSION_FILE), "w", encoding="utf-8") as f:
+        f.write(str(time.time_ns()))
+
+
+def read_corpus_version(persist_dir="./chroma_db"):
+    """
+    Returns the current corpus version (None if never recorded).
+
+    Args:
+        persist_dir (str): Directory of the ChromaDB
+    """
+    try:
+        with open(os.path.join(persist_dir, CORPUS_VERSION_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except (FileNotFoundError, TypeError):
+        return None
+
+
+# === Function 6: Retrieve for Many Queries in One Pass ===
+@timed_stage("batch_retrieval")
+def retrieve_documents_for_queries(vectordb, queries, k: int = 10):
+    """
+    Embeds all queries in one model call and runs a single multi-query search.
+    Chunks returned for several queries are stored once in a shared pool.
+
+    Args:
+        vectordb: The Chroma vector store
+        queries (List[str]): Sub-questions to retrieve for
+        k (int): Number of top documents to retrieve per query
+
+    Returns:
+        Tuple[List[List[Document]], Dict[str, List[float]], List[List[float]]]:
+            Per-query documents (fresh copies, safe to compress independently),
+            the chunk pool mapping chunk text to its stored embedding, and the
+            query embeddings
+    """
+    print(f"📚 Batch retrieving documents for {len(queries)} queries")
+
+    if not queries:
+        return [], {}, []
+
+    # One embedding call for every query
+    query_embeddings = vectordb.embeddings.embed_documents(list(queries))
+
+    # One search for every query
+    results = query_by_vectors(vectordb, query_embeddings, k)
+
+    pool = {}  # chunk id -> (text, metadata, embedding)
+    per_query_ids = []
+    for ids, texts, metadatas, vectors in zip(
+        results["ids"], results["documents"], results["metadatas"], results["embeddings"]
+    ):
+        for chunk_id, text, metadata, vector in zip(ids, texts, metadatas, vectors):
+            if chunk_id not in pool:
+                pool[chunk_id] = (text, metadata or {}, list(vector))
+        per_query_ids.append(ids)
+
+    per_query_docs = [
+        [Document(page_content=pool[chunk_id][0], metadata=dict(pool[chunk_id][1])) for chunk_id in ids]
+        for ids in per_query_ids
+    ]
+    stored_embeddings = {text: vector for text, _, vector in pool.values()}
+
+    total = sum(len(ids) for ids in per_query_ids)
+    record("retrieved_docs", total)
+    record("distinct_chunks", len(pool))
+    print(f"  📖 Retrieved {total} documents ({len(pool)} distinct chunks)")
+    return per_query_docs, stored_embeddings, [list(vector) for vector in query_embeddings]
+
+
+# === Function 7: Load the Embedding Model ===
+def load_embedding_model(model_name: str = EMBEDDING_MODEL_NAME):
+    """
+    Loads the sentence-transformers model used for every embedding in the app,
+    wrapped in the shared embedding cache.
+
+    Args:
+        model_name (str): HuggingFace model id
+
+    Returns:
+        CachedEmbeddings: The cached embedding model
+    """
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    print(f"🧠 Loading embedding model {model_name}")
+    return with_embedding_cache(HuggingFaceEmbeddings(model_name=model_name))
+
+
+# === Function 8: Open the Vector Store, Building It if Needed ===
+def init_vector_store(embeddings, persist_dir="./chroma_db", docs_folder="data/sports_documents"):
+    """
+    Opens the persisted vector store. If it is empty (first run), the corpus in
+    `docs_folder` is ingested first.
+
+    Args:
+        embeddings: Embedding model (e.g., HuggingFaceEmbeddings)
+        persist_dir (str): Directory of the ChromaDB
+        docs_folder (str): Folder with the .txt corpus used for a first build
+
+    Returns:
+        Chroma: The ready-to-query vector store
+    """
+    vectordb = load_existing_database(embeddings, persist_dir)
+
+    if count_vectors(vectordb) == 0:
+        print(f"  ⚠️ Vector store is empty, ingesting {docs_folder}")
+        # 🔁 Lazy import to avoid circular dependency
+        from ingestion import ingest_incrementally
+        vectordb, _ = ingest_incrementally(docs_folder, embeddings, persist_dir)
+
+    return vectordb
@@ -47,10 +47,69 @@ def display_citations(citations: List[Dict[str, str]]):
     """Display citations in a formatted way"""
     for citation in citations:
         st.markdown(f"""
-        **Source**: {citation.get('source', 'Unknown')}
+        **{citation.get('id', '')} Source**: {citation.get('source', 'Unknown')}
         > {citation.get('text', '')}
         """)
 
+def stream_query_events(query: str):
+    """Yield (event, data) pairs from the backend's Server-Sent Events stream"""
+    with requests.post(
+        f"{API_URL}/process_query/stream",
+        json={"query": query},
+        stream=True
+    ) as response:
+        response.raise_for_status()
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue  # Blank line ends an event; we emit on the data line
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):].strip())
+                event = "message"
+
+def render_streaming_results(query: str):
+    """Render sub-question answers incrementally as the backend streams them"""
+    st.header("📊 Results")
+    st.markdown("### Original Query")
+    st.info(query)
+
+    status = st.empty()
+    status.write("Breaking down the query...")
+    answer_boxes = {}
+    partial_answers = {}
+
+    for event, data in stream_query_events(query):
+        if event == "decomposition":
+            status.write(f"Answering {len(data['sub_questions'])} sub-questions...")
+            for i, sub_q in enumerate(data["sub_questions"], 1):
+                st.markdown(f"**Sub-Question {i}: {sub_q}**")
+                answer_boxes[i] = st.empty()
+                partial_answers[i] = ""
+
+        elif event == "token":
+            # Show the answer growing token by token
+            partial_answers[data["index"]] += data["token"]
+            answer_boxes[data["index"]].markdown(partial_answers[data["index"]])
+
+        elif event == "sub_answer":
+            with answer_boxes[data["index"]].container():
+                st.write(data["answer"])
+                with st.expander("Citations"):
+                    display_citations(data["citations"])
+                with st.expander("Processing Details"):
+                    st.json(data.get("processing_steps", {}))
+
+        elif event == "error":
+            if "index" in data:
+                answer_boxes[data["index"]].error(data["detail"])
+            else:
+                st.error(f"Error: {data['detail']}")
+
+        elif event == "done":
+            status.success("All sub-questions answered")
+
 def main():
     # Header
     st.title("🏈 Sports Analytics RAG System")
@@ -80,8 +139,18 @@ def main():
             query = sample
             st.session_state.query = sample
     
+    stream_results = st.checkbox("Stream answers as they are generated", value=True)
+
     # Process query
-    if query and st.button("Process Query"):
+    process_clicked = query and st.button("Process Query")
+
+    if process_clicked and stream_results:
+        try:
+            render_streaming_results(query)
+        except Exception as e:
+            st.error(f"Error connecting to the backend: {str(e)}")
+
+    elif process_clicked:
         with st.spinner("Processing your query..."):
             try:
                 # Call the backend API
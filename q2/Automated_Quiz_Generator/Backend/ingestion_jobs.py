@@ -0,0 +1,303 @@
+"""
+Background Ingestion Jobs
+
+Runs document ingestion (extraction, chunking, embedding, indexing) off the request
+path, so a large upload never blocks `/generate`:
+1. A bounded worker pool: at most `max_workers` documents are ingested at once and at
+   most `max_pending` wait or run; beyond that new uploads are refused (`QueueFull`)
+2. Job records with status, current stage, chunk progress and per-stage timings,
+   written to small JSON files so every worker process can answer `/jobs/{id}`
+3. A throttle shared with the query endpoints: ingestion works in small batches and,
+   between batches, yields to queries that are in flight
+"""
+
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from uuid import uuid4
+
+
+class QueueFull(Exception):
+    """Raised when too many ingestion jobs are already queued or running."""
+
+
+# === Class: Query-Aware Ingestion Throttle ===
+class IngestionThrottle:
+    """
+    Lets ingestion give way to query traffic.
+
+    Args:
+        batch_pause (float): Seconds every ingestion batch sleeps, even when idle
+        max_pause (float): Longest a batch waits for in-flight queries to finish
+    """
+
+    def __init__(self, batch_pause=0.05, max_pause=2.0):
+        self.batch_pause = batch_pause
+        self.max_pause = max_pause
+        self.active_queries = 0
+        self._idle = threading.Condition()
+
+    @contextmanager
+    def query(self):
+        """Marks a query as in flight for the duration of the `with` block."""
+        with self._idle:
+            self.active_queries += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self.active_queries -= 1
+                if not self.active_queries:
+                    self._idle.notify_all()
+
+    def pause(self):
+        """
+        Called by ingestion between batches. Waits until no query is in flight
+        (at most `max_pause`, so ingestion always makes progress).
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        start = time.perf_counter()
+        time.sleep(self.batch_pause)
+        with self._idle:
+            self._idle.wait_for(lambda: not self.active_queries, timeout=self.max_pause)
+        return time.perf_counter() - start
+
+
+# === Class: Ingestion Job ===
+class IngestionJob:
+    """
+    Progress and timings of one document's ingestion.
+
+    Args:
+        filename (str): Name of the uploaded file (for display)
+        throttle (IngestionThrottle): Throttle to yield to between batches (None: never yield)
+        on_update (callable): Called with the job whenever its state changes
+    """
+
+    def __init__(self, filename, throttle=None, on_update=None):
+        self.id = uuid4().hex
+        self.filename = filename
+        self.status = "queued"  # queued -> running -> done | failed
+        self.stage = None
+        self.chunks_done = 0
+        self.chunks_total = None
+        self.pages_done = 0
+        self.pages_total = None
+        self.timings = {}
+        self.throttled_seconds = 0.0
+        self.doc_id = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._throttle = throttle
+        self._on_update = on_update
+
+    @contextmanager
+    def track(self, stage):
+        """Records `stage` as the current stage and its duration in `timings`."""
+        self.stage = stage
+        self._changed()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = round(self.timings.get(stage, 0.0) + time.perf_counter() - start, 4)
+            self._changed()
+
+    def timed(self, iterable, stage):
+        """Yields from `iterable`, adding the time spent waiting on it to `timings[stage]`."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.timings[stage] = round(self.timings.get(stage, 0.0) + time.perf_counter() - start, 4)
+            yield item
+
+    def set_total(self, chunks_total):
+        self.chunks_total = chunks_total
+        self._changed()
+
+    def set_pages(self, pages_total):
+        """Page count of the document, when known (PDF), so progress can be reported early."""
+        self.pages_total = pages_total
+        self._changed()
+
+    def page_done(self):
+        self.pages_done += 1
+        self._changed()
+
+    def advance(self, chunks):
+        """Counts `chunks` as stored, then yields to query traffic before the next batch."""
+        self.chunks_done += chunks
+        self._changed()
+        if self._throttle is not None:
+            self.throttled_seconds += self._throttle.pause()
+
+    def to_dict(self):
+        progress = None
+        if self.status == "done":
+            progress = 1.0
+        elif self.chunks_total:
+            progress = round(self.chunks_done / self.chunks_total, 4)
+        elif self.pages_total:
+            # Chunks are produced while pages are still being extracted
+            progress = round(self.pages_done / self.pages_total, 4)
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": progress,
+            "chunks_done": self.chunks_done,
+            "chunks_total": self.chunks_total,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+            "timings": dict(self.timings),
+            "throttled_seconds": round(self.throttled_seconds, 4),
+            "doc_id": self.doc_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def _changed(self):
+        if self._on_update is not None:
+            self._on_update(self)
+
+
+# === Class: Bounded Ingestion Worker Pool ===
+class IngestionJobManager:
+    """
+    Queues uploaded files for ingestion on a small thread pool.
+
+    Args:
+        process_fn (callable): `process_fn(file_path, job=job)` -> (doc_id, num_chunks)
+        jobs_dir (str): Directory for the job status files (shared by worker processes)
+        max_workers (int): Documents ingested at the same time
+        max_pending (int): Jobs allowed to be queued or running at once
+        keep_jobs (int): Finished job files kept on disk
+        throttle (IngestionThrottle): Shared with the query endpoints
+    """
+
+    def __init__(self, process_fn, jobs_dir="data/ingest_jobs", max_workers=1, max_pending=16,
+                 keep_jobs=500, throttle=None):
+        self.process_fn = process_fn
+        self.jobs_dir = jobs_dir
+        self.max_pending = max_pending
+        self.keep_jobs = keep_jobs
+        self.throttle = throttle or IngestionThrottle()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = {}  # Jobs of this process that are queued or running
+        self._lock = threading.Lock()
+        self._last_saved = {}
+
+    def create(self, filename):
+        """
+        Reserves a slot for a new job (before the upload is saved).
+
+        Raises:
+            QueueFull: If `max_pending` jobs are already queued or running
+        """
+        with self._lock:
+            if len(self._jobs) >= self.max_pending:
+                raise QueueFull(f"{len(self._jobs)} documents are already being ingested, please retry shortly")
+            job = IngestionJob(filename, throttle=self.throttle, on_update=self._save)
+            self._jobs[job.id] = job
+        self._save(job, force=True)
+        return job
+
+    def start(self, job, file_path):
+        """Hands the saved file to the worker pool."""
+        self._executor.submit(self._run, job, file_path)
+
+    def cancel(self, job, error):
+        """Marks a reserved job as failed (e.g. the upload could not be saved)."""
+        self._finish(job, "failed", error=error)
+
+    def get(self, job_id):
+        """Status of a job started by any worker process, or None if unknown."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "max_pending": self.max_pending,
+            "active_queries": self.throttle.active_queries,
+        }
+
+    def _run(self, job, file_path):
+        job.status = "running"
+        job.started_at = time.time()
+        self._save(job, force=True)
+        try:
+            job.doc_id, num_chunks = self.process_fn(file_path, job=job)
+        except Exception as e:
+            traceback.print_exc()
+            self._finish(job, "failed", error=f"{type(e).__name__}: {e}")
+        else:
+            job.chunks_done = num_chunks
+            self._finish(job, "done")
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.stage = None
+        job.error = error
+        job.finished_at = time.time()
+        self._save(job, force=True)
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            self._last_saved.pop(job.id, None)
+        self._prune()
+
+    def _path(self, job_id):
+        # Job ids are hex strings; anything else can't name a file of ours
+        return os.path.join(self.jobs_dir, f"{job_id if job_id.isalnum() else '_'}.json")
+
+    def _save(self, job, force=False):
+        """Writes the job's status file atomically (progress updates at most 4x a second)."""
+        now = time.monotonic()
+        if not force and now - self._last_saved.get(job.id, 0.0) < 0.25:
+            return
+        self._last_saved[job.id] = now
+        path = self._path(job.id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    def _prune(self):
+        """Deletes the oldest job files beyond `keep_jobs`."""
+        try:
+            paths = [os.path.join(self.jobs_dir, name) for name in os.listdir(self.jobs_dir) if name.endswith(".json")]
+            if len(paths) <= self.keep_jobs:
+                return
+            paths.sort(key=os.path.getmtime)
+            for path in paths[:-self.keep_jobs]:
+                if os.path.basename(path)[:-len(".json")] not in self._jobs:
+                    os.remove(path)
+        except OSError:
+            pass  # Another process pruned the same files
@@ -1,4 +1,5 @@
 from fastapi import FastAPI, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import os
@@ -6,7 +7,8 @@ import shutil
 from typing import Literal
 
 # Import processing and generation logic
-from processing import process_file
+from processing import process_file, rebuild_bm25_from_chroma
+from ingestion_jobs import IngestionJobManager, IngestionThrottle, QueueFull
 from rag_engine import hybrid_retrieve
 from quiz_generator import generate_quiz_from_chunks
 
@@ -27,51 +29,111 @@ app.add_middleware(
 UPLOAD_DIR = "data/uploaded_docs"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Uploads are ingested in the background by a small worker pool, which pauses
+# between batches while /generate requests are in flight
+ingestion_throttle = IngestionThrottle(
+    batch_pause=float(os.getenv("INGEST_BATCH_PAUSE_SECONDS", "0.05")),
+    max_pause=float(os.getenv("INGEST_MAX_PAUSE_SECONDS", "2")),
+)
+ingestion_jobs = IngestionJobManager(
+    process_file,
+    jobs_dir=os.getenv("INGEST_JOBS_DIR", "data/ingest_jobs"),
+    max_workers=int(os.getenv("INGEST_WORKERS", "1")),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", "16")),
+    throttle=ingestion_throttle,
+)
+
+@app.on_event("startup")
+def load_sparse_index():
+    """Fills the BM25 index from Chroma if it was never persisted (one-time migration)."""
+    rebuild_bm25_from_chroma()
+
+
 @app.get("/")
 def read_root():
     return {"message": "Quiz Generator Backend is running."}
 
 
-@app.post("/upload")
+def save_upload(file: UploadFile, file_path: str):
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+
+@app.post("/upload", status_code=202)
 async def upload_file(file: UploadFile = File(...)):
     """
-    Save the uploaded file to the local directory and trigger processing.
+    Save the uploaded file and queue it for background processing.
+    Returns a job id right away; poll /jobs/{job_id} for progress.
     """
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    filename = os.path.basename(file.filename or "upload")
+    try:
+        job = ingestion_jobs.create(filename)
+    except QueueFull as e:
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "5"})
+
+    # Prefixed with the job id so two uploads of the same name never overwrite each other
+    file_path = os.path.join(UPLOAD_DIR, f"{job.id}_{filename}")
+    try:
+        await run_in_threadpool(save_upload, file, file_path)
+    except Exception as e:
+        ingestion_jobs.cancel(job, error=f"Could not save upload: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e), "job_id": job.id})
+
+    ingestion_jobs.start(job, file_path)
+
+    return {
+        "message": f"File '{filename}' uploaded and queued for processing.",
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}",
+    }
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Status of an ingestion job: queued / running / done / failed, current stage,
+    chunk progress and per-stage timings (seconds).
+    """
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job '{job_id}'."})
+    return job
 
-    # Process the file for embeddings + indexing
-    process_file(file_path)
 
-    return {"message": f"File '{file.filename}' uploaded and processed successfully."}
+@app.get("/jobs")
+def get_ingestion_load():
+    """Jobs queued and running in this worker, and queries currently in flight."""
+    return ingestion_jobs.stats()
 
 
 @app.post("/generate")
-async def generate_questions(
+def generate_questions(
     topic: str = Form(...),
     q_type: Literal["quiz", "assignment", "test"] = Form(...),
     difficulty: Literal["easy", "medium", "hard"] = Form(...),
     num_questions: int = Form(...),
 ):
     """
-    Hybrid RAG + LLM-based question generation
+    Hybrid RAG + LLM-based question generation.
+    A plain `def`, so FastAPI runs the blocking retrieval and LLM calls on its
+    thread pool instead of the event loop.
     """
     try:
-        # Step 1: Retrieve relevant content using Hybrid RAG
-        chunks = hybrid_retrieve(query=topic, final_k=5)
-
-        if not chunks:
-            return JSONResponse(status_code=404, content={"error": "No relevant content found."})
-
-        # Step 2: Generate questions based on type and difficulty
-        result = generate_quiz_from_chunks(
-            chunks=chunks,
-            q_type=q_type,
-            difficulty=difficulty,
-            count=num_questions
-        )
+        # Background ingestion gives way while this request is in flight
+        with ingestion_throttle.query():
+            # Step 1: Retrieve relevant content using Hybrid RAG
+            chunks = hybrid_retrieve(query=topic, final_k=5)
+
+            if not chunks:
+                return JSONResponse(status_code=404, content={"error": "No relevant content found."})
+
+            # Step 2: Generate questions based on type and difficulty
+            result = generate_quiz_from_chunks(
+                chunks=chunks,
+                q_type=q_type,
+                difficulty=difficulty,
+                count=num_questions
+            )
 
         return {"generated_content": result}
 
@@ -0,0 +1,182 @@
+"""
+Streaming Page Extraction
+
+Extracts the text of uploaded documents piece by piece instead of as one big string,
+so chunking and embedding can start on the first pages of a large textbook while
+later ones are still being read:
+1. PDF - page ranges are extracted in parallel on a process pool (each worker opens
+   the file itself), and yielded back in page order with a bounded number of
+   ranges in flight, so memory stays bounded however long the document is
+2. DOCX - `word/document.xml` is streamed out of the zip archive and parsed
+   incrementally, one paragraph at a time, without building the whole XML tree
+   (same paragraphs and text as python-docx, which it replaces)
+3. TXT - read in blocks of lines
+
+This module deliberately imports nothing heavy: process-pool workers import it on
+their own, and must not load the embedding model.
+"""
+
+import gc
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree.ElementTree import iterparse
+
+PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "32"))
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or os.cpu_count() or 1
+TXT_BLOCK_CHARS = 64 * 1024
+
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Process pool shared by all extractions (spawned, so workers never inherit model threads)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def count_pages(file_path: str):
+    """Number of pages of a PDF (for progress reporting), or None for other formats."""
+    if not file_path.endswith(".pdf"):
+        return None
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+
+def extract_pdf_range(file_path: str, start: int, end: int):
+    """
+    Extracts pages [start, end) of a PDF. Runs in a pool worker.
+
+    Returns:
+        List[str]: One string per page
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    pages = [reader.pages[i].extract_text() or "" for i in range(start, end)]
+    # The reader's object graph is cyclic: free it now, so a worker's memory stays
+    # flat however many ranges it extracts (cheap in a small worker process)
+    del reader
+    gc.collect()
+    return pages
+
+
+# === Function: Stream PDF Pages ===
+def iter_pdf_pages(file_path: str, num_pages: int = None, parallel: bool = True):
+    """
+    Yields the text of every page of a PDF, in order.
+
+    Args:
+        file_path (str): Path to the PDF
+        num_pages (int): Page count, if already known
+        parallel (bool): Spread page ranges over the process pool (small files
+            are always extracted in-process)
+    """
+    if num_pages is None:
+        num_pages = count_pages(file_path)
+    # Every task re-opens the file (~0.05 s for 1000 pages), so ranges shouldn't be too small
+    ranges = [(start, min(start + PAGES_PER_TASK, num_pages)) for start in range(0, num_pages, PAGES_PER_TASK)]
+
+    if not parallel or EXTRACT_WORKERS < 2 or len(ranges) < 2:
+        from pypdf import PdfReader
+        for page in PdfReader(file_path).pages:
+            yield page.extract_text() or ""
+        return
+
+    # Keep two ranges per worker in flight: enough to keep every core busy while
+    # the caller embeds, without holding the whole document's text in memory
+    pool = _get_pool()
+    in_flight = 2 * EXTRACT_WORKERS
+    pending = deque(pool.submit(extract_pdf_range, file_path, start, end) for start, end in ranges[:in_flight])
+    queued = iter(ranges[in_flight:])
+    try:
+        while pending:
+            pages = pending.popleft().result()
+            next_range = next(queued, None)
+            if next_range is not None:
+                pending.append(pool.submit(extract_pdf_range, file_path, *next_range))
+            yield from pages
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+# === Function: Stream DOCX Paragraphs ===
+def iter_docx_paragraphs(file_path: str):
+    """
+    Yields the text of every body paragraph of a DOCX file, in order: the same
+    paragraphs and text as python-docx's `Document(path).paragraphs` / `.text`.
+    Runs, tabs and line breaks are kept; page breaks are dropped, and tables
+    (like nested text boxes) are skipped.
+    """
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml:
+        parts = []
+        table_depth = 0  # > 0 inside a table
+        paragraph_depth = 0  # > 1 inside a paragraph nested in another (text boxes)
+        for event, element in iterparse(xml, events=("start", "end")):
+            tag = element.tag
+            if event == "start":
+                if tag == _WORD_NS + "tbl":
+                    table_depth += 1
+                elif tag == _WORD_NS + "p":
+                    paragraph_depth += 1
+                continue
+
+            if tag == _WORD_NS + "tbl":
+                table_depth -= 1
+                element.clear()
+            elif tag == _WORD_NS + "p":
+                paragraph_depth -= 1
+                if not table_depth and not paragraph_depth:
+                    yield "".join(parts)
+                    parts = []
+                    element.clear()  # Frees the paragraph's subtree as we go
+            elif table_depth or paragraph_depth != 1:
+                continue
+            elif tag == _WORD_NS + "t":
+                parts.append(element.text or "")
+            elif tag == _WORD_NS + "tab":
+                parts.append("\t")
+            elif tag == _WORD_NS + "cr" or (
+                tag == _WORD_NS + "br" and element.get(_WORD_NS + "type", "textWrapping") == "textWrapping"
+            ):
+                parts.append("\n")
+
+
+def iter_txt_blocks(file_path: str):
+    """Yields a text file in blocks of whole lines (about TXT_BLOCK_CHARS each)."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        block, size = [], 0
+        for line in f:
+            block.append(line)
+            size += len(line)
+            if size >= TXT_BLOCK_CHARS:
+                yield "".join(block)
+                block, size = [], 0
+        if block:
+            yield "".join(block)
+
+
+def iter_text(file_path: str, num_pages: int = None, parallel: bool = True):
+    """
+    Streams the text of a PDF (pages), DOCX (paragraphs) or TXT (blocks) file.
+    """
+    if file_path.endswith(".pdf"):
+        return iter_pdf_pages(file_path, num_pages, parallel)
+    elif file_path.endswith(".docx"):
+        return iter_docx_paragraphs(file_path)
+    elif file_path.endswith(".txt"):
+        return iter_txt_blocks(file_path)
+    else:
+        raise ValueError("Unsupported file format")
@@ -1,6 +1,6 @@
 import os
 import glob
-from typing import List
+from typing import Iterable, Iterator, List
 from uuid import uuid4
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -9,39 +9,45 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 
 from sentence_transformers import SentenceTransformer
-from rank_bm25 import BM25Okapi
 
-from docx import Document
-from pypdf import PdfReader
+from embedding_cache import with_embedding_cache
+from ingestion_jobs import IngestionJob
+from page_extraction import count_pages, iter_docx_paragraphs, iter_pdf_pages, iter_text, iter_txt_blocks
+from sparse_index import PersistentBM25Index
 
 # Global paths
 UPLOAD_DIR = "data/uploaded_docs"
 CHROMA_DB_DIR = "data/chroma_db"
+BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", "data/bm25_index")
+# Chunks embedded and stored per batch; ingestion yields to queries between batches
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "32"))
+# Streamed text is split once this many chunks' worth of it has been buffered
+CHUNK_WINDOW_CHUNKS = 16
 
-# Initialize embedding model
+# Initialize embedding model (wrapped in a cache so re-uploaded text isn't re-embedded)
 embedding_model_name = "sentence-transformers/all-MiniLM-L6-v2"
-embedding_function = HuggingFaceEmbeddings(model_name=embedding_model_name)
+embedding_function = with_embedding_cache(HuggingFaceEmbeddings(model_name=embedding_model_name))
 
-# Global BM25 store
-bm25_corpus = []
-bm25_tokenized = []
-bm25_index = None
+# Global BM25 store: memory-mapped snapshots on disk, shared by every worker process.
+# Uploads publish a new version; readers switch to it within BM25_CHECK_SECONDS.
+bm25_index = PersistentBM25Index(
+    BM25_INDEX_DIR,
+    check_seconds=float(os.getenv("BM25_CHECK_SECONDS", "2"))
+)
 
 def read_txt(path: str) -> str:
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
+    return "".join(iter_txt_blocks(path))
 
 def read_pdf(path: str) -> str:
-    reader = PdfReader(path)
-    return "\n".join(page.extract_text() or "" for page in reader.pages)
+    return "\n".join(iter_pdf_pages(path))
 
 def read_docx(path: str) -> str:
-    doc = Document(path)
-    return "\n".join(para.text for para in doc.paragraphs)
+    return "\n".join(iter_docx_paragraphs(path))
 
 def extract_text(file_path: str) -> str:
     """
     Reads text from PDF, DOCX, or TXT based on file extension.
+    Large files are better streamed with `iter_text` + `iter_chunks`.
     """
     if file_path.endswith(".pdf"):
         return read_pdf(file_path)
@@ -59,51 +65,139 @@ def chunk_text(text: str, chunk_size: int = 500, chunk_overlap: int = 50) -> Lis
     splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     return splitter.split_text(text)
 
-def store_in_chroma(chunks: List[str], doc_id: str):
+def iter_chunks(segments: Iterable[str], separator: str = "\n",
+                chunk_size: int = 500, chunk_overlap: int = 50) -> Iterator[str]:
+    """
+    Streaming version of `chunk_text`: splits text that arrives in segments (pages,
+    paragraphs), holding only about CHUNK_WINDOW_CHUNKS chunks of text at a time.
+    The last, possibly incomplete chunk of each window is carried over and split
+    again with the following text.
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    window = chunk_size * CHUNK_WINDOW_CHUNKS
+    buffer = None
+    for segment in segments:
+        buffer = segment if buffer is None else buffer + separator + segment
+        if len(buffer) < window:
+            continue
+        chunks = splitter.split_text(buffer)
+        if len(chunks) < 2:
+            continue
+        yield from chunks[:-1]
+        tail = buffer.rfind(chunks[-1])
+        buffer = buffer[tail:] if tail >= 0 else chunks[-1]
+    if buffer:
+        yield from splitter.split_text(buffer)
+
+def store_in_chroma(chunks: List[str], doc_id: str, job: IngestionJob = None,
+                    first_chunk_id: int = 0, vectorstore=None):
     """
     Store embedded chunks in Chroma vector database.
+    Chunks are embedded in batches of INGEST_BATCH_SIZE; after each batch the job
+    records its progress and gives way to in-flight queries.
     """
-    vectorstore = Chroma(
-        collection_name="quiz_docs",
-        embedding_function=embedding_function,
-        persist_directory=CHROMA_DB_DIR
-    )
-
-    metadatas = [{"doc_id": doc_id, "chunk_id": i} for i in range(len(chunks))]
-
-    vectorstore.add_texts(texts=chunks, metadatas=metadatas)
+    if vectorstore is None:
+        vectorstore = Chroma(
+            collection_name="quiz_docs",
+            embedding_function=embedding_function,
+            persist_directory=CHROMA_DB_DIR
+        )
+
+    for start in range(0, len(chunks), INGEST_BATCH_SIZE):
+        batch = chunks[start:start + INGEST_BATCH_SIZE]
+        metadatas = [{"doc_id": doc_id, "chunk_id": first_chunk_id + start + i} for i in range(len(batch))]
+        vectorstore.add_texts(texts=batch, metadatas=metadatas)
+        if job is not None:
+            job.advance(len(batch))
     # vectorstore.persist()
 
 def index_with_bm25(chunks: List[str]):
     """
     Index chunks using BM25 for sparse keyword-based search.
+    Only the new chunks are tokenized; they are written as a new on-disk segment.
+    """
+    bm25_index.add_documents(chunks)
+
+def rebuild_bm25_from_chroma():
+    """
+    Builds the BM25 index from the chunks already in Chroma (e.g. documents
+    uploaded before the sparse index was persisted). Does nothing if it has chunks.
     """
-    global bm25_corpus, bm25_tokenized, bm25_index
-    bm25_corpus.extend(chunks)
-    bm25_tokenized = [doc.lower().split() for doc in bm25_corpus]
-    bm25_index = BM25Okapi(bm25_tokenized)
+    if len(bm25_index):
+        return 0
 
-def process_file(file_path: str):
+    vectorstore = Chroma(
+        collection_name="quiz_docs",
+        embedding_function=embedding_function,
+        persist_directory=CHROMA_DB_DIR
+    )
+    chunks = vectorstore.get(include=["documents"])["documents"]
+    # Several workers may start at once: only the first one to get the lock publishes
+    added = bm25_index.add_documents(chunks, if_empty=True) if chunks else range(0)
+    if added:
+        print(f"📚 Rebuilt BM25 index from {len(added)} chunks in Chroma")
+    return len(added)
+
+def process_file(file_path: str, job: IngestionJob = None):
     """
     Main entry to extract, chunk, embed, and store a document.
+    Extraction, chunking and embedding are pipelined: pages are streamed (PDF page
+    ranges in parallel on a process pool) and each batch of chunks is embedded while
+    later pages are still being extracted.
+    `job` (optional) receives the current stage, progress and per-stage timings.
     """
     print(f"Processing: {file_path}")
+    job = job or IngestionJob(os.path.basename(file_path))
 
-    # Step 1: Extract raw text
-    raw_text = extract_text(file_path)
+    # Step 1: Generate a document ID
+    doc_id = str(uuid4())
 
-    # Step 2: Chunk text
-    chunks = chunk_text(raw_text)
+    # Step 2: Stream raw text (PDF: pages, DOCX: paragraphs, TXT: blocks of lines)
+    with job.track("open"):
+        num_pages = count_pages(file_path)
+    job.set_pages(num_pages)
+    segments = job.timed(iter_text(file_path, num_pages), "extract")
+    if num_pages:
+        segments = _count_pages(segments, job)
 
-    # Step 3: Generate a document ID
-    doc_id = str(uuid4())
+    # Step 3: Chunk text as it arrives
+    separator = "" if file_path.endswith(".txt") else "\n"
+    chunk_stream = job.timed(iter_chunks(segments, separator), "chunk")
 
-    # Step 4: Store in Chroma (dense retrieval)
-    store_in_chroma(chunks, doc_id)
+    # Step 4: Store in Chroma (dense retrieval), one batch at a time
+    vectorstore = Chroma(
+        collection_name="quiz_docs",
+        embedding_function=embedding_function,
+        persist_directory=CHROMA_DB_DIR
+    )
+    chunks = []
+    for batch in _batched(chunk_stream, INGEST_BATCH_SIZE):
+        with job.track("embed_and_store"):
+            store_in_chroma(batch, doc_id, job, first_chunk_id=len(chunks), vectorstore=vectorstore)
+        chunks.extend(batch)
+    # Time spent waiting on the chunk stream includes waiting on extraction
+    job.timings["chunk"] = round(job.timings.get("chunk", 0.0) - job.timings.get("extract", 0.0), 4)
+    job.set_total(len(chunks))
 
-    # Step 5: Index with BM25 (sparse retrieval)
-    index_with_bm25(chunks)
+    # Step 5: Index with BM25 (sparse retrieval): one new version per document
+    with job.track("bm25_index"):
+        index_with_bm25(chunks)
 
-    print(f"✅ Document processed and stored. ID: {doc_id}")
+    print(f"✅ Document processed and stored. ID: {doc_id} ({job.timings})")
 
     return doc_id, len(chunks)
+
+def _count_pages(pages: Iterable[str], job: IngestionJob) -> Iterator[str]:
+    for page in pages:
+        job.page_done()
+        yield page
+
+def _batched(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -3,14 +3,14 @@ from langchain_chroma import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 
 from sentence_transformers import CrossEncoder
-from rank_bm25 import BM25Okapi
 
-from processing import bm25_index, bm25_corpus, embedding_model_name
-import numpy as np
+from processing import bm25_index, embedding_model_name
+from embedding_cache import with_embedding_cache
+from sparse_index import tokenize
 from typing import List, Dict
 
-# Initialize embedding function
-embedding_function = HuggingFaceEmbeddings(model_name=embedding_model_name)
+# Initialize embedding function (shares the cache used during ingestion)
+embedding_function = with_embedding_cache(HuggingFaceEmbeddings(model_name=embedding_model_name))
 
 # (Optional) Load cross-encoder model for reranking (heavy model, so only use if needed)
 # cross_encoder = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
@@ -35,19 +35,20 @@ def retrieve_sparse(query: str, k: int = 5) -> List[Dict]:
     """
     Uses BM25 to retrieve top-k keyword-relevant chunks.
     """
-    if not bm25_index:
+    # One snapshot for the whole query, so scores and texts come from the same version
+    index = bm25_index.snapshot
+    if not index:
         print("⚠️ BM25 index is empty. Make sure a document is uploaded and processed.")
         return []
 
-    tokenized_query = query.lower().split()
-    scores = bm25_index.get_scores(tokenized_query)
+    tokenized_query = tokenize(query)
 
-    # Get top-k highest scoring docs
-    top_k_indices = np.argsort(scores)[-k:][::-1]
+    # Top-k with MaxScore pruning: only documents containing a query term are scored
+    top_k_indices, scores = index.top_k(tokenized_query, k)
 
     return [
-        {"text": bm25_corpus[i], "score": scores[i], "source": "sparse"}
-        for i in top_k_indices
+        {"text": index.corpus[i], "score": float(score), "source": "sparse"}
+        for i, score in zip(top_k_indices, scores)
     ]
 
 def rerank_with_cross_encoder(query: str, docs: List[Dict]) -> List[Dict]:
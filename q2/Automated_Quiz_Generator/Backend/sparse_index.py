@@ -0,0 +1,1003 @@
+"""
+Incremental BM25 Index
+
+A BM25 (Okapi) index that grows one document at a time, instead of re-tokenizing
+the whole corpus and rebuilding `rank_bm25.BM25Okapi` on every upload:
+1. An inverted index: per-term postings (document ids + term frequencies)
+2. Document lengths and per-term document frequencies, updated as documents arrive
+3. Corpus statistics (average document length, IDF) derived from those counts,
+   refreshed lazily with one vectorized pass over the vocabulary
+
+Adding a document only touches its own terms. Scores are the same as
+`BM25Okapi(tokenized_corpus).get_scores(query)` (same k1, b and epsilon defaults,
+same floor for negative IDFs).
+
+The index is persisted as immutable segments that every worker process memory-maps
+read-only, listed by versioned manifests (see `PersistentBM25Index`). An upload
+writes one new segment and a manifest; existing segments are never rewritten, and
+small segments are merged in the background:
+    index_dir/CURRENT                   -> name of the live version
+    index_dir/manifests/<version>.json  -> the version's segments (in document-id order),
+                                           document count, total length, a histogram of
+                                           document frequencies (for the IDF floor), parameters
+    index_dir/segments/<segment>/       -> one segment (document ids local to it):
+        terms.bin + terms.offsets.npy    term dictionary (UTF-8 blob, by term id)
+        term_hashes.npy + term_order.npy term lookup (sorted 64-bit hashes -> term id)
+        postings.offsets.npy             per-term range in the postings arrays
+        postings.docs.npy / .tfs.npy     postings (document ids, term frequencies)
+        doc_lens.npy                     document lengths
+        tf_bound.npy                     per-term score upper bounds (for top-k pruning)
+        texts.bin + texts.offsets.npy    chunk texts
+        meta.json                        document count, total length, parameters
+IDF depends on the whole corpus, so it is computed per query from the segments'
+document frequencies.
+"""
+
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from collections.abc import Sequence
+
+import numpy as np
+
+try:
+    import fcntl  # Serializes writers across worker processes (POSIX only)
+except ImportError:
+    fcntl = None
+
+CURRENT_FILE = "CURRENT"
+MANIFESTS_DIR = "manifests"
+SEGMENTS_DIR = "segments"
+META_FILE = "meta.json"
+
+
+def tokenize(text: str):
+    """Same tokenization the quiz backend has always used for BM25."""
+    return text.lower().split()
+
+
+def _term_scores(idf, tf, doc_lens, avgdl, k1, b):
+    """BM25 contribution of one query term to the documents in its postings."""
+    return idf * (tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_lens / avgdl)))
+
+
+def _bm25_idf(df, num_docs, epsilon):
+    """BM25Okapi's IDF: negative values are floored to `epsilon * average IDF`."""
+    df = np.asarray(df, dtype=np.float64)
+    idf = np.log(num_docs - df + 0.5) - np.log(df + 0.5)
+    if len(idf):
+        idf[idf < 0] = epsilon * idf.mean()
+    return idf
+
+
+# === Class: Incremental Inverted-Index BM25 ===
+class BM25Index:
+    """
+    Inverted-index BM25 scorer that supports appending documents.
+
+    Args:
+        k1 (float): Term-frequency saturation
+        b (float): Document-length normalization
+        epsilon (float): Negative IDFs are floored to `epsilon * average IDF`
+    """
+
+    def __init__(self, k1=1.5, b=0.75, epsilon=0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self.corpus = []  # Document texts, by document id
+        self._lock = threading.RLock()
+
+        # Inverted index
+        self._term_ids = {}  # term -> term id
+        self._postings_docs = []  # term id -> array of document ids (ascending)
+        self._postings_tfs = []  # term id -> array of term frequencies
+        self._df = array("i")  # term id -> number of documents containing it
+
+        # Per-document and corpus statistics
+        self._doc_lens = array("i")
+        self._total_len = 0
+
+        self._idf = None  # Recomputed lazily after the corpus changes
+
+    def __len__(self):
+        return len(self.corpus)
+
+    # --- Indexing ---
+
+    def add_documents(self, texts):
+        """
+        Appends documents to the index, updating only the postings of their own terms.
+
+        Args:
+            texts (List[str]): Raw document texts
+
+        Returns:
+            range: The new documents' ids
+        """
+        with self._lock:
+            first_id = len(self.corpus)
+            for doc_id, text in enumerate(texts, first_id):
+                tokens = tokenize(text)
+                for term, tf in Counter(tokens).items():
+                    term_id = self._term_ids.get(term)
+                    if term_id is None:
+                        term_id = self._term_ids[term] = len(self._postings_docs)
+                        self._postings_docs.append(array("i"))
+                        self._postings_tfs.append(array("i"))
+                        self._df.append(0)
+                    self._postings_docs[term_id].append(doc_id)
+                    self._postings_tfs[term_id].append(tf)
+                    self._df[term_id] += 1
+
+                self._doc_lens.append(len(tokens))
+                self._total_len += len(tokens)
+                self.corpus.append(text)
+
+            self._idf = None
+            return range(first_id, len(self.corpus))
+
+    # --- Scoring ---
+
+    def _idf_vector(self):
+        """IDF of every term, with BM25Okapi's floor for terms in most documents."""
+        if self._idf is None:
+            self._idf = _bm25_idf(np.frombuffer(self._df, dtype=np.int32), len(self.corpus), self.epsilon)
+        return self._idf
+
+    def get_scores(self, query_tokens):
+        """
+        BM25 score of every document for the query, computed from the postings of
+        the query terms only (documents without any query term score 0).
+
+        Args:
+            query_tokens (List[str]): Tokenized query (see `tokenize`)
+
+        Returns:
+            np.ndarray: One score per document id
+        """
+        with self._lock:
+            scores = np.zeros(len(self.corpus))
+            if not self.corpus:
+                return scores
+
+            idf = self._idf_vector()
+            avgdl = self._total_len / len(self.corpus)
+            doc_lens = np.array(self._doc_lens, dtype=np.float64)
+
+            # Repeated query terms count once per occurrence, like BM25Okapi
+            for term in query_tokens:
+                term_id = self._term_ids.get(term)
+                if term_id is None:
+                    continue
+                docs = np.array(self._postings_docs[term_id], dtype=np.int64)
+                tf = np.array(self._postings_tfs[term_id], dtype=np.float64)
+                scores[docs] += _term_scores(idf[term_id], tf, doc_lens[docs], avgdl, self.k1, self.b)
+            return scores
+
+    def postings(self):
+        """
+        Yields (term, document ids, term frequencies) for every term, in term-id order.
+        Used to write a batch of new documents as a persisted segment.
+        """
+        with self._lock:
+            for term, term_id in self._term_ids.items():
+                yield (
+                    term,
+                    np.array(self._postings_docs[term_id], dtype=np.int32),
+                    np.array(self._postings_tfs[term_id], dtype=np.int32),
+                )
+
+    def doc_lengths(self):
+        """Returns the token count of every document, by document id."""
+        with self._lock:
+            return np.array(self._doc_lens, dtype=np.int32)
+
+    def stats(self):
+        """Returns index size counters."""
+        with self._lock:
+            return {
+                "documents": len(self.corpus),
+                "terms": len(self._term_ids),
+                "postings": int(sum(self._df)),
+                "avgdl": self._total_len / len(self.corpus) if self.corpus else 0.0,
+            }
+
+
+# === Helper: Packed, Memory-Mapped String Columns ===
+def _load_array(path):
+    """Memory-maps a .npy file (empty arrays can't be mapped, so they are read).
+    Returned as a plain ndarray view: slicing an np.memmap is several times slower."""
+    try:
+        return np.asarray(np.load(path, mmap_mode="r"))
+    except ValueError:
+        return np.load(path)
+
+
+class PackedStrings(Sequence):
+    """
+    Read-only list of strings stored as one UTF-8 blob plus an (n + 1) offsets array.
+    Both files are memory-mapped; a string is only decoded when it is accessed.
+
+    Args:
+        path (str): Path prefix (`<path>.bin` and `<path>.offsets.npy`)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._offsets = _load_array(path + ".offsets.npy")
+        size = int(self._offsets[-1])
+        self._data = np.memmap(path + ".bin", dtype=np.uint8, mode="r") if size else np.empty(0, np.uint8)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        return bytes(self._data[start:end]).decode("utf-8")
+
+
+class _ChainedStrings(Sequence):
+    """Read-only concatenation of the segments' packed columns, indexed by global id."""
+
+    def __init__(self, parts, bases):
+        self._parts = parts
+        self._bases = [int(base) for base in bases]  # len(parts) + 1 boundaries
+
+    def __len__(self):
+        return self._bases[-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("document id out of range")
+        part = bisect_right(self._bases, index) - 1
+        return self._parts[part][index - self._bases[part]]
+
+
+def _write_packed(path, items=(), sources=()):
+    """Writes a packed column: the strings of `sources` (PackedStrings, copied as raw
+    bytes, without decoding) followed by `items`."""
+    offsets = [np.zeros(1, dtype=np.int64)]
+    size = 0
+    with open(path + ".bin", "wb") as out:
+        for source in sources:
+            source_offsets = np.asarray(source._offsets, dtype=np.int64)
+            with open(source.path + ".bin", "rb") as f:
+                shutil.copyfileobj(f, out)
+            offsets.append(size + source_offsets[1:])
+            size += int(source_offsets[-1])
+        encoded = [item.encode("utf-8") for item in items]
+        for data in encoded:
+            out.write(data)
+        lengths = np.fromiter((len(data) for data in encoded), dtype=np.int64, count=len(encoded))
+        offsets.append(size + np.cumsum(lengths))
+    np.save(path + ".offsets.npy", np.concatenate(offsets))
+
+
+def _term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _idf(df, num_docs):
+    """Unfloored BM25Okapi IDF of a document frequency (same arithmetic as rank_bm25)."""
+    return math.log(num_docs - df + 0.5) - math.log(df + 0.5)
+
+
+# === Class: Immutable Index Segment ===
+class BM25Segment:
+    """
+    An immutable, memory-mapped inverted index over a contiguous run of documents.
+    Document ids are local to the segment; a snapshot adds the segment's base.
+    Segments only hold counts: IDF depends on the whole corpus and is computed per query.
+
+    Args:
+        segment_dir (str): Directory of the segment
+    """
+
+    def __init__(self, segment_dir):
+        with open(os.path.join(segment_dir, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.segment_dir = segment_dir
+        self.num_docs = meta["num_docs"]
+        self.total_len = meta["total_len"]
+
+        def path(name):
+            return os.path.join(segment_dir, name)
+
+        self.terms = PackedStrings(path("terms"))
+        self.term_hashes = _load_array(path("term_hashes.npy"))  # Sorted
+        self.term_order = _load_array(path("term_order.npy"))  # Hash position -> term id
+        self.offsets = _load_array(path("postings.offsets.npy"))
+        self.docs = _load_array(path("postings.docs.npy"))
+        self.tfs = _load_array(path("postings.tfs.npy"))
+        self.doc_lens = _load_array(path("doc_lens.npy"))
+        self.corpus = PackedStrings(path("texts"))
+
+        # Per-term bounds: the largest tf component (BM25 score / IDF) in the term's
+        # postings, computed at the average document length `bound_avgdl`
+        self.tf_bound = _load_array(path("tf_bound.npy"))
+        self._bound_avgdl = meta["bound_avgdl"]
+
+    def __len__(self):
+        return self.num_docs
+
+    def term_id(self, term, term_hash=None):
+        """Looks a term up in the dictionary; returns None if it is not indexed."""
+        if term_hash is None:
+            term_hash = _term_hash(term)
+        position = int(np.searchsorted(self.term_hashes, np.uint64(term_hash)))
+        while position < len(self.term_hashes) and int(self.term_hashes[position]) == term_hash:
+            term_id = int(self.term_order[position])
+            if self.terms[term_id] == term:
+                return term_id
+            position += 1
+        return None
+
+    def document_frequencies(self, term_hashes):
+        """
+        Number of this segment's documents containing each term (0 if not indexed),
+        matched by hash alone: one vectorized lookup for a whole batch. Only feeds the
+        average IDF, which a 64-bit hash collision would barely move.
+        """
+        df = np.zeros(len(term_hashes), dtype=np.int64)
+        if not len(self.term_hashes):
+            return df
+        positions = np.minimum(np.searchsorted(self.term_hashes, term_hashes), len(self.term_hashes) - 1)
+        found = self.term_hashes[positions] == term_hashes
+        term_ids = self.term_order[positions[found]]
+        df[found] = self.offsets[term_ids + 1] - self.offsets[term_ids]
+        return df
+
+    def tf_bound_at(self, term_id, avgdl):
+        """Bound of the term's tf component at the corpus' current average length: the
+        component grows at most in proportion to avgdl."""
+        return float(self.tf_bound[term_id]) * max(1.0, avgdl / self._bound_avgdl)
+
+
+def _tf_bounds(offsets, docs, tfs, doc_lens, avgdl, k1, b):
+    """Largest tf component of every term's postings at `avgdl`."""
+    components = _term_scores(1.0, np.asarray(tfs, dtype=np.float64), doc_lens[docs], avgdl, k1, b)
+    nonempty = np.diff(offsets) > 0
+    tf_bound = np.zeros(len(offsets) - 1)
+    if nonempty.any():
+        tf_bound[nonempty] = np.maximum.reduceat(components, np.asarray(offsets[:-1])[nonempty])
+    return tf_bound
+
+
+# === Class: Read-Only Index Snapshot ===
+class BM25Snapshot:
+    """
+    One published version of the index: the segments listed by its manifest, in
+    document-id order. Every array is memory-mapped read-only, so opening a
+    snapshot takes milliseconds and all worker processes share the same pages
+    in the page cache.
+
+    Args:
+        manifest (dict): The version's manifest (see `PersistentBM25Index`)
+        segments (List[BM25Segment]): Its segments, already opened
+    """
+
+    def __init__(self, manifest, segments):
+        self.manifest = manifest
+        self.version = manifest["version"]
+        self.k1, self.b, self.epsilon = manifest["k1"], manifest["b"], manifest["epsilon"]
+        self.num_docs = manifest["num_docs"]
+        self.total_len = manifest["total_len"]
+        self.average_idf = manifest["average_idf"]
+        self.segments = segments
+        self.bases = np.concatenate([[0], np.cumsum([segment.num_docs for segment in segments])]).astype(np.int64)
+        self.corpus = _ChainedStrings([segment.corpus for segment in segments], self.bases)
+
+    def __len__(self):
+        return self.num_docs
+
+    def _postings(self, term):
+        """
+        A term's postings across segments.
+
+        Returns:
+            Tuple[List, int]: (segment base, segment, term id, start, end) for every
+            segment containing the term, and its document frequency in the snapshot
+        """
+        term_hash = _term_hash(term)
+        parts, df = [], 0
+        for base, segment in zip(self.bases, self.segments):
+            term_id = segment.term_id(term, term_hash)
+            if term_id is None:
+                continue
+            start, end = int(segment.offsets[term_id]), int(segment.offsets[term_id + 1])
+            parts.append((int(base), segment, term_id, start, end))
+            df += end - start
+        return parts, df
+
+    def _idf(self, df):
+        """BM25Okapi's IDF, floored to `epsilon * average IDF` (from the manifest)."""
+        idf = _idf(df, self.num_docs)
+        return self.epsilon * self.average_idf if idf < 0 else idf
+
+    def _part_scores(self, part, idf, avgdl):
+        """Global document ids and BM25 contributions of one segment's postings of a term."""
+        base, segment, _, start, end = part
+        docs = segment.docs[start:end]
+        tf = np.asarray(segment.tfs[start:end], dtype=np.float64)
+        return docs.astype(np.int64) + base, _term_scores(idf, tf, segment.doc_lens[docs], avgdl, self.k1, self.b)
+
+    def get_scores(self, query_tokens):
+        """Same as `BM25Index.get_scores`, read from the memory-mapped postings."""
+        scores = np.zeros(self.num_docs)
+        if not self.num_docs:
+            return scores
+
+        avgdl = self.total_len / self.num_docs
+        for term in query_tokens:
+            parts, df = self._postings(term)
+            if not parts:
+                continue
+            idf = self._idf(df)
+            for part in parts:
+                docs, contribution = self._part_scores(part, idf, avgdl)
+                scores[docs] += contribution
+        return scores
+
+    def top_k(self, query_tokens, k):
+        """
+        The k best-scoring documents, without scoring the whole corpus (MaxScore).
+
+        Query terms are processed from the highest score upper bound to the lowest.
+        Once the bounds of the terms still to come add up to less than the current
+        k-th best score, no unseen document can make the top k: the remaining
+        (typically long) postings lists are only probed by binary search for the
+        existing candidates, and candidates that can no longer reach the top k are
+        dropped. The top k is then picked with `argpartition` instead of sorting
+        every score. Results are the same as ranking `get_scores`.
+
+        Args:
+            query_tokens (List[str]): Tokenized query (see `tokenize`)
+            k (int): Number of results
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Document ids and their scores, best first
+            (only documents containing at least one query term)
+        """
+        if not self.num_docs or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        avgdl = self.total_len / self.num_docs
+        terms = []  # (upper bound, query position, postings parts, weighted IDF)
+        for term, weight in Counter(query_tokens).items():
+            parts, df = self._postings(term)
+            if not parts:
+                continue
+            idf = self._idf(df)
+            if idf < 0:
+                # Negative IDF (tiny corpora only) breaks the bounds: score exhaustively
+                return self._top_k_exhaustive(query_tokens, k)
+            bound = max(segment.tf_bound_at(term_id, avgdl) for _, segment, term_id, _, _ in parts)
+            terms.append((weight * idf * bound * (1 + 1e-9), len(terms), parts, weight * idf))
+        if not terms:
+            # No query term is in the vocabulary: no document contains one
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        terms.sort(key=lambda term: (-term[0], term[1]))
+
+        # remaining_bounds[i]: most that the terms after term i can still add (exactly 0 after the last)
+        remaining_bounds = np.append(np.cumsum([bound for bound, _, _, _ in terms][::-1])[::-1][1:], 0.0)
+
+        # Phase 1: scan postings lists into a dense accumulator (np.zeros is lazily
+        # allocated, so only pages of matching documents are touched) until no unseen
+        # document can make the top k any more
+        accumulator = np.zeros(self.num_docs)
+        scanned = []  # Postings lists added to the accumulator (global ids)
+        threshold = 0.0  # Lower bound of the final k-th best score
+        position = 0
+        total_bound = sum(bound for bound, _, _, _ in terms)
+        lengths = [sum(end - start for _, _, _, start, end in parts) for _, _, parts, _ in terms]
+        postings_left = np.append(np.cumsum(lengths[::-1])[::-1][1:], 0)  # After term i
+        for (_, _, parts, idf), remaining in zip(terms, remaining_bounds):
+            for part in parts:
+                docs, contribution = self._part_scores(part, idf, avgdl)
+                accumulator[docs] += contribution
+                scanned.append(docs)
+            position += 1
+
+            # Look for a threshold only if it could stop the scan, and costs less than finishing it
+            num_scanned = sum(len(docs) for docs in scanned)
+            num_left = int(postings_left[position - 1])
+            if remaining >= total_bound - remaining or min(num_scanned, lengths[position - 1]) > num_left:
+                continue
+            if num_scanned * 8 < self.num_docs and num_scanned <= num_left:
+                candidates = accumulator[np.unique(np.concatenate(scanned))]
+            else:
+                # Any distinct documents give a valid bound: a sample of this term's postings is enough
+                docs = np.concatenate(scanned[len(scanned) - len(parts):])
+                candidates = accumulator[docs[::max(1, len(docs) // 65536)]]
+            if len(candidates) >= k:
+                threshold = max(threshold, np.partition(candidates, len(candidates) - k)[len(candidates) - k])
+            if remaining < threshold:
+                break
+
+        # Candidates: every document seen so far
+        if sum(len(docs) for docs in scanned) * 8 < self.num_docs:
+            cand_docs = np.unique(np.concatenate(scanned))
+        else:
+            cand_docs = np.flatnonzero(accumulator)  # Cheaper than sorting that many ids
+        cand_scores = accumulator[cand_docs]
+
+        # Phase 2: the remaining terms only add to existing candidates, found by binary search
+        for (_, _, parts, idf), length in zip(terms[position:], lengths[position:]):
+            if len(cand_docs) > k:
+                threshold = np.partition(cand_scores, len(cand_scores) - k)[len(cand_scores) - k]
+                keep = cand_scores + remaining_bounds[position - 1] >= threshold
+                cand_docs, cand_scores = cand_docs[keep], cand_scores[keep]
+
+            if len(cand_docs) * 16 < length:
+                # Few candidates left: binary-search them in each segment's postings list
+                for base, segment, _, start, end in parts:
+                    lo, hi = np.searchsorted(cand_docs, [base, base + segment.num_docs])
+                    local = cand_docs[lo:hi] - base
+                    docs = segment.docs[start:end]
+                    positions = np.searchsorted(docs, local)
+                    found = positions < len(docs)
+                    found[found] = docs[positions[found]] == local[found]
+                    tf = np.asarray(segment.tfs[start + positions[found]], dtype=np.float64)
+                    cand_scores[lo:hi][found] += _term_scores(
+                        idf, tf, segment.doc_lens[local[found]], avgdl, self.k1, self.b
+                    )
+            else:
+                # Many candidates: a sequential pass over the lists is cheaper than searching
+                contribution = np.zeros(self.num_docs)
+                for part in parts:
+                    docs, scores = self._part_scores(part, idf, avgdl)
+                    contribution[docs] = scores
+                cand_scores += contribution[cand_docs]
+            position += 1
+
+        return _best_first(cand_docs, cand_scores, k)
+
+    def _top_k_exhaustive(self, query_tokens, k):
+        scores = self.get_scores(query_tokens)
+        matched = np.flatnonzero(scores)
+        return _best_first(matched, scores[matched], k)
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "documents": self.num_docs,
+            "segments": len(self.segments),
+            "postings": sum(len(segment.docs) for segment in self.segments),
+            "avgdl": self.total_len / self.num_docs if self.num_docs else 0.0,
+        }
+
+
+def _best_first(docs, scores, k):
+    """Top k of (docs, scores), sorted by descending score."""
+    if len(docs) > 64 * k:
+        # The k-th best of an evenly spaced sample is a lower bound of the real k-th best:
+        # filtering on it first leaves argpartition only a small fraction to look at
+        sample = scores[::len(scores) // (32 * k)]
+        keep = scores >= np.partition(sample, len(sample) - k)[len(sample) - k]
+        docs, scores = docs[keep], scores[keep]
+    if len(docs) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+        docs, scores = docs[top], scores[top]
+    order = np.argsort(-scores, kind="stable")
+    return docs[order], scores[order]
+
+
+# === Function: Write a Segment ===
+def _write_segment(segment_dir, terms, offsets, docs, tfs, doc_lens, k1, b, texts=(), text_sources=()):
+    """
+    Writes an immutable segment: the postings of `terms` (grouped by term,
+    `offsets[i]:offsets[i + 1]` for term i, ascending local document ids), the
+    document lengths, and the texts (`text_sources` copied first, then `texts`).
+    """
+    os.makedirs(segment_dir)
+
+    def path(name):
+        return os.path.join(segment_dir, name)
+
+    np.save(path("postings.offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    np.save(path("postings.docs.npy"), np.asarray(docs, dtype=np.int32))
+    np.save(path("postings.tfs.npy"), np.asarray(tfs, dtype=np.int32))
+    np.save(path("doc_lens.npy"), np.asarray(doc_lens, dtype=np.int32))
+
+    _write_packed(path("terms"), terms)
+    hashes = np.array([_term_hash(term) for term in terms], dtype=np.uint64)
+    by_hash = np.argsort(hashes, kind="stable")
+    np.save(path("term_hashes.npy"), hashes[by_hash])
+    np.save(path("term_order.npy"), by_hash.astype(np.int64))
+    _write_packed(path("texts"), texts, text_sources)
+
+    num_docs, total_len = len(doc_lens), int(np.sum(doc_lens, dtype=np.int64))
+    avgdl = total_len / num_docs
+    np.save(path("tf_bound.npy"), _tf_bounds(offsets, docs, tfs, np.asarray(doc_lens), avgdl, k1, b))
+
+    with open(path(META_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "num_docs": num_docs,
+            "total_len": total_len,
+            "bound_avgdl": avgdl,
+            "k1": k1,
+            "b": b,
+            "created": time.time(),
+        }, f)
+
+
+def _write_batch_segment(segment_dir, batch):
+    """Writes the documents of `batch` (a BM25Index) as a new segment."""
+    terms, docs, tfs = [], [], []
+    for term, term_docs, term_tfs in batch.postings():
+        terms.append(term)
+        docs.append(term_docs)
+        tfs.append(term_tfs)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, docs), dtype=np.int64, count=len(docs)), out=offsets[1:])
+    empty = np.zeros(0, dtype=np.int32)  # A batch of empty texts has no postings
+    _write_segment(
+        segment_dir, terms, offsets, np.concatenate(docs or [empty]), np.concatenate(tfs or [empty]),
+        batch.doc_lengths(), batch.k1, batch.b, texts=batch.corpus
+    )
+
+
+def _write_merged_segment(segment_dir, segments, k1, b):
+    """Writes adjacent `segments` (in document-id order) as one segment."""
+    term_ids = {}  # term -> id in the merged segment
+    new_ids, docs, base = [], [], 0
+    for segment in segments:
+        local_ids = np.fromiter(
+            (term_ids.setdefault(term, len(term_ids)) for term in segment.terms),
+            dtype=np.int64, count=len(segment.terms)
+        )
+        new_ids.append(np.repeat(local_ids, np.diff(segment.offsets)))
+        docs.append(np.asarray(segment.docs, dtype=np.int32) + base)
+        base += segment.num_docs
+
+    # A stable sort by merged term id keeps every term's documents ascending
+    new_ids = np.concatenate(new_ids)
+    order = np.argsort(new_ids, kind="stable")
+    offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(new_ids, minlength=len(term_ids)), out=offsets[1:])
+    _write_segment(
+        segment_dir, list(term_ids), offsets,
+        np.concatenate(docs)[order], np.concatenate([segment.tfs for segment in segments])[order],
+        np.concatenate([segment.doc_lens for segment in segments]), k1, b,
+        text_sources=[segment.corpus for segment in segments]
+    )
+
+
+def _plan_merge(sizes):
+    """
+    Picks two adjacent segments to merge, or None: the newest pair whose older
+    segment is no larger than the newer one. Merging until sizes strictly decrease
+    keeps O(log n) segments, and every document is rewritten O(log n) times.
+    """
+    for i in range(len(sizes) - 2, -1, -1):
+        if sizes[i] <= sizes[i + 1]:
+            return i
+    return None
+
+
+# === Class: Persistent, Process-Shared Index ===
+class PersistentBM25Index:
+    """
+    BM25 index stored on disk as immutable segments plus versioned manifests.
+
+    Readers always score against one complete version and pick up versions
+    published by other processes within `check_seconds`. Writers add each batch
+    of documents as a new segment, without touching existing ones, and publish
+    a manifest listing it by atomically replacing the `CURRENT` pointer; a file
+    lock serializes writers across processes. Small segments are merged in a
+    background thread, and the merge is published the same way.
+
+    Args:
+        index_dir (str): Root directory of the index
+        check_seconds (float): How often readers look for a newer version
+        keep_versions (int): Old versions kept on disk (other workers may still be reading them)
+        merge (bool): Merge segments in the background after each write
+    """
+
+    def __init__(self, index_dir, check_seconds=2.0, keep_versions=3, k1=1.5, b=0.75, epsilon=0.25, merge=True):
+        self.index_dir = index_dir
+        self.check_seconds = check_seconds
+        self.keep_versions = keep_versions
+        self.merge = merge
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+
+        self._snapshot = None
+        self._segments = {}  # Segment path -> open BM25Segment, for the live version only
+        self._last_check = 0.0
+        self._write_lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._merge_thread = None
+        for name in (MANIFESTS_DIR, SEGMENTS_DIR):
+            os.makedirs(os.path.join(index_dir, name), exist_ok=True)
+        self.refresh(force=True)
+
+    # --- Reading ---
+
+    @property
+    def snapshot(self):
+        """The newest published snapshot (None while the index is empty). Hold on to it
+        for the whole query so scores and texts come from the same version."""
+        self.refresh()
+        return self._snapshot
+
+    def refresh(self, force=False):
+        """Opens a newer published version, if there is one."""
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_seconds:
+            return
+        self._last_check = now
+
+        version = self._current_version()
+        if not version or (self._snapshot is not None and self._snapshot.version == version):
+            return
+        with self._open_lock:
+            if self._snapshot is not None and self._snapshot.version == version:
+                return
+            started = time.perf_counter()
+            for attempt in range(3):
+                try:
+                    manifest = self._read_manifest(version)
+                    # Segments are immutable: keep the ones still listed open, drop the rest
+                    segments = {
+                        path: self._segments.get(path) or BM25Segment(os.path.join(self.index_dir, path))
+                        for path in manifest["segments"]
+                    }
+                    break
+                except FileNotFoundError:
+                    # Pruned after we read CURRENT, so a newer version is live: open that one
+                    if attempt == 2:
+                        raise
+                    version = self._current_version()
+            self._segments = segments
+            self._snapshot = BM25Snapshot(manifest, list(segments.values()))
+            print(f"  📚 Opened BM25 index {version} ({len(self._snapshot)} chunks, {len(segments)} segments) "
+                  f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    def __len__(self):
+        snapshot = self.snapshot
+        return len(snapshot) if snapshot else 0
+
+    def get_scores(self, query_tokens):
+        snapshot = self.snapshot
+        return snapshot.get_scores(query_tokens) if snapshot else np.zeros(0)
+
+    def top_k(self, query_tokens, k):
+        snapshot = self.snapshot
+        return snapshot.top_k(query_tokens, k) if snapshot else (np.zeros(0, dtype=np.int64), np.zeros(0))
+
+    def stats(self):
+        snapshot = self.snapshot
+        return snapshot.stats() if snapshot else {"version": None, "documents": 0}
+
+    # --- Writing ---
+
+    def add_documents(self, texts, if_empty=False):
+        """
+        Adds documents as a new segment and publishes a version that includes it.
+        Existing segments are not rewritten, so a write costs work proportional to
+        the batch (plus looking its terms up in the existing segments).
+
+        Args:
+            texts (List[str]): Raw document texts
+            if_empty (bool): Only add them if nothing was published yet (for one-time
+                migrations that every worker process runs at startup)
+
+        Returns:
+            range: The new documents' ids (empty if `if_empty` skipped them)
+        """
+        batch = BM25Index(self.k1, self.b, self.epsilon)
+        batch.add_documents(texts)  # Tokenize outside the locks
+
+        with self._write_lock, self._exclusive():
+            self.refresh(force=True)  # Another process may have published meanwhile
+            base = self._snapshot
+            first_id = len(base) if base else 0
+            if (if_empty and base) or not len(batch):
+                return range(first_id, first_id)
+
+            name = _new_name()
+            staging_dir = os.path.join(self.index_dir, SEGMENTS_DIR, f".staging-{name}")
+            _write_batch_segment(staging_dir, batch)
+            os.replace(staging_dir, os.path.join(self.index_dir, SEGMENTS_DIR, name))
+
+            manifest = self._updated_manifest(base, batch)
+            manifest["segments"] = (base.manifest["segments"] if base else []) + [f"{SEGMENTS_DIR}/{name}"]
+            self._publish(manifest)
+
+        if self.merge:
+            self._merge_in_background()
+        return range(first_id, first_id + len(batch))
+
+    def merge_segments(self):
+        """
+        Merges segments until their sizes strictly decrease (oldest first), publishing
+        a new version after each merge. The segments are written outside the writer
+        lock, so uploads carry on meanwhile. Returns at once if another thread or
+        process is already merging.
+
+        Returns:
+            int: Number of merges done
+        """
+        if not self._merge_lock.acquire(blocking=False):
+            return 0
+        try:
+            with _FileLock(os.path.join(self.index_dir, ".merge.lock"), blocking=False) as lock:
+                if not lock.acquired:
+                    return 0
+                merges = 0
+                while True:
+                    self.refresh(force=True)
+                    snapshot = self._snapshot
+                    if snapshot is None:
+                        return merges
+                    i = _plan_merge([segment.num_docs for segment in snapshot.segments])
+                    if i is None:
+                        return merges
+
+                    started = time.perf_counter()
+                    name = _new_name()
+                    staging_dir = os.path.join(self.index_dir, SEGMENTS_DIR, f".staging-{name}")
+                    _write_merged_segment(staging_dir, snapshot.segments[i:i + 2], self.k1, self.b)
+
+                    merged = snapshot.manifest["segments"][i:i + 2]
+                    with self._write_lock, self._exclusive():
+                        # Renamed only now: pruning (by concurrent writers) spares staging directories
+                        os.replace(staging_dir, os.path.join(self.index_dir, SEGMENTS_DIR, name))
+                        self.refresh(force=True)
+                        # Only merges remove segments, so the pair is still there, still adjacent
+                        current = dict(self._snapshot.manifest, version=_new_name(), created=time.time())
+                        position = current["segments"].index(merged[0])
+                        current["segments"] = (
+                            current["segments"][:position] + [f"{SEGMENTS_DIR}/{name}"] + current["segments"][position + 2:]
+                        )
+                        self._publish(current)
+                    merges += 1
+                    print(f"  📚 Merged BM25 segments of {snapshot.segments[i].num_docs} and "
+                          f"{snapshot.segments[i + 1].num_docs} chunks in {time.perf_counter() - started:.2f} s")
+        finally:
+            self._merge_lock.release()
+
+    # --- Internal helpers ---
+
+    def _merge_in_background(self):
+        if self._merge_thread is not None and self._merge_thread.is_alive():
+            return  # The running merge re-plans after every step and picks the new segment up
+        self._merge_thread = threading.Thread(target=self.merge_segments, name="bm25-merge", daemon=True)
+        self._merge_thread.start()
+
+    def _updated_manifest(self, base, batch):
+        """
+        Statistics of the base version plus `batch`. The average IDF (for BM25Okapi's
+        negative-IDF floor) is kept exact by maintaining a histogram of document
+        frequencies: only the batch's terms move between buckets.
+        """
+        histogram = Counter(dict(zip(base.manifest["df_values"], base.manifest["df_counts"]))) if base else Counter()
+        terms, batch_df = [], []
+        for term, docs, _ in batch.postings():
+            terms.append(term)
+            batch_df.append(len(docs))
+        hashes = np.array([_term_hash(term) for term in terms], dtype=np.uint64)
+        previous_df = np.zeros(len(terms), dtype=np.int64)
+        for segment in (base.segments if base else []):
+            previous_df += segment.document_frequencies(hashes)
+        for df, new_df in zip(previous_df.tolist(), batch_df):
+            if df:
+                histogram[df] -= 1
+            histogram[df + new_df] += 1
+        histogram = {df: count for df, count in histogram.items() if count}
+
+        num_docs = (base.num_docs if base else 0) + len(batch)
+        df_values = sorted(histogram)
+        df_counts = [histogram[df] for df in df_values]
+        vocabulary = sum(df_counts)
+        return {
+            "version": _new_name(),
+            "num_docs": num_docs,
+            "total_len": (base.total_len if base else 0) + int(batch.doc_lengths().sum()),
+            "df_values": df_values,
+            "df_counts": df_counts,
+            "average_idf": sum(count * _idf(df, num_docs) for df, count in histogram.items()) / max(1, vocabulary),
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "created": time.time(),
+        }
+
+    def _publish(self, manifest):
+        """Writes the manifest, then points CURRENT at it (both atomically). Call with the locks held."""
+        manifest_path = os.path.join(self.index_dir, MANIFESTS_DIR, manifest["version"] + ".json")
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        pointer_tmp = os.path.join(self.index_dir, CURRENT_FILE + ".tmp")
+        with open(pointer_tmp, "w", encoding="utf-8") as f:
+            f.write(manifest["version"])
+        os.replace(pointer_tmp, os.path.join(self.index_dir, CURRENT_FILE))
+
+        self.refresh(force=True)
+        self._prune()
+
+    def _read_manifest(self, version):
+        with open(os.path.join(self.index_dir, MANIFESTS_DIR, version + ".json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _current_version(self):
+        try:
+            with open(os.path.join(self.index_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _exclusive(self):
+        return _FileLock(os.path.join(self.index_dir, ".lock"))
+
+    def _prune(self):
+        """Deletes all but the newest manifests, and the segments none of them lists.
+        Workers still mapping a deleted segment keep reading it safely; the space is
+        freed when they let go. Call with the locks held."""
+        manifests_root = os.path.join(self.index_dir, MANIFESTS_DIR)
+        manifests = sorted(name for name in os.listdir(manifests_root) if name.endswith(".json"))
+        for name in manifests[:-self.keep_versions]:
+            os.remove(os.path.join(manifests_root, name))
+
+        live = set(self._snapshot.manifest["segments"])
+        for name in manifests[-self.keep_versions:]:
+            try:
+                with open(os.path.join(manifests_root, name), "r", encoding="utf-8") as f:
+                    live.update(json.load(f)["segments"])
+            except (OSError, ValueError):
+                pass
+        for name in os.listdir(os.path.join(self.index_dir, SEGMENTS_DIR)):
+            # Staging directories belong to writes or merges still in progress
+            if not name.startswith(".") and f"{SEGMENTS_DIR}/{name}" not in live:
+                shutil.rmtree(os.path.join(self.index_dir, SEGMENTS_DIR, name), ignore_errors=True)
+
+
+def _new_name():
+    """Version and segment names: sortable by creation time."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 1_000_000_000:09d}"
+
+
+class _FileLock:
+    """Exclusive lock on a file, held across processes (a no-op without fcntl).
+    With `blocking=False`, `acquired` tells whether the lock was free."""
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self.acquired = False
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "w")
+        if fcntl is None:
+            self.acquired = True
+            return self
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.acquired = True
+        except BlockingIOError:
+            self.acquired = False
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None and self.acquired:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
@@ -0,0 +1,125 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sparse_index import PersistentBM25Index, tokenize  # noqa: E402
+
+DOCS = [
+    "the cell is the basic unit of life",
+    "plants convert light into chemical energy",
+    "the mitochondria is the powerhouse of the cell",
+    "energy flows through an ecosystem",
+    "rivers carry water to the sea",
+    "volcanoes form at plate boundaries",
+    "stars fuse hydrogen into helium",
+    "the cell membrane controls what enters the cell",
+]
+
+
+def _index(tmp_path):
+    index = PersistentBM25Index(str(tmp_path), check_seconds=0)
+    index.add_documents(DOCS)
+    return index
+
+
+def test_top_k_with_no_known_query_term_returns_nothing(tmp_path):
+    ids, scores = _index(tmp_path).top_k(tokenize("how does photosynthesis work"), 5)
+    assert len(ids) == 0 and len(scores) == 0
+
+
+def test_top_k_matches_ranking_all_scores(tmp_path):
+    index = _index(tmp_path)
+    query = tokenize("cell energy unknownword")
+    ids, scores = index.top_k(query, 2)
+
+    all_scores = index.get_scores(query)
+    expected = np.argsort(-all_scores, kind="stable")[:2]
+    assert list(ids) == list(expected)
+    assert np.allclose(scores, all_scores[expected])
+
+
+def _uploads(tmp_path, merge):
+    index = PersistentBM25Index(str(tmp_path), check_seconds=0, merge=merge)
+    for start in range(0, len(DOCS), 3):
+        index.add_documents(DOCS[start:start + 3])
+    return index
+
+
+def test_uploads_add_segments_without_rewriting_existing_ones(tmp_path):
+    index = PersistentBM25Index(str(tmp_path), check_seconds=0, merge=False)
+    index.add_documents(DOCS[:4])
+    first = index.snapshot.segments[0].segment_dir
+    before = {name: os.path.getmtime(os.path.join(first, name)) for name in os.listdir(first)}
+
+    assert index.add_documents(DOCS[4:]) == range(4, len(DOCS))
+    assert [segment.segment_dir for segment in index.snapshot.segments][0] == first
+    assert {name: os.path.getmtime(os.path.join(first, name)) for name in os.listdir(first)} == before
+
+
+def test_segmented_index_scores_like_rank_bm25(tmp_path):
+    from rank_bm25 import BM25Okapi
+
+    reference = BM25Okapi([tokenize(doc) for doc in DOCS])
+    index = _uploads(tmp_path, merge=False)
+    assert len(index.snapshot.segments) == 3
+    for merged in (False, True):
+        if merged:
+            assert index.merge_segments() > 0
+            sizes = [segment.num_docs for segment in index.snapshot.segments]
+            assert sizes == sorted(sizes, reverse=True) and len(set(sizes)) == len(sizes)
+        snapshot = index.snapshot
+        assert list(snapshot.corpus) == DOCS
+        for query in ("the cell", "energy of the sea", "cell cell membrane"):
+            expected = reference.get_scores(tokenize(query))
+            assert np.allclose(snapshot.get_scores(tokenize(query)), expected)
+            ids, scores = snapshot.top_k(tokenize(query), 3)
+            assert np.allclose(scores, np.sort(expected)[::-1][:3])
+
+
+def test_reader_process_sees_merged_version(tmp_path):
+    writer = _uploads(tmp_path, merge=False)
+    reader = PersistentBM25Index(str(tmp_path), check_seconds=0)
+    writer.merge_segments()
+    assert reader.snapshot.version == writer.snapshot.version
+    assert list(reader.snapshot.corpus) == DOCS
+
+
+def _random_corpus(seed, num_docs=300, vocab_size=400):
+    # Zipf-like term frequencies, so some terms appear in most documents (negative IDF)
+    rng = np.random.default_rng(seed)
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    weights = 1 / np.arange(1, vocab_size + 1)
+    weights /= weights.sum()
+    return [
+        " ".join(rng.choice(vocab, size=rng.integers(1, 40), p=weights)) for _ in range(num_docs)
+    ], vocab, rng
+
+
+def test_random_corpus_matches_rank_bm25_before_and_after_merge(tmp_path):
+    from rank_bm25 import BM25Okapi
+
+    docs, vocab, rng = _random_corpus(seed=7)
+    reference = BM25Okapi([tokenize(doc) for doc in docs])
+    doc_terms = [set(tokenize(doc)) for doc in docs]
+    queries = [list(rng.choice(vocab, size=rng.integers(1, 6))) + ["unknownword"] for _ in range(30)]
+
+    index = PersistentBM25Index(str(tmp_path), check_seconds=0, merge=False)
+    for start in range(0, len(docs), 37):
+        index.add_documents(docs[start:start + 37])
+    assert len(index.snapshot.segments) > 1
+
+    for merged in (False, True):
+        if merged:
+            assert index.merge_segments() > 0
+        snapshot = index.snapshot
+        for query in queries:
+            expected = reference.get_scores(query)
+            assert np.allclose(snapshot.get_scores(query), expected)
+            # top_k only returns documents containing at least one query term
+            matching = np.array([bool(terms.intersection(query)) for terms in doc_terms])
+            ids, scores = snapshot.top_k(query, 10)
+            assert np.allclose(scores, np.sort(expected[matching])[::-1][:10])
+            assert matching[ids].all() and np.allclose(expected[ids], scores)
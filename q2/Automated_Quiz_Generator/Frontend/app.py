@@ -1,8 +1,11 @@
+import time
+
 import streamlit as st
 import requests
 
 # Backend URL (change if deployed)
 BACKEND_URL = "http://localhost:8000"
+JOB_POLL_TIMEOUT_SECONDS = 30 * 60  # Stop waiting on a job after this long
 
 st.set_page_config(page_title="AI Quiz Generator", layout="centered")
 
@@ -15,16 +18,41 @@ uploaded_file = st.file_uploader("Upload a .pdf, .docx, or .txt file", type=["pd
 
 if uploaded_file:
     if st.button("📤 Upload and Process"):
-        with st.spinner("Uploading and processing document..."):
+        with st.spinner("Uploading document..."):
             response = requests.post(
                 f"{BACKEND_URL}/upload",
                 files={"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
             )
 
-            if response.status_code == 200:
-                st.success("✅ File uploaded and processed successfully!")
+        if response.status_code == 202:
+            # Processing runs in the background: poll the job until it finishes
+            job_url = f"{BACKEND_URL}{response.json()['status_url']}"
+            progress = st.progress(0.0, text="Queued for processing...")
+            deadline = time.monotonic() + JOB_POLL_TIMEOUT_SECONDS
+            job = {}
+            while time.monotonic() < deadline:
+                job_response = requests.get(job_url)
+                if job_response.status_code != 200:
+                    # e.g. 404 once the job is unknown (status file lost or pruned)
+                    job = {"status": "lost", "error": f"job status returned HTTP {job_response.status_code}"}
+                    break
+                job = job_response.json()
+                if job.get("status") in ("done", "failed"):
+                    break
+                progress.progress(job.get("progress") or 0.0, text=f"Processing: {job.get('stage') or 'queued'}...")
+                time.sleep(1)
+
+            if job.get("status") == "done":
+                progress.progress(1.0, text="Done")
+                st.success(f"✅ File uploaded and processed successfully! ({job.get('chunks_total')} chunks)")
+            elif job.get("status") in ("failed", "lost"):
+                st.error(f"❌ Processing failed: {job.get('error')}")
             else:
-                st.error("❌ Upload failed.")
+                st.warning("⏳ Still processing in the background; check back later.")
+        elif response.status_code == 429:
+            st.warning("⏳ Too many documents are being processed, please retry shortly.")
+        else:
+            st.error("❌ Upload failed.")
 
 st.markdown("---")
 